@@ -24,6 +24,7 @@ class ContinuousprintPlugin(
     octoprint.plugin.TemplatePlugin,
     octoprint.plugin.AssetPlugin,
     octoprint.plugin.StartupPlugin,
+    octoprint.plugin.ShutdownPlugin,
     octoprint.plugin.EventHandlerPlugin,
 ):
 
@@ -68,12 +69,21 @@ class ContinuousprintPlugin(
 
         # It's possible to miss events or for some weirdness to occur in conditionals. Adding a watchdog
         # timer with a periodic tick ensures that the driver knows what the state of the printer is.
-        self.watchdog = RepeatedTimer(5.0, self._plugin.tick)
+        # The interval is re-read each tick, as it slows down when the driver is event-driven.
+        self.watchdog = RepeatedTimer(self._plugin.watchdog_interval, self._plugin.tick)
         self.watchdog.start()
         self._logger.info("Continuous Print Plugin started")
 
     # ------------------------ End StartupPlugin ---------------------------
 
+    # ------------------------ Begin ShutdownPlugin ------------------------
+
+    def on_shutdown(self):
+        if hasattr(self, "_plugin"):
+            self._plugin.shutdown()
+
+    # ------------------------ End ShutdownPlugin --------------------------
+
     # ------------------------ Begin EventHandlerPlugin --------------------
 
     def register_custom_events(*args, **kwargs):
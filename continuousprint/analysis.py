@@ -1,10 +1,43 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from octoprint.filemanager.analysis import AbstractAnalysisQueue, AnalysisAborted
-from octoprint.util.platform import CLOSE_FDS
 from octoprint.util import dict_merge
+from .scripts.extract_profile import infer_profile, Cancelled
+from .storage import queries
+
+HASH_CHUNK = 1024 * 1024  # Bytes read at a time when hashing files
+
+
+def content_hash(path, cancel=None):
+    """Returns the hex SHA-256 of the file at `path`, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            if cancel is not None and cancel.is_set():
+                raise Cancelled()
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_infer_profile(path, cancel=None):
+    """Like infer_profile, but consults (and fills) the profile cache keyed on the
+    file's contents. Returns "" if no profile could be inferred."""
+    h = content_hash(path, cancel)
+    profile = queries.getCachedProfile(h)
+    if profile is None:
+        profile = infer_profile(path, cancel=cancel) or ""
+        queries.cacheProfile(h, profile)
+    return profile
 
 
 class CPQProfileAnalysisQueue(AbstractAnalysisQueue):
-    """This queue attempts to resolve the profiles for which a gcode has been created."""
+    """This queue attempts to resolve the profiles for which a gcode has been created.
+
+    Inference runs in-process on the queue's worker thread; the profile candidates
+    are computed once at import, and only the file's header and footer are read.
+    Results are cached by file content, so copies of a file are only inferred once."""
 
     META_KEY = "continuousprint"
     PROFILE_KEY = "profile"
@@ -12,60 +45,100 @@ class CPQProfileAnalysisQueue(AbstractAnalysisQueue):
     def __init__(self, finished_callback):
         AbstractAnalysisQueue.__init__(self, finished_callback)
 
-        self._aborted = False
+        self._aborted = threading.Event()
         self._reenqueue = False
 
     def _do_analysis(self, high_priority=False):
-        import sys
-        import sarge
-
         if self._current.analysis and self._current.analysis.get(self.PROFILE_KEY):
             return self._current.analysis
 
+        path = self._current.absolute_path
+        self._logger.info(f"Inferring profile for {path}")
+        self._aborted.clear()
         try:
-            command = [
-                sys.executable,
-                "-m",
-                "continuousprint.scripts.extract_profile",
-            ]
-            command.append(self._current.absolute_path)
-            self._logger.info("Invoking analysis command: {}".format(" ".join(command)))
-            self._aborted = False
-            p = sarge.run(
-                command, close_fds=CLOSE_FDS, async_=True, stdout=sarge.Capture()
-            )
-
-            while len(p.commands) == 0:
-                time.sleep(0.01)
-            p.commands[0].process_ready.wait()
-
-            if not p.commands[0].process:
-                raise RuntimeError(
-                    "Error while trying to run command {}".format(" ".join(command))
-                )
-
-            try:
-                while p.returncode is None:
-                    if self._aborted:
-                        p.commands[0].terminate()
-                        raise AnalysisAborted(reenqueue=self._reenqueue)
-                    p.commands[0].poll()
-            finally:
-                p.close()
-
-            output = p.stdout.text
-            self._logger.info(f"Got output: {output!r}")
-
-            result = {}
-            result[self.PROFILE_KEY] = output.strip()
-
-            if self._current.analysis and isinstance(self._current.analysis, dict):
-                return dict_merge(result, self._current.analysis)
-            else:
-                return result
-        finally:
-            self._gcode = None
+            profile = cached_infer_profile(path, cancel=self._aborted)
+        except Cancelled:
+            raise AnalysisAborted(reenqueue=self._reenqueue)
+        except OSError as e:
+            raise RuntimeError(f"Error while inferring profile for {path}: {e}")
+        self._logger.info(f"Got profile: {profile!r}")
+
+        result = {}
+        result[self.PROFILE_KEY] = profile or ""
+
+        if self._current.analysis and isinstance(self._current.analysis, dict):
+            return dict_merge(result, self._current.analysis)
+        else:
+            return result
 
     def _do_abort(self, reenqueue=True):
-        self._aborted = True
         self._reenqueue = reenqueue
+        self._aborted.set()
+
+
+class BacklogAnalyzer:
+    """Infers profiles for a backlog of files using a bounded pool of worker threads.
+
+    Entries are processed in the order given, so callers should put important files
+    first. While `is_printing()` is true, workers take turns and pause between files
+    so the print's serial communication isn't starved."""
+
+    PROGRESS_INTERVAL = 30  # Seconds between progress callbacks
+    PRINTING_DELAY = 1.0  # Seconds to pause before each file while printing
+
+    def __init__(self, workers, on_result, on_progress, is_printing, logger):
+        self._workers = max(1, workers)
+        self._on_result = on_result
+        self._on_progress = on_progress
+        self._is_printing = is_printing
+        self._logger = logger
+        self._aborted = threading.Event()
+        self._result_lock = threading.Lock()
+        self._print_lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+        self._last_progress = 0
+
+    def abort(self):
+        self._aborted.set()
+
+    def _analyze(self, entry):
+        if self._aborted.is_set():
+            return
+        if self._is_printing():
+            with self._print_lock:
+                if self._aborted.wait(self.PRINTING_DELAY):
+                    return
+                return self._analyze_one(entry)
+        return self._analyze_one(entry)
+
+    def _analyze_one(self, entry):
+        try:
+            profile = cached_infer_profile(entry.absolute_path, cancel=self._aborted)
+        except Cancelled:
+            return
+        except OSError as e:
+            self._logger.warning(f"Failed to infer profile for {entry.path}: {e}")
+            profile = None
+        with self._result_lock:
+            self._on_result(entry, {CPQProfileAnalysisQueue.PROFILE_KEY: profile or ""})
+            self._done += 1
+            now = time.monotonic()
+            if now - self._last_progress >= self.PROGRESS_INTERVAL:
+                self._last_progress = now
+                self._on_progress(self._done, self._total)
+
+    def run(self, entries):
+        """Analyzes all `entries` (QueueEntry objects), blocking until done or
+        aborted. Returns the number of files analyzed."""
+        self._total = len(entries)
+        self._done = 0
+        self._last_progress = time.monotonic()
+        with ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="cpq_analysis"
+        ) as pool:
+            for f in [pool.submit(self._analyze, e) for e in entries]:
+                f.result()
+        if self._total > 0:
+            self._on_progress(self._done, self._total)
+        return self._done
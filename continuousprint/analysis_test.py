@@ -0,0 +1,166 @@
+import hashlib
+import unittest
+import logging
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+from octoprint.filemanager.analysis import AnalysisAborted, QueueEntry
+from .analysis import CPQProfileAnalysisQueue, BacklogAnalyzer, content_hash
+from .storage import queries
+from .storage.database_test import QueuesDBTest
+
+KIRI_GCODE = "; Generated by Kiri:Moto\n; Target: Creality.CR-30\nG0 X5\n"
+
+
+class TestProfileAnalysisQueue(QueuesDBTest):
+    def setUp(self):
+        super().setUp()
+        self.aq = CPQProfileAnalysisQueue(MagicMock())
+        self.f = tempfile.NamedTemporaryFile(mode="w", suffix=".gcode")
+        self.f.write(KIRI_GCODE)
+        self.f.flush()
+
+    def tearDown(self):
+        self.f.close()
+        super().tearDown()
+
+    def entry(self, analysis=None):
+        return QueueEntry(
+            name="a.gcode",
+            path="a.gcode",
+            type="gcode",
+            location="local",
+            absolute_path=self.f.name,
+            printer_profile=None,
+            analysis=analysis,
+        )
+
+    def testInfersInProcess(self):
+        self.aq._current = self.entry()
+        self.assertEqual(
+            self.aq._do_analysis(),
+            {CPQProfileAnalysisQueue.PROFILE_KEY: "Creality CR30"},
+        )
+
+    def testCachedByContent(self):
+        self.aq._current = self.entry()
+        self.aq._do_analysis()
+        with patch("continuousprint.analysis.infer_profile") as ip:
+            self.assertEqual(
+                self.aq._do_analysis(),
+                {CPQProfileAnalysisQueue.PROFILE_KEY: "Creality CR30"},
+            )
+            ip.assert_not_called()
+        self.assertEqual(
+            queries.getCachedProfile(content_hash(self.f.name)), "Creality CR30"
+        )
+
+    def testExistingAnalysisMerged(self):
+        self.aq._current = self.entry(analysis=dict(foo="bar"))
+        self.assertEqual(
+            self.aq._do_analysis(),
+            {CPQProfileAnalysisQueue.PROFILE_KEY: "Creality CR30", "foo": "bar"},
+        )
+
+    def testExistingProfileSkipsInference(self):
+        a = {CPQProfileAnalysisQueue.PROFILE_KEY: "asdf"}
+        self.aq._current = self.entry(analysis=a)
+        self.assertEqual(self.aq._do_analysis(), a)
+
+    def testAbort(self):
+        self.aq._current = self.entry()
+        self.aq._aborted.clear = MagicMock()  # Simulate abort arriving mid-analysis
+        self.aq._do_abort(reenqueue=False)
+        with self.assertRaises(AnalysisAborted) as cm:
+            self.aq._do_analysis()
+        self.assertFalse(cm.exception.reenqueue)
+
+    def testMissingFileRaisesRuntimeError(self):
+        self.aq._current = self.entry()
+        self.f.close()
+        with self.assertRaises(RuntimeError):
+            self.aq._do_analysis()
+
+
+class TestBacklogAnalyzer(QueuesDBTest):
+    def setUp(self):
+        super().setUp()
+        self.td = tempfile.TemporaryDirectory()
+        self.entries = []
+        for i in range(10):
+            path = f"{self.td.name}/{i}.gcode"
+            with open(path, "w") as f:
+                f.write(KIRI_GCODE if i % 2 == 0 else "G0 X5\n")
+            self.entries.append(
+                QueueEntry(
+                    f"{i}.gcode", f"{i}.gcode", "gcode", "local", path, None, None
+                )
+            )
+        self.results = dict()
+        self.on_progress = MagicMock()
+        self.printing = False
+
+    def tearDown(self):
+        self.td.cleanup()
+        super().tearDown()
+
+    def analyzer(self, workers=4):
+        def on_result(entry, result):
+            self.results[entry.path] = result[CPQProfileAnalysisQueue.PROFILE_KEY]
+
+        return BacklogAnalyzer(
+            workers,
+            on_result,
+            self.on_progress,
+            lambda: self.printing,
+            logging.getLogger(),
+        )
+
+    def testRun(self):
+        self.assertEqual(self.analyzer().run(self.entries), 10)
+        self.assertEqual(self.results["0.gcode"], "Creality CR30")
+        self.assertEqual(self.results["1.gcode"], "")
+        self.on_progress.assert_called_once_with(10, 10)
+
+    def testMissingFile(self):
+        self.entries[0] = self.entries[0]._replace(absolute_path="/nonexistent")
+        self.assertEqual(self.analyzer().run(self.entries), 10)
+        self.assertEqual(self.results["0.gcode"], "")
+
+    def testThrottledWhilePrinting(self):
+        self.printing = True
+        a = self.analyzer()
+        a.PRINTING_DELAY = 0
+        lock = threading.Lock()
+        active = [0]
+        peak = [0]
+
+        def infer(path, cancel=None):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return None
+
+        with patch("continuousprint.analysis.infer_profile", side_effect=infer):
+            self.assertEqual(a.run(self.entries), 10)
+        self.assertEqual(peak[0], 1)
+
+    def testAborted(self):
+        a = self.analyzer()
+        a.abort()
+        self.assertEqual(a.run(self.entries), 0)
+        self.assertEqual(self.results, dict())
+
+
+class TestContentHash(unittest.TestCase):
+    def testChunked(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(b"a" * 1000)
+            f.flush()
+            with patch("continuousprint.analysis.HASH_CHUNK", 7):
+                h = content_hash(f.name)
+        self.assertEqual(h, hashlib.sha256(b"a" * 1000).hexdigest())
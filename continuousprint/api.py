@@ -100,17 +100,29 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
         pass
 
     @abstractmethod
-    def _history_json(self) -> str:
+    def _history_json(self, **filters) -> str:
+        pass
+
+    @abstractmethod
+    def _history_row(self, run) -> dict:
         pass
 
     @abstractmethod
     def _state_json(self) -> str:
         pass
 
+    @abstractmethod
+    def _state_delta(self) -> dict:
+        pass  # Changes to state since it was last synced, or None if unchanged
+
     @abstractmethod
     def _commit_queues(self, added, removed):
         pass
 
+    @abstractmethod
+    def _on_queue_edited(self):
+        pass  # Called after jobs or sets are added, changed or removed
+
     @abstractmethod
     def _get_queue(self, name):
         pass
@@ -135,6 +147,14 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
     def _set_external_symbols(self, data):
         pass
 
+    @abstractmethod
+    def _update_timing_dict(self) -> dict:
+        pass  # Timing of driver updates (ticks and events), in milliseconds
+
+    @abstractmethod
+    def _metrics_text(self) -> str:
+        pass  # Metrics in the Prometheus text exposition format
+
     def popup(self, msg, type="popup"):
         return self._msg(dict(type=type, msg=msg))
 
@@ -145,10 +165,19 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
         self._msg(msg)
 
     def _sync_state(self):
-        return self._sync("state", self._state_json())
-
-    def _sync_history(self):
-        return self._sync("history", self._history_json())
+        # Only changes are pushed; clients that fall out of step re-fetch the full
+        # state via /state/get.
+        delta = self._state_delta()
+        if delta is not None:
+            return self._sync("statedelta", delta)
+
+    def _sync_history(self, run=None):
+        # When a specific run changed, only its row is pushed
+        if run is None:
+            return self._sync("history", self._history_json())
+        row = self._history_row(run)
+        if row is not None:
+            return self._sync("historyrow", row)
 
     # Public method - returns the full state of the plugin in JSON format.
     # See `_state_json()` for return values.
@@ -160,6 +189,23 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
     def get_state(self):
         return self._state_json()
 
+    # PRIVATE API METHOD - may change without warning.
+    @octoprint.plugin.BlueprintPlugin.route("/state/timing", methods=["GET"])
+    @restricted_access
+    @cpq_permission(Permission.GETSTATE)
+    def get_state_timing(self):
+        return json.dumps(self._update_timing_dict())
+
+    # PRIVATE API METHOD - may change without warning.
+    # Scrapers can authenticate by passing an API key, e.g. /metrics?apikey=...
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    @restricted_access
+    @cpq_permission(Permission.GETSTATE)
+    def get_metrics(self):
+        return flask.Response(
+            self._metrics_text(), mimetype="text/plain; version=0.0.4"
+        )
+
     # Public method - enables/disables management and returns the current state
     # IMPORTANT: Non-additive changes to this method MUST be done via MAJOR version bump
     # (e.g. 1.4.1 -> 2.0.0)
@@ -189,7 +235,9 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
         jid = data.get("job")
         if jid is None:
             jid = ""
-        return json.dumps(self._get_queue(DEFAULT_QUEUE).add_set(jid, data))
+        result = self._get_queue(DEFAULT_QUEUE).add_set(jid, data)
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/add", methods=["POST"])
@@ -197,9 +245,26 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
     @cpq_permission(Permission.ADDJOB)
     def add_job(self):
         data = json.loads(flask.request.form.get("json"))
-        return json.dumps(
-            self._get_queue(DEFAULT_QUEUE).add_job(data.get("name")).as_dict()
-        )
+        result = self._get_queue(DEFAULT_QUEUE).add_job(data.get("name")).as_dict()
+        self._on_queue_edited()
+        return json.dumps(result)
+
+    # PRIVATE API METHOD - may change without warning.
+    # Adds many jobs (each with a list of sets) in a single transaction.
+    @octoprint.plugin.BlueprintPlugin.route("/job/bulk_add", methods=["POST"])
+    @restricted_access
+    @cpq_permission(Permission.ADDJOB)
+    def bulk_add_job(self):
+        data = json.loads(flask.request.form.get("json"))
+        q = self._get_queue(data.get("queue", DEFAULT_QUEUE))
+        if getattr(q, "add_jobs", None) is None:
+            return json.dumps(dict(error="Jobs can only be bulk added to local queues"))
+        jobs = data["jobs"]
+        for j in jobs:
+            j["sets"] = [self._preprocess_set(s) for s in j.get("sets", [])]
+        result = q.add_jobs(jobs)
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/mv", methods=["POST"])
@@ -221,11 +286,30 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
                 return json.dumps(dict(error=str(e)))
             sq.remove_jobs([src_id])
             src_id = new_id
+            self._on_queue_edited()
 
         # Finally, move the job
         dq.mv_job(src_id, after_id)
         return json.dumps("OK")
 
+    # PRIVATE API METHOD - may change without warning.
+    @octoprint.plugin.BlueprintPlugin.route("/job/reorder", methods=["POST"])
+    @restricted_access
+    @cpq_permission(Permission.EDITJOB)
+    def reorder_jobs(self):
+        # Moves several jobs within a queue at once; listing every job in the
+        # queue with no after_id sets the full ordering.
+        data = json.loads(flask.request.form.get("json"))
+        q = self._get_queue(data["queue"])
+        after_id = data.get("after_id")
+        if after_id == "":
+            after_id = None  # Front of the queue, as for a missing after_id
+        try:
+            q.mv_jobs(data["job_ids"], after_id)
+        except ValueError as e:
+            return json.dumps(dict(error=str(e)))
+        return json.dumps("OK")
+
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/edit", methods=["POST"])
     @restricted_access
@@ -233,18 +317,22 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
     def edit_job(self):
         data = json.loads(flask.request.form.get("json"))
         q = self._get_queue(data["queue"])
-        return json.dumps(q.edit_job(data["id"], data))
+        result = q.edit_job(data["id"], data)
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/import", methods=["POST"])
     @restricted_access
     @cpq_permission(Permission.ADDJOB)
     def import_job(self):
-        return json.dumps(
+        result = (
             self._get_queue(flask.request.form["queue"])
             .import_job(flask.request.form["path"])
             .as_dict()
         )
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/export", methods=["POST"])
@@ -272,29 +360,61 @@ class ContinuousPrintAPI(ABC, octoprint.plugin.BlueprintPlugin):
     @restricted_access
     @cpq_permission(Permission.RMJOB)
     def rm_job(self):
-        return json.dumps(
-            self._get_queue(flask.request.form["queue"]).remove_jobs(
-                flask.request.form.getlist("job_ids[]")
-            )
+        result = self._get_queue(flask.request.form["queue"]).remove_jobs(
+            flask.request.form.getlist("job_ids[]")
         )
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/job/reset", methods=["POST"])
     @restricted_access
     @cpq_permission(Permission.EDITJOB)
     def reset_multi(self):
-        return json.dumps(
-            self._get_queue(flask.request.form["queue"]).reset_jobs(
-                flask.request.form.getlist("job_ids[]")
-            )
+        result = self._get_queue(flask.request.form["queue"]).reset_jobs(
+            flask.request.form.getlist("job_ids[]")
         )
+        self._on_queue_edited()
+        return json.dumps(result)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/history/get", methods=["GET"])
     @restricted_access
     @cpq_permission(Permission.GETHISTORY)
     def get_history(self):
-        return self._history_json()
+        # Paginate by passing the run_id of the last returned row as `before`
+        args = flask.request.args
+        filters = dict()
+        # An empty or invalid cursor (e.g. `before=` from a blank form field) just
+        # fetches the first page
+        before = args.get("before", "")
+        if before.isdigit():
+            filters["before"] = int(before)
+        try:
+            for k in ("limit", "since", "until"):
+                if args.get(k) is not None:
+                    filters[k] = int(args[k])
+        except ValueError:
+            return flask.make_response(f"Invalid integer value for {k}", 400)
+        for k in ("queue", "job", "result"):
+            if args.get(k) is not None:
+                filters[k] = args[k]
+        return self._history_json(**filters)
+
+    # PRIVATE API METHOD - may change without warning.
+    @octoprint.plugin.BlueprintPlugin.route("/history/stats", methods=["GET"])
+    @restricted_access
+    @cpq_permission(Permission.GETHISTORY)
+    def get_history_stats(self):
+        args = flask.request.args
+        filters = dict(group=args.get("group", "path"), queue=args.get("queue"))
+        try:
+            for k in ("since", "until"):
+                if args.get(k) is not None:
+                    filters[k] = int(args[k])
+            return json.dumps(queries.getHistoryStats(**filters))
+        except ValueError as e:
+            return flask.make_response(str(e), 400)
 
     # PRIVATE API METHOD - may change without warning.
     @octoprint.plugin.BlueprintPlugin.route("/history/reset", methods=["POST"])
@@ -63,6 +63,7 @@ class TestAPI(unittest.TestCase):
         self.api._basefolder = "notexisty"
         self.api._identifier = "continuousprint"
         self.api._get_queue = MagicMock()
+        self.api._on_queue_edited = MagicMock()
         self.api._logger = logging.getLogger()
         self.app.register_blueprint(self.api.get_blueprint())
         self.app.config.update({"TESTING": True})
@@ -71,16 +72,21 @@ class TestAPI(unittest.TestCase):
     def test_role_access_denied(self):
         testcases = [
             ("GETSTATE", "/state/get"),
+            ("GETSTATE", "/state/timing"),
+            ("GETSTATE", "/metrics"),
             ("STARTSTOP", "/set_active"),
             ("ADDSET", "/set/add"),
             ("ADDJOB", "/job/add"),
+            ("ADDJOB", "/job/bulk_add"),
             ("EDITJOB", "/job/mv"),
+            ("EDITJOB", "/job/reorder"),
             ("EDITJOB", "/job/edit"),
             ("ADDJOB", "/job/import"),
             ("EXPORTJOB", "/job/export"),
             ("RMJOB", "/job/rm"),
             ("EDITJOB", "/job/reset"),
             ("GETHISTORY", "/history/get"),
+            ("GETHISTORY", "/history/stats"),
             ("RESETHISTORY", "/history/reset"),
             ("GETQUEUES", "/queues/get"),
             ("EDITQUEUES", "/queues/edit"),
@@ -89,6 +95,7 @@ class TestAPI(unittest.TestCase):
             ("EDITAUTOMATION", "/automation/external"),
         ]
         self.api._get_queue = None  # MagicMock interferes with checking
+        self.api._on_queue_edited = None
 
         num_handlers_tested = len(set([tc[1] for tc in testcases]))
         handlers = [
@@ -118,6 +125,21 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.assertEqual(rep.data, b"foo")
 
+    def test_get_state_timing(self):
+        self.perm.PLUGIN_CONTINUOUSPRINT_GETSTATE.can.return_value = True
+        self.api._update_timing_dict = lambda: dict(count=1)
+        rep = self.client.get("/state/timing")
+        self.assertEqual(rep.status_code, 200)
+        self.assertEqual(json.loads(rep.data), dict(count=1))
+
+    def test_get_metrics(self):
+        self.perm.PLUGIN_CONTINUOUSPRINT_GETSTATE.can.return_value = True
+        self.api._metrics_text = lambda: "continuousprint_foo 1\n"
+        rep = self.client.get("/metrics")
+        self.assertEqual(rep.status_code, 200)
+        self.assertEqual(rep.mimetype, "text/plain")
+        self.assertEqual(rep.data, b"continuousprint_foo 1\n")
+
     def test_set_active(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_STARTSTOP.can.return_value = True
         self.api._update = MagicMock()
@@ -152,6 +174,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.assertEqual(rep.get_data(as_text=True), '"ret"')
         self.api._get_queue().add_set.assert_called_with("jid", data)
+        self.api._on_queue_edited.assert_called_once()
 
     def test_add_job(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_ADDJOB.can.return_value = True
@@ -164,6 +187,25 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.get_data(as_text=True), '"ret"')
         self.api._get_queue().add_job.assert_called_with("jobname")
 
+    def test_bulk_add_job(self):
+        self.perm.PLUGIN_CONTINUOUSPRINT_ADDJOB.can.return_value = True
+        data = dict(
+            jobs=[dict(name="j1", sets=[dict(path="a.gcode")]), dict(name="j2")]
+        )
+        self.api._get_queue().add_jobs.return_value = "ret"
+        self.api._preprocess_set = lambda s: dict(s, profiles=["p"])
+
+        rep = self.client.post("/job/bulk_add", data=dict(json=json.dumps(data)))
+
+        self.assertEqual(rep.status_code, 200)
+        self.assertEqual(rep.get_data(as_text=True), '"ret"')
+        self.api._get_queue().add_jobs.assert_called_with(
+            [
+                dict(name="j1", sets=[dict(path="a.gcode", profiles=["p"])]),
+                dict(name="j2", sets=[]),
+            ]
+        )
+
     def test_mv_job(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_EDITJOB.can.return_value = True
         data = dict(id="foo", after_id="bar", src_queue="q1", dest_queue="q2")
@@ -173,6 +215,23 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.api._get_queue().mv_job.assert_called_with(data["id"], data["after_id"])
 
+    def test_reorder_jobs(self):
+        self.perm.PLUGIN_CONTINUOUSPRINT_EDITJOB.can.return_value = True
+        data = dict(queue="q1", job_ids=[3, 1], after_id=2)
+        rep = self.client.post("/job/reorder", data=dict(json=json.dumps(data)))
+        self.assertEqual(rep.status_code, 200)
+        self.assertEqual(json.loads(rep.data), "OK")
+        self.api._get_queue.assert_called_with("q1")
+        self.api._get_queue().mv_jobs.assert_called_with([3, 1], 2)
+
+        data["after_id"] = ""
+        rep = self.client.post("/job/reorder", data=dict(json=json.dumps(data)))
+        self.api._get_queue().mv_jobs.assert_called_with([3, 1], None)
+
+        self.api._get_queue().mv_jobs.side_effect = ValueError("bad")
+        rep = self.client.post("/job/reorder", data=dict(json=json.dumps(data)))
+        self.assertEqual(json.loads(rep.data), dict(error="bad"))
+
     def test_edit_job(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_EDITJOB.can.return_value = True
         data = dict(id="foo", queue="queue")
@@ -220,6 +279,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.assertEqual(rep.get_data(as_text=True), '"ret"')
         self.api._get_queue().remove_jobs.assert_called_with(data["job_ids[]"])
+        self.api._on_queue_edited.assert_called_once()
 
     def test_reset_multi(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_EDITJOB.can.return_value = True
@@ -231,6 +291,7 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.assertEqual(rep.get_data(as_text=True), '"ret"')
         self.api._get_queue().reset_jobs.assert_called_with(data["job_ids[]"])
+        self.api._on_queue_edited.assert_called_once()
 
     def test_get_history(self):
         self.perm.PLUGIN_CONTINUOUSPRINT_GETHISTORY.can.return_value = True
@@ -239,6 +300,35 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(rep.status_code, 200)
         self.assertEqual(rep.data, b"foo")
 
+    def test_get_history_paginated(self):
+        self.perm.PLUGIN_CONTINUOUSPRINT_GETHISTORY.can.return_value = True
+        self.api._history_json = MagicMock(return_value="foo")
+        rep = self.client.get("/history/get?before=5&limit=10&job=j1&since=100")
+        self.assertEqual(rep.status_code, 200)
+        self.api._history_json.assert_called_with(
+            before=5, limit=10, job="j1", since=100
+        )
+
+        for before in ("", "abc"):
+            rep = self.client.get(f"/history/get?before={before}&limit=10")
+            self.assertEqual(rep.status_code, 200)
+            self.api._history_json.assert_called_with(limit=10)
+
+        rep = self.client.get("/history/get?limit=abc")
+        self.assertEqual(rep.status_code, 400)
+
+    @patch("continuousprint.api.queries")
+    def test_get_history_stats(self, q):
+        self.perm.PLUGIN_CONTINUOUSPRINT_GETHISTORY.can.return_value = True
+        q.getHistoryStats.return_value = [dict(key="a.gcode", runs=1)]
+        rep = self.client.get("/history/stats?group=day&since=100")
+        self.assertEqual(rep.status_code, 200)
+        self.assertEqual(json.loads(rep.data), [dict(key="a.gcode", runs=1)])
+        q.getHistoryStats.assert_called_with(group="day", queue=None, since=100)
+
+        rep = self.client.get("/history/stats?until=abc")
+        self.assertEqual(rep.status_code, 400)
+
     @patch("continuousprint.api.queries")
     def test_reset_history(self, q):
         self.perm.PLUGIN_CONTINUOUSPRINT_RESETHISTORY.can.return_value = True
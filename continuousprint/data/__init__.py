@@ -96,7 +96,28 @@ class Keys(Enum):
         "do_nothing",
     )  # One of "do_nothing", "add_draft", "add_printable"
     INFER_PROFILE = ("cp_infer_profile", True)
+    # Worker threads used to infer profiles for a backlog of files; 1 analyzes
+    # them one at a time in the background analysis queue
+    ANALYSIS_WORKERS = ("cp_analysis_workers", 2)
     AUTO_RECONNECT = ("cp_auto_reconnect", False)
+    SYNC_WINDOW_MS = ("cp_sync_window_ms", 250)
+    # Wake the driver at its own deadlines and on printer events, keeping the
+    # periodic watchdog tick only as a slow safety net
+    EVENT_DRIVEN = ("cp_event_driven", False)
+    # Download the next LAN job while printing, at up to this many KiB/s (0 for
+    # no limit)
+    PREFETCH_LAN = ("cp_prefetch_lan", True)
+    PREFETCH_RATE_KBPS = ("cp_prefetch_rate_kbps", 1024)
+    STORAGE_PROFILE = (
+        "cp_storage_profile",
+        "balanced",
+    )  # One of "legacy", "durable", "balanced"
+    # Retention limits on history and archived jobs; 0 keeps everything
+    RETENTION_RUN_DAYS = ("cp_retention_run_days", 0)
+    RETENTION_MAX_RUNS = ("cp_retention_max_runs", 0)
+    RETENTION_ARCHIVE_DAYS = ("cp_retention_archive_days", 0)
+    RETENTION_MAX_ARCHIVED = ("cp_retention_max_archived_jobs", 0)
+    RETENTION_EXPORT = ("cp_retention_export", True)
 
     def __init__(self, setting, default):
         self.setting = setting
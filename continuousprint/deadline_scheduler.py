@@ -0,0 +1,49 @@
+import time
+from .worker import Worker
+
+
+class DeadlineScheduler(Worker):
+    """Calls `fn` on a background thread as soon as a scheduled deadline passes.
+
+    Only one deadline is pending at a time: scheduling replaces it if the new
+    deadline is earlier and is ignored otherwise. `fn` is expected to schedule the
+    next deadline itself, so repeated requests (e.g. a poll interval re-requested on
+    every tick) never pile up into parallel chains of wakeups."""
+
+    def __init__(self, fn, logger):
+        super().__init__("Deadline handler", logger, ("scheduled", "fired"))
+        self._fn = fn
+        self._deadline = None
+        self._start()
+
+    def schedule(self, deadline):
+        with self._cv:
+            if self._deadline is not None and self._deadline <= deadline:
+                return
+            self._deadline = deadline
+            self._count("scheduled")
+            self._cv.notify_all()
+
+    def pending(self):
+        with self._cv:
+            return self._deadline
+
+    def _has_work(self):
+        return self._deadline is not None
+
+    def _ready(self):
+        return self._deadline is not None and self._deadline <= time.time()
+
+    def _timeout(self):
+        if self._deadline is None:
+            return None
+        return max(0, self._deadline - time.time())
+
+    def _take(self):
+        self._deadline = None
+
+    def _work(self, item):
+        self._fn()
+
+    def _finished(self, item, result):
+        self._count("fired")
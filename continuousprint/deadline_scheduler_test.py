@@ -0,0 +1,46 @@
+import unittest
+import threading
+import time
+import logging
+from unittest.mock import MagicMock
+from .deadline_scheduler import DeadlineScheduler
+
+
+class TestDeadlineScheduler(unittest.TestCase):
+    def setUp(self):
+        self.called = threading.Event()
+        self.fn = MagicMock(side_effect=lambda: self.called.set())
+        self.s = DeadlineScheduler(self.fn, logging.getLogger())
+        self.addCleanup(self.s.stop)
+
+    def testFiresAtDeadline(self):
+        start = time.time()
+        self.s.schedule(start + 0.1)
+        self.assertTrue(self.called.wait(5))
+        self.assertGreaterEqual(time.time(), start + 0.1)
+        self.assertTrue(self.s.wait_idle(timeout=5))
+        self.assertEqual(self.s.counters(), dict(scheduled=1, fired=1))
+
+    def testEarlierDeadlineWakesSooner(self):
+        now = time.time()
+        self.s.schedule(now + 60)
+        self.s.schedule(now)
+        self.assertTrue(self.called.wait(5))
+        self.assertEqual(self.s.pending(), None)  # Replaced by the earlier deadline
+
+    def testLaterDeadlineIgnored(self):
+        now = time.time()
+        self.s.schedule(now + 60)
+        self.s.schedule(now + 120)
+        self.assertEqual(self.s.pending(), now + 60)
+        self.assertEqual(self.s.counters(), dict(scheduled=1, fired=0))
+
+    def testPassedDeadlinesCoalesce(self):
+        self.fn.side_effect = lambda: time.sleep(0.1)
+        now = time.time()
+        self.s.schedule(now)
+        time.sleep(0.05)  # First call is running
+        for i in range(5):
+            self.s.schedule(now + 0.01 * i + 0.01)  # Later ones are ignored
+        self.assertTrue(self.s.wait_idle(timeout=5))
+        self.assertEqual(self.s.counters(), dict(scheduled=2, fired=2))
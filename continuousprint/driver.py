@@ -2,6 +2,7 @@ import time
 from multiprocessing import Lock
 from enum import Enum, auto
 from .data import CustomEvents
+from .metrics import DriverMetrics, state_name
 
 
 class Action(Enum):
@@ -40,20 +41,29 @@ class Driver:
     # If the printer is idle for this long while printing, break out of the printing state (consider it a failure)
     PRINTING_IDLE_BREAKOUT_SEC = 15.0
     TIMELAPSE_WAIT_SEC = 30
+    # How often to re-check the bed temperature while cooling down, and to retry a
+    # failed print start, when ticks are scheduled by deadline
+    COOLDOWN_POLL_SEC = 5.0
+    START_RETRY_SEC = 5.0
+    # Margin added to deadlines so the strict comparisons in the states have passed
+    DEADLINE_SLACK_SEC = 0.05
 
     def __init__(
         self,
         queue,
         script_runner,
         logger,
+        metrics=None,
     ):
         self.mutex = Lock()
+        self.metrics = metrics if metrics is not None else DriverMetrics()
         self._logger = logger
         self.status = None
         self.status_type = StatusType.NORMAL
         self._set_status("Initializing")
         self.q = queue
         self.state = self._state_unknown
+        self.state_ts = time.time()
         self.last_printer_state = None
         self.printer_state_ts = 0
         self.printer_state_logs_suppressed = False
@@ -62,6 +72,7 @@ class Driver:
         self.max_retries = 0
         self.retry_threshold_seconds = 0
         self.max_startup_attempts = 3
+        self.start_failures = 0
         self.managed_cooldown = False
         self.cooldown_threshold = 0
         self.cooldown_timeout = 0
@@ -72,6 +83,7 @@ class Driver:
         self._cur_materials = []
         self._bed_temp = 0
         self._timelapse_start_ts = None
+        self._advanced = False
 
     def action(
         self,
@@ -124,9 +136,21 @@ class Driver:
             else:
                 nxt = self.state(a, p)
 
+            self._advanced = nxt is not None
             if nxt is not None:
                 self._logger.info(f"{self.state.__name__} -> {nxt.__name__}")
+                self.metrics.transition(
+                    state_name(self.state),
+                    state_name(nxt),
+                    a.name,
+                    now - self.state_ts,
+                    now,
+                )
+                if nxt in (self._state_idle, self._state_inactive):
+                    # Covers the queue finishing, going idle and being stopped
+                    self.metrics.queue_stopped()
                 self.state = nxt
+                self.state_ts = now
                 self._update_ui = True
 
             if self._update_ui:
@@ -134,6 +158,48 @@ class Driver:
                 return True
             return False
 
+    def next_deadline(self):
+        # Returns the time.time() at which a TICK may next advance the state machine
+        # without any other event occurring, or None if only an event can advance it.
+        with self.mutex:
+            now = time.time()
+            if self._advanced:
+                # Several states only act on the following action; run it right away
+                return now
+            if self.state == self._state_success and self._timelapse_start_ts:
+                return (
+                    self._timelapse_start_ts
+                    + self.TIMELAPSE_WAIT_SEC
+                    + self.DEADLINE_SLACK_SEC
+                )
+            if self.state == self._state_cooldown:
+                return min(
+                    self.cooldown_start
+                    + 60 * self.cooldown_timeout
+                    + self.DEADLINE_SLACK_SEC,
+                    now + self.COOLDOWN_POLL_SEC,
+                )
+            if self.state == self._state_start_print and self.start_failures > 0:
+                return now + self.START_RETRY_SEC
+            if (
+                self.state
+                in (
+                    self._state_activating,
+                    self._state_preprint,
+                    self._state_printing,
+                    self._state_paused,
+                    self._state_clearing,
+                    self._state_finishing,
+                )
+                and self.last_printer_state == Printer.IDLE
+            ):
+                return (
+                    self.printer_state_ts
+                    + self.PRINTING_IDLE_BREAKOUT_SEC
+                    + self.DEADLINE_SLACK_SEC
+                )
+            return None
+
     def _state_unknown(self, a: Action, p: Printer):
         pass
 
@@ -243,6 +309,7 @@ class Driver:
 
         self.q.begin_run()
         if self._runner.start_print(item):
+            self.metrics.print_started(time.time())
             return self._state_printing
         else:
             # TODO bail out of the job and mark it as bad rather than dropping into inactive state
@@ -282,6 +349,7 @@ class Driver:
             # If idle state without event, assume we somehow missed the SUCCESS action.
             # We wait for a period of idleness to prevent idle-before-success events
             # from double-completing prints.
+            self.metrics.print_done(time.time())
             item = self.q.get_set()
 
             # A limitation of `octoprint.printer`, the "current file" path passed to the driver is only
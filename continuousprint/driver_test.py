@@ -344,6 +344,121 @@ class TestFromStartPrint(unittest.TestCase):
         self.d.q.end_run.assert_not_called()
 
 
+class TestNextDeadline(unittest.TestCase):
+    def setUp(self):
+        self.d = Driver(
+            queue=MagicMock(),
+            script_runner=MagicMock(),
+            logger=logging.getLogger(),
+        )
+        item = MagicMock(path="asdf")
+        self.d.q.get_set_or_acquire.return_value = item
+        self.d.q.get_set.return_value = item
+        self.d._runner.run_script_for_event.return_value = None
+        self.d.action(DA.DEACTIVATE, DP.IDLE)
+        self.d.action(DA.ACTIVATE, DP.BUSY)  # -> printing
+        self.d.action(DA.TICK, DP.BUSY)
+
+    def test_none_while_printing(self):
+        self.assertEqual(self.d.next_deadline(), None)
+
+    def test_immediate_after_transition(self):
+        now = time.time()
+        self.d.action(DA.SUCCESS, DP.IDLE, path="asdf")  # -> success
+        self.assertGreaterEqual(self.d.next_deadline(), now)
+        self.assertLess(self.d.next_deadline(), now + 1)
+
+    def test_idle_breakout(self):
+        self.d.action(DA.TICK, DP.IDLE)
+        self.assertEqual(
+            self.d.next_deadline(),
+            self.d.printer_state_ts
+            + Driver.PRINTING_IDLE_BREAKOUT_SEC
+            + Driver.DEADLINE_SLACK_SEC,
+        )
+
+    def test_idle_breakout_deadline_advances_state(self):
+        self.d.action(DA.TICK, DP.IDLE)
+        self.d.printer_state_ts -= Driver.PRINTING_IDLE_BREAKOUT_SEC + 1
+        self.assertLess(self.d.next_deadline(), time.time())
+        self.d.action(DA.TICK, DP.IDLE, path="asdf")  # -> success
+        self.assertEqual(self.d.state.__name__, self.d._state_success.__name__)
+
+    def test_timelapse_wait(self):
+        now = time.time()
+        self.d.action(DA.SUCCESS, DP.IDLE, path="asdf", timelapse_start_ts=now)
+        self.d.action(DA.TICK, DP.IDLE, timelapse_start_ts=now)  # -> still success
+        self.assertEqual(
+            self.d.next_deadline(),
+            now + Driver.TIMELAPSE_WAIT_SEC + Driver.DEADLINE_SLACK_SEC,
+        )
+
+    def test_cooldown(self):
+        self.d.set_managed_cooldown(True, 20, 60)
+        self.d.state = self.d._state_start_clearing
+        self.d.action(DA.TICK, DP.IDLE, bed_temp=21)  # -> cooldown
+        self.d.action(DA.TICK, DP.IDLE, bed_temp=21)
+        deadline = self.d.next_deadline()
+        self.assertLessEqual(deadline, time.time() + Driver.COOLDOWN_POLL_SEC)
+        self.assertGreater(deadline, time.time())
+
+        self.d.cooldown_start -= 60 * 61
+        self.assertLess(self.d.next_deadline(), time.time())
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.d = Driver(
+            queue=MagicMock(),
+            script_runner=MagicMock(),
+            logger=logging.getLogger(),
+        )
+        item = MagicMock(path="asdf")
+        self.d.q.get_set_or_acquire.return_value = item
+        self.d.q.get_set.return_value = item
+        self.d._runner.run_script_for_event.return_value = None
+        self.d.action(DA.DEACTIVATE, DP.IDLE)
+        self.d.action(DA.ACTIVATE, DP.IDLE)  # -> start_print -> printing
+
+    def test_transitions_recorded(self):
+        self.assertEqual(
+            self.d.metrics.transitions,
+            {("unknown", "inactive"): 1, ("inactive", "printing"): 1},
+        )
+        trace = self.d.metrics.recent_transitions()
+        self.assertEqual(trace[-1]["action"], "ACTIVATE")
+        self.assertEqual(self.d.metrics.dwell["inactive"].count, 1)
+
+    def test_print_gap(self):
+        self.d.action(DA.SUCCESS, DP.IDLE, path="asdf")  # -> success
+        self.d.action(DA.TICK, DP.IDLE)  # -> start_clearing
+        self.d.action(DA.TICK, DP.IDLE)  # -> clearing
+        self.assertEqual(self.d.metrics.print_gap.count, 0)
+        self.d.action(DA.SUCCESS, DP.IDLE)  # -> start_print -> printing
+        self.assertEqual(self.d.state.__name__, self.d._state_printing.__name__)
+        self.assertEqual(self.d.metrics.print_gap.count, 1)
+
+    def test_no_print_gap_across_idle(self):
+        self.d.action(DA.SUCCESS, DP.IDLE, path="asdf")  # -> success
+        self.d.action(DA.TICK, DP.IDLE)  # -> start_clearing
+        self.d.action(DA.TICK, DP.IDLE)  # -> clearing
+        self.d.q.get_set_or_acquire.return_value = None
+        self.d.action(DA.SUCCESS, DP.IDLE)  # -> idle; queue finished
+        self.assertEqual(self.d.state.__name__, self.d._state_idle.__name__)
+
+        self.d.q.get_set_or_acquire.return_value = MagicMock(path="asdf")
+        self.d.action(DA.TICK, DP.IDLE)  # -> start_print -> printing
+        self.assertEqual(self.d.state.__name__, self.d._state_printing.__name__)
+        self.assertEqual(self.d.metrics.print_gap.count, 0)
+
+    def test_no_print_gap_across_deactivation(self):
+        self.d.action(DA.SUCCESS, DP.IDLE, path="asdf")  # -> success
+        self.d.action(DA.DEACTIVATE, DP.IDLE)  # -> inactive
+        self.d.action(DA.ACTIVATE, DP.IDLE)  # -> start_print -> printing
+        self.assertEqual(self.d.state.__name__, self.d._state_printing.__name__)
+        self.assertEqual(self.d.metrics.print_gap.count, 0)
+
+
 class TestMaterialConstraints(unittest.TestCase):
     def setUp(self):
         self.d = Driver(
@@ -0,0 +1,158 @@
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from pathlib import Path
+from peerprint.filesharing import Fileshare, FileshareServer, unpack_job
+
+
+class _Prefetch:
+    def __init__(self, rate):
+        self.rate = rate  # Bytes/sec, 0 for unlimited; may be lifted mid-transfer
+        self.done = threading.Event()
+        self.result = None
+
+
+class CountingFileshare(Fileshare):
+    """Fileshare which counts the bytes of job files served to LAN peers, and can
+    fetch jobs ahead of time at a limited rate."""
+
+    PREFETCH_CHUNK = 64 * 1024
+    PREFETCH_TIMEOUT = 30  # Seconds to wait on the peer's fileshare server
+    PREFETCH_WAIT_SLICE = 0.1
+
+    def __init__(self, addr, basedir, logger):
+        super().__init__(addr, basedir, logger)
+        self.httpd = None
+        self._lock = threading.Lock()
+        self._prefetching = dict()  # hash -> _Prefetch in progress
+        self._fetching = set()
+        self.bytes_served = 0
+
+    def _served(self, n):
+        with self._lock:
+            self.bytes_served += n
+
+    def connect(self, testing=False):
+        if testing:
+            return
+        basedir = self.basedir
+        served = self._served
+
+        class CountingRequestHandler(http.server.SimpleHTTPRequestHandler):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, directory=basedir, **kwargs)
+
+            def copyfile(self, source, outputfile):
+                super().copyfile(source, outputfile)
+                served(source.tell())
+
+            def log_message(self, format, *args):
+                pass  # Keep per-request lines out of OctoPrint's log
+
+        # As Fileshare.connect(), whose request handler is defined inline and so
+        # can't be extended to count bytes
+        self.httpd = FileshareServer((self.host, self.port), CountingRequestHandler)
+        self.httpd.allow_reuse_address = True
+        self.t = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.t.start()
+
+        # Re-assign host & port since some formats (e.g. *:0) auto-assign
+        (self.host, self.port) = self.httpd.socket.getsockname()
+
+        self._logger.info(f"Fileshare listening on {self.host}:{self.port}")
+
+    def _download(self, url, dest, cancel, job):
+        # Streams url to dest at no more than `job.rate` bytes/sec (0 is unlimited).
+        # Returns False, leaving nothing at dest, if cancelled.
+        part = dest.with_suffix(".part")
+        try:
+            with requests.get(url, stream=True, timeout=self.PREFETCH_TIMEOUT) as r:
+                r.raise_for_status()
+                start = time.monotonic()
+                n = 0
+                with open(part, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=self.PREFETCH_CHUNK):
+                        if cancel.is_set():
+                            return False
+                        f.write(chunk)
+                        n += len(chunk)
+                        # Waits in short slices so a lifted limit applies promptly
+                        while job.rate > 0:
+                            ahead = n / job.rate - (time.monotonic() - start)
+                            if ahead <= 0:
+                                break
+                            if cancel.wait(min(ahead, self.PREFETCH_WAIT_SLICE)):
+                                return False
+            os.replace(part, dest)
+            return True
+        finally:
+            part.unlink(missing_ok=True)
+
+    def fetch(self, peer: str, hash_: str, unpack=False, overwrite=False):
+        # If the job is already being prefetched, finish that transfer at full speed
+        # and use it, rather than downloading the same job alongside it.
+        with self._lock:
+            job = self._prefetching.get(hash_)
+            self._fetching.add(hash_)
+        try:
+            if job is not None and not overwrite:
+                self._logger.info(f"Waiting on in-progress prefetch of {hash_}")
+                job.rate = 0
+                job.done.wait()
+                if job.result is not None:
+                    return (
+                        job.result if unpack else Path(self.basedir) / f"{hash_}.gjob"
+                    )
+            return super().fetch(peer, hash_, unpack=unpack, overwrite=overwrite)
+        finally:
+            with self._lock:
+                self._fetching.discard(hash_)
+
+    def prefetch(self, peer: str, hash_: str, cancel, rate=0):
+        """Fetches and unpacks a job like fetch(peer, hash_, unpack=True), but at a
+        limited rate and stopping early if `cancel` (a threading.Event) is set.
+
+        Partial downloads are never left where fetch() would treat them as cached,
+        and a fetch() of the same job waits on this one instead of racing it.
+        Returns the unpacked directory, or None if cancelled or already being
+        fetched."""
+        job = _Prefetch(rate)
+        with self._lock:
+            if hash_ in self._fetching or hash_ in self._prefetching:
+                return None
+            self._prefetching[hash_] = job
+        try:
+            job.result = self._prefetch(peer, hash_, cancel, job)
+            return job.result
+        finally:
+            with self._lock:
+                del self._prefetching[hash_]
+            job.done.set()
+
+    def _prefetch(self, peer, hash_, cancel, job):
+        dest = Path(self.basedir) / f"{hash_}.gjob"
+        dest_dir = Path(self.basedir) / hash_
+        if dest_dir.exists():
+            return dest_dir
+        if not dest.exists():
+            self._logger.debug(f"Prefetching {hash_} from {peer}")
+            if not self._download(f"http://{peer}/{dest.name}", dest, cancel, job):
+                return None
+
+        # The suffix keeps fileshare cleanup from removing this while unpacking
+        tmp = tempfile.mkdtemp(
+            prefix=f"{hash_}-", suffix=".unpacking", dir=self.basedir
+        )
+        try:
+            unpack_job(dest, tmp)
+            os.rename(tmp, dest_dir)
+        except OSError:
+            if not dest_dir.exists():  # Not just fetched by someone else meanwhile
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return dest_dir
@@ -0,0 +1,127 @@
+import unittest
+import logging
+import tempfile
+import time
+import threading
+import urllib.request
+from pathlib import Path
+from peerprint.filesharing import pack_job
+from .fileshare import CountingFileshare
+
+
+class TestCountingFileshare(unittest.TestCase):
+    def setUp(self):
+        td = tempfile.TemporaryDirectory()
+        self.addCleanup(td.cleanup)
+        self.dir = Path(td.name)
+        (self.dir / "abc.gjob").write_bytes(b"x" * 1000)
+        self.fs = CountingFileshare("127.0.0.1:0", td.name, logging.getLogger())
+        try:
+            with self.assertLogs(level="INFO") as logs:
+                self.fs.connect()
+        except OSError as e:
+            self.skipTest(f"Cannot bind fileshare: {e}")
+        self.addCleanup(self.fs.destroy)
+        self.assertIn(
+            f"Fileshare listening on 127.0.0.1:{self.fs.port}", logs.output[0]
+        )
+
+    def test_counts_bytes_served(self):
+        for i in range(2):
+            with urllib.request.urlopen(
+                f"http://{self.fs.host}:{self.fs.port}/abc.gjob"
+            ) as r:
+                self.assertEqual(len(r.read()), 1000)
+        # The server thread counts after the response has been written
+        deadline = time.time() + 5
+        while self.fs.bytes_served < 2000 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.fs.bytes_served, 2000)
+
+    def test_missing_file_not_counted(self):
+        with self.assertRaises(Exception):
+            urllib.request.urlopen(f"http://{self.fs.host}:{self.fs.port}/nope.gjob")
+        self.assertEqual(self.fs.bytes_served, 0)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.dirs = []
+        for i in range(2):
+            td = tempfile.TemporaryDirectory()
+            self.addCleanup(td.cleanup)
+            self.dirs.append(Path(td.name))
+        src, dst = self.dirs
+
+        gcode = src / "a.gcode"
+        gcode.write_text("G0 X1\n" * 1000)
+        pack_job(
+            dict(name="j", sets=[dict(path="a.gcode", count=1)]),
+            {"a.gcode": str(gcode)},
+            str(src / "h1.gjob"),
+        )
+        self.size = (src / "h1.gjob").stat().st_size
+
+        self.server = CountingFileshare("127.0.0.1:0", str(src), logging.getLogger())
+        try:
+            self.server.connect()
+        except OSError as e:
+            self.skipTest(f"Cannot bind fileshare: {e}")
+        self.addCleanup(self.server.destroy)
+        self.peer = f"{self.server.host}:{self.server.port}"
+        self.fs = CountingFileshare("127.0.0.1:0", str(dst), logging.getLogger())
+
+    def test_prefetch_unpacks_like_fetch(self):
+        cancel = threading.Event()
+        start = time.monotonic()
+        got = self.fs.prefetch(self.peer, "h1", cancel, rate=self.size * 4)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)  # Rate limited
+        self.assertEqual(got, self.dirs[1] / "h1")
+        self.assertTrue((got / "a.gcode").exists())
+        self.assertEqual(self.fs.fetch(self.peer, "h1", unpack=True), got)
+        self.assertEqual(
+            sorted(p.name for p in self.dirs[1].iterdir()), ["h1", "h1.gjob"]
+        )
+
+    def test_prefetch_cancelled(self):
+        cancel = threading.Event()
+        cancel.set()
+        self.assertIsNone(self.fs.prefetch(self.peer, "h1", cancel))
+        self.assertEqual(list(self.dirs[1].iterdir()), [])
+
+    def test_prefetch_unpacks_existing_gjob(self):
+        (self.dirs[1] / "h1.gjob").write_bytes((self.dirs[0] / "h1.gjob").read_bytes())
+        got = self.fs.prefetch("unreachable:1", "h1", threading.Event())
+        self.assertTrue((got / "a.gcode").exists())
+
+    def test_fetch_waits_on_inflight_prefetch(self):
+        cancel = threading.Event()
+        got = []
+        t = threading.Thread(
+            target=lambda: got.append(self.fs.prefetch(self.peer, "h1", cancel, rate=1))
+        )
+        t.start()
+        self.addCleanup(t.join, 5)
+        self.addCleanup(cancel.set)
+        deadline = time.time() + 5
+        while "h1" not in self.fs._prefetching and time.time() < deadline:
+            time.sleep(0.01)
+
+        # Lifts the rate limit on the prefetch and reuses it instead of
+        # downloading the job a second time
+        start = time.monotonic()
+        self.assertEqual(
+            self.fs.fetch(self.peer, "h1", unpack=True), self.dirs[1] / "h1"
+        )
+        self.assertLess(time.monotonic() - start, 5)
+        t.join(5)
+        self.assertEqual(got, [self.dirs[1] / "h1"])
+        deadline = time.time() + 5
+        while self.server.bytes_served < self.size and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.bytes_served, self.size)
+
+    def test_prefetch_skipped_while_fetching(self):
+        self.fs._fetching.add("h1")
+        self.assertIsNone(self.fs.prefetch(self.peer, "h1", threading.Event()))
+        self.assertEqual(list(self.dirs[1].iterdir()), [])
@@ -32,7 +32,7 @@ class IntegrationTest(DBTest):
     def setUp(self):
         super().setUp()
 
-        def onupdate():
+        def onupdate(run=None):
             pass
 
         self.lq = self.newQueue()
@@ -183,7 +183,7 @@ class TestDriver(DBTest):
     def setUp(self):
         super().setUp()
 
-        def onupdate():
+        def onupdate(run=None):
             pass
 
         self.fm = MagicMock()
@@ -272,7 +272,7 @@ class TestLANQueue(IntegrationTest):
     """A simple in-memory integration test between DB storage layer, queuing layer, and driver."""
 
     def newQueue(self):
-        def onupdate():
+        def onupdate(run=None):
             pass
 
         lq = LANQueue(
@@ -339,7 +339,7 @@ class TestMultiDriverLANQueue(unittest.TestCase):
         NPEERS = 2
         self.dbs = [SqliteDatabase(":memory:") for i in range(NPEERS)]
 
-        def onupdate():
+        def onupdate(run=None):
             pass
 
         self.locks = {}
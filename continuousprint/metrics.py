@@ -0,0 +1,243 @@
+import threading
+from bisect import bisect_left
+from collections import Counter, deque
+
+PREFIX = "continuousprint"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(
+        '{}="{}"'.format(
+            k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for k, v in labels.items()
+    )
+    return "{" + inner + "}"
+
+
+def _fmt(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def header(name, kind, desc) -> list:
+    return [f"# HELP {PREFIX}_{name} {desc}", f"# TYPE {PREFIX}_{name} {kind}"]
+
+
+def sample(name, value, **labels) -> str:
+    return f"{PREFIX}_{name}{_labels(labels)} {_fmt(value)}"
+
+
+def render_worker_counters(workers: dict) -> list:
+    """Renders the `counters()` of background workers, keyed by worker name, so
+    e.g. sync requests can be compared with the syncs actually emitted."""
+    lines = header(
+        "worker_events_total", "counter", "Events counted by background workers"
+    )
+    for worker, counters in sorted(workers.items()):
+        for event, n in sorted(counters.items()):
+            lines.append(sample("worker_events_total", n, worker=worker, event=event))
+    return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram; memory use does not grow with observations."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v):
+        self.counts[bisect_left(self.buckets, v)] += 1
+        self.sum += v
+        self.count += 1
+
+    def render(self, name, **labels) -> list:
+        lines = []
+        cum = 0
+        for le, n in zip(self.buckets + ("+Inf",), self.counts):
+            cum += n
+            lines.append(sample(f"{name}_bucket", cum, **labels, le=le))
+        lines.append(sample(f"{name}_sum", self.sum, **labels))
+        lines.append(sample(f"{name}_count", self.count, **labels))
+        return lines
+
+
+def state_name(state) -> str:
+    name = state.__name__
+    return name[len("_state_") :] if name.startswith("_state_") else name
+
+
+class DriverMetrics:
+    """Instrumentation for the driver state machine and the scripts it runs.
+
+    Histograms have fixed buckets and recent transitions are kept in a ring buffer
+    of TRACE_SIZE entries, so memory use stays constant however long we run."""
+
+    TRACE_SIZE = 256
+    DWELL_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+    PRINT_GAP_BUCKETS = (5, 10, 15, 20, 30, 60, 120, 300, 600, 1800)
+    SCRIPT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.transitions = Counter()
+        self.dwell = dict()
+        self.print_gap = Histogram(self.PRINT_GAP_BUCKETS)
+        self.script_latency = dict()
+        self.trace = deque(maxlen=self.TRACE_SIZE)
+        self._print_done_ts = None
+
+    def transition(self, src, dst, action, dwell, now):
+        with self._lock:
+            self.transitions[(src, dst)] += 1
+            h = self.dwell.get(src)
+            if h is None:
+                h = self.dwell[src] = Histogram(self.DWELL_BUCKETS)
+            h.observe(dwell)
+            self.trace.append(
+                dict(ts=now, src=src, dst=dst, action=action, dwell=dwell)
+            )
+
+    def print_done(self, now):
+        with self._lock:
+            self._print_done_ts = now
+
+    def queue_stopped(self):
+        # Time spent idle or inactive isn't a gap between prints
+        with self._lock:
+            self._print_done_ts = None
+
+    def print_started(self, now):
+        # Records the printer time lost between one print and the next
+        with self._lock:
+            if self._print_done_ts is not None:
+                self.print_gap.observe(now - self._print_done_ts)
+                self._print_done_ts = None
+
+    def script_run(self, event, seconds):
+        with self._lock:
+            h = self.script_latency.get(event)
+            if h is None:
+                h = self.script_latency[event] = Histogram(self.SCRIPT_BUCKETS)
+            h.observe(seconds)
+
+    def recent_transitions(self) -> list:
+        with self._lock:
+            return list(self.trace)
+
+    def render(self) -> list:
+        with self._lock:
+            lines = header(
+                "driver_transitions_total", "counter", "Driver state transitions"
+            )
+            for (src, dst), n in sorted(self.transitions.items()):
+                lines.append(sample("driver_transitions_total", n, src=src, dst=dst))
+
+            lines += header(
+                "driver_state_dwell_seconds",
+                "histogram",
+                "Time spent in a driver state before leaving it",
+            )
+            for state, h in sorted(self.dwell.items()):
+                lines += h.render("driver_state_dwell_seconds", state=state)
+
+            lines += header(
+                "driver_print_gap_seconds",
+                "histogram",
+                "Time from a print finishing to the next print starting",
+            )
+            lines += self.print_gap.render("driver_print_gap_seconds")
+
+            lines += header(
+                "script_run_seconds",
+                "histogram",
+                "Time taken to generate and submit an event's gcode script",
+            )
+            for event, h in sorted(self.script_latency.items()):
+                lines += h.render("script_run_seconds", event=event)
+            return lines
+
+
+class QueueMetrics:
+    """Queue depth and throughput, cached between scrapes.
+
+    `count_remaining()` and `run_totals()` are only called again after the cached
+    values are invalidated by queue edits or runs beginning/ending. Completed
+    prints decrement the cached remaining count in place."""
+
+    def __init__(self, count_remaining, run_totals):
+        self._count_remaining = count_remaining
+        self._run_totals = run_totals
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._runs = None
+
+    def invalidate_remaining(self):
+        with self._lock:
+            self._remaining = None
+
+    def invalidate_runs(self):
+        with self._lock:
+            self._runs = None
+
+    def decremented(self, queue):
+        with self._lock:
+            if self._remaining is not None and self._remaining.get(queue, 0) > 0:
+                self._remaining[queue] -= 1
+
+    def remaining(self) -> dict:
+        with self._lock:
+            if self._remaining is None:
+                self._remaining = dict(self._count_remaining())
+            return dict(self._remaining)
+
+    def runs(self) -> list:
+        with self._lock:
+            if self._runs is None:
+                self._runs = list(self._run_totals())
+            return list(self._runs)
+
+    def render(self, peers: dict, bytes_served) -> list:
+        lines = header(
+            "queue_remaining_prints",
+            "gauge",
+            "Set prints left in each queue's non-draft jobs",
+        )
+        for queue, n in sorted(self.remaining().items()):
+            lines.append(sample("queue_remaining_prints", n, queue=queue))
+
+        runs = self.runs()
+        lines += header("runs_total", "counter", "Finished runs by result")
+        for (queue, result, n, _) in runs:
+            lines.append(sample("runs_total", n, queue=queue, result=result))
+        lines += header(
+            "run_duration_seconds_mean",
+            "gauge",
+            "Mean duration of finished runs by result",
+        )
+        for (queue, result, n, seconds) in runs:
+            if n:
+                lines.append(
+                    sample(
+                        "run_duration_seconds_mean",
+                        float(seconds / n),
+                        queue=queue,
+                        result=result,
+                    )
+                )
+
+        lines += header("lan_peers", "gauge", "Peers seen in each LAN queue")
+        for queue, n in sorted(peers.items()):
+            lines.append(sample("lan_peers", n, queue=queue))
+
+        lines += header(
+            "fileshare_served_bytes_total",
+            "counter",
+            "Bytes of job files served to LAN peers",
+        )
+        lines.append(sample("fileshare_served_bytes_total", bytes_served))
+        return lines
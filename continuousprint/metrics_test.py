@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import MagicMock
+from .metrics import Histogram, DriverMetrics, QueueMetrics, sample, state_name
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe_and_render(self):
+        h = Histogram((1, 5))
+        for v in (0.5, 1, 3, 10):
+            h.observe(v)
+        self.assertEqual(
+            h.render("x", state="a"),
+            [
+                'continuousprint_x_bucket{state="a",le="1"} 2',
+                'continuousprint_x_bucket{state="a",le="5"} 3',
+                'continuousprint_x_bucket{state="a",le="+Inf"} 4',
+                'continuousprint_x_sum{state="a"} 14.5',
+                'continuousprint_x_count{state="a"} 4',
+            ],
+        )
+
+
+class TestDriverMetrics(unittest.TestCase):
+    def setUp(self):
+        self.m = DriverMetrics()
+
+    def test_sample_escapes_labels(self):
+        self.assertEqual(
+            sample("y", 1, path='a"b'), 'continuousprint_y{path="a\\"b"} 1'
+        )
+
+    def test_state_name(self):
+        def _state_start_clearing():
+            pass
+
+        self.assertEqual(state_name(_state_start_clearing), "start_clearing")
+
+    def test_trace_is_bounded(self):
+        for i in range(DriverMetrics.TRACE_SIZE + 10):
+            self.m.transition("a", "b", "TICK", 1.0, i)
+        trace = self.m.recent_transitions()
+        self.assertEqual(len(trace), DriverMetrics.TRACE_SIZE)
+        self.assertEqual(trace[0]["ts"], 10)
+        self.assertEqual(self.m.transitions[("a", "b")], DriverMetrics.TRACE_SIZE + 10)
+
+    def test_print_gap_requires_print_done(self):
+        self.m.print_started(100)
+        self.assertEqual(self.m.print_gap.count, 0)
+        self.m.print_done(100)
+        self.m.print_started(112)
+        self.m.print_started(200)  # Not preceded by another print
+        self.assertEqual(self.m.print_gap.count, 1)
+        self.assertEqual(self.m.print_gap.sum, 12)
+
+    def test_print_gap_cleared_when_queue_stops(self):
+        self.m.print_done(100)
+        self.m.queue_stopped()
+        self.m.print_started(50000)
+        self.assertEqual(self.m.print_gap.count, 0)
+
+    def test_render(self):
+        self.m.transition("printing", "success", "SUCCESS", 20.0, 100)
+        self.m.script_run("FINISH", 0.02)
+        text = "\n".join(self.m.render())
+        self.assertIn(
+            'continuousprint_driver_transitions_total{src="printing",dst="success"} 1',
+            text,
+        )
+        self.assertIn(
+            'continuousprint_driver_state_dwell_seconds_count{state="printing"} 1',
+            text,
+        )
+        self.assertIn(
+            'continuousprint_script_run_seconds_count{event="FINISH"} 1', text
+        )
+        self.assertIn("# TYPE continuousprint_driver_print_gap_seconds histogram", text)
+
+
+class TestQueueMetrics(unittest.TestCase):
+    def setUp(self):
+        self.count = MagicMock(return_value=dict(q1=3, LAN=0))
+        self.totals = MagicMock(
+            return_value=[("q1", "success", 2, 100.0), ("q1", "failure", 1, 5.0)]
+        )
+        self.m = QueueMetrics(self.count, self.totals)
+
+    def test_remaining_cached_until_invalidated(self):
+        self.assertEqual(self.m.remaining(), dict(q1=3, LAN=0))
+        self.m.decremented("q1")
+        self.m.decremented("LAN")  # Never goes negative
+        self.assertEqual(self.m.remaining(), dict(q1=2, LAN=0))
+        self.count.assert_called_once()
+
+        self.m.invalidate_remaining()
+        self.assertEqual(self.m.remaining(), dict(q1=3, LAN=0))
+        self.assertEqual(self.count.call_count, 2)
+
+    def test_runs_cached_until_invalidated(self):
+        self.m.runs()
+        self.m.runs()
+        self.totals.assert_called_once()
+        self.m.invalidate_runs()
+        self.m.runs()
+        self.assertEqual(self.totals.call_count, 2)
+
+    def test_render(self):
+        text = "\n".join(self.m.render(dict(LAN=2), 1234))
+        for want in (
+            'continuousprint_queue_remaining_prints{queue="q1"} 3',
+            'continuousprint_runs_total{queue="q1",result="failure"} 1',
+            'continuousprint_run_duration_seconds_mean{queue="q1",result="success"} 50.0',
+            'continuousprint_lan_peers{queue="LAN"} 2',
+            "continuousprint_fileshare_served_bytes_total 1234",
+        ):
+            self.assertIn(want, text)
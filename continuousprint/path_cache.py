@@ -0,0 +1,47 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+
+class PathExistsCache:
+    """Caches whether paths exist on disk, to avoid repeated stat calls on slow storage.
+
+    Entries are dropped via `invalidate()` when file events arrive, and otherwise expire
+    after `ttl` seconds in case files change without an event (e.g. via ssh)."""
+
+    def __init__(self, ttl, clock=time.monotonic):
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = dict()  # path -> (exists, expiry)
+        self._generation = 0
+
+    def exists(self, path: str) -> bool:
+        now = self._clock()
+        with self._lock:
+            e = self._entries.get(path)
+            if e is not None and e[1] > now:
+                return e[0]
+            gen = self._generation
+
+        result = Path(path).exists()
+        with self._lock:
+            # Don't cache a result that may have been invalidated while we were checking
+            if gen == self._generation:
+                self._entries[path] = (result, now + self._ttl)
+        return result
+
+    def invalidate(self, path: str):
+        """Drops `path` and anything beneath it (if it's a folder) from the cache"""
+        prefix = path.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._generation += 1
+            for k in list(self._entries.keys()):
+                if k == path or k.startswith(prefix):
+                    del self._entries[k]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries = dict()
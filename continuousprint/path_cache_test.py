@@ -0,0 +1,40 @@
+import unittest
+import tempfile
+import os
+from unittest.mock import MagicMock
+from .path_cache import PathExistsCache
+
+
+class TestPathExistsCache(unittest.TestCase):
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+        self.now = 0
+        self.c = PathExistsCache(ttl=10, clock=lambda: self.now)
+        self.path = os.path.join(self.td.name, "a.gcode")
+
+    def testCachedUntilInvalidated(self):
+        self.assertEqual(self.c.exists(self.path), False)
+        open(self.path, "w").close()
+        self.assertEqual(self.c.exists(self.path), False)  # Stale
+        self.c.invalidate(self.path)
+        self.assertEqual(self.c.exists(self.path), True)
+
+    def testExpiresAfterTTL(self):
+        self.assertEqual(self.c.exists(self.path), False)
+        open(self.path, "w").close()
+        self.now = 11
+        self.assertEqual(self.c.exists(self.path), True)
+
+    def testInvalidateFolder(self):
+        self.assertEqual(self.c.exists(self.path), False)
+        open(self.path, "w").close()
+        self.c.invalidate(self.td.name)
+        self.assertEqual(self.c.exists(self.path), True)
+
+    def testInvalidateDoesNotMatchSiblingPrefix(self):
+        other = self.path + "x"
+        self.assertEqual(self.c.exists(other), False)
+        open(other, "w").close()
+        self.c.invalidate(self.path)
+        self.assertEqual(self.c.exists(other), False)  # Still cached
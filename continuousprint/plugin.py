@@ -14,8 +14,7 @@ from octoprint.filemanager.analysis import AnalysisQueue, QueueEntry
 from octoprint.filemanager.destinations import FileDestinations
 import octoprint.timelapse
 
-from peerprint.filesharing import Fileshare
-from .analysis import CPQProfileAnalysisQueue
+from .analysis import CPQProfileAnalysisQueue, BacklogAnalyzer
 from .driver import Driver, Action as DA, Printer as DP
 from .queues.lan import LANQueue
 from .queues.multi import MultiQueue
@@ -25,6 +24,9 @@ from .storage.database import (
     migrateFromSettings,
     migrateScriptsFromSettings,
     init_db,
+    optimize_db,
+    compact_db,
+    DB,
     DEFAULT_QUEUE,
     ARCHIVE_QUEUE,
 )
@@ -35,8 +37,16 @@ from .data import (
     TEMP_FILE_DIR,
     PRINT_FILE_DIR,
 )
+from .storage.retention import applyRetention
 from .api import ContinuousPrintAPI
 from .script_runner import ScriptRunner
+from .state_tracker import StateTracker
+from .sync_scheduler import SyncScheduler
+from .deadline_scheduler import DeadlineScheduler
+from .metrics import DriverMetrics, QueueMetrics, render_worker_counters
+from .fileshare import CountingFileshare
+from .prefetch import GjobPrefetcher
+from .path_cache import PathExistsCache
 
 
 class CPQPlugin(ContinuousPrintAPI):
@@ -52,6 +62,17 @@ class CPQPlugin(ContinuousPrintAPI):
     MAX_WINDOW_EXP = 6
     GET_ADDR_TIMEOUT = 3
     CPQ_ANALYSIS_FINISHED = "CPQ_ANALYSIS_FINISHED"
+    PATH_CACHE_TTL = 30.0
+    MAINTENANCE_INTERVAL = 24 * 60 * 60
+    # Keeps the first maintenance run clear of startup and the first queue loads
+    MAINTENANCE_STARTUP_DELAY = 10 * 60
+    # Seconds between watchdog ticks; the slow interval is a safety net used when
+    # the driver is woken by deadlines and printer events instead
+    WATCHDOG_INTERVAL = 5.0
+    WATCHDOG_SLOW_INTERVAL = 30.0
+    # Driver updates slower than this are logged as warnings
+    SLOW_UPDATE_SEC = 0.5
+    ARCHIVE_EXPORT_DIR = "archives"
 
     def __init__(
         self,
@@ -81,18 +102,61 @@ class CPQPlugin(ContinuousPrintAPI):
         self._fire_event = fire_event
         self._exceptions = []
         self._timelapse_start_ts = None
+        self._state_tracker = StateTracker()
+        self._sync_scheduler = None
+        self._deadline_scheduler = None
+        self._queue_metrics = None
+        self._prefetcher = None
+        # Inputs to _update() which only change on specific events; None means the
+        # value must be re-read
+        self._materials = None
+        self._update_timing = dict(count=0, total_ms=0.0, max_ms=0.0, last_ms=0.0)
+        self._path_cache = PathExistsCache(self.PATH_CACHE_TTL)
+        self._next_maintenance = None  # Set on the first tick
+        self._backlog_analyzer = None
 
     def start(self):
         self._setup_thirdparty_plugin_integration()
         self._init_db()
         self._init_fileshare()
         self._init_queues()
+        self._init_sync_scheduler()
         self._init_driver()
+        self._init_deadline_scheduler()
+        self._init_prefetcher()
         self._init_analysis_queue()
 
+    def shutdown(self):
+        if self._backlog_analyzer is not None:
+            self._backlog_analyzer.abort()
+        if self._deadline_scheduler is not None:
+            self._deadline_scheduler.stop()
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+        if self._sync_scheduler is not None:
+            self._sync_scheduler.stop()
+
+    def watchdog_interval(self):
+        if self._get_key(Keys.EVENT_DRIVEN, False):
+            return self.WATCHDOG_SLOW_INTERVAL
+        return self.WATCHDOG_INTERVAL
+
     def _on_queue_update(self, q, now=time.time()):
+        self._on_queue_edited()
         self._sync_state()
 
+    def _on_queue_edited(self):
+        # Prints completed here are decremented in place by MultiQueue; anything
+        # else that changes the queues needs a fresh count
+        if self._queue_metrics is not None:
+            self._queue_metrics.invalidate_remaining()
+
+    def _sync_state(self):
+        # Coalesce bursts of sync requests (e.g. LAN queue gossip) into a single push
+        if self._sync_scheduler is None:
+            return super()._sync_state()
+        self._sync_scheduler.request()
+
     def _on_settings_updated(self):
         self.d.set_retry_on_pause(
             self._get_key(Keys.RESTART_ON_PAUSE, False),
@@ -207,6 +271,7 @@ class CPQPlugin(ContinuousPrintAPI):
                     )
                 ),
             )
+            self._on_queue_edited()
             self._sync_state()
 
     def _preprocess_set(self, data):
@@ -293,7 +358,7 @@ class CPQPlugin(ContinuousPrintAPI):
             octoprint.events.Events, "PLUGIN__SPOOLMANAGER_SPOOL_DESELECTED", None
         )
 
-    def _init_fileshare(self, fs_cls=Fileshare):
+    def _init_fileshare(self, fs_cls=CountingFileshare):
         # Note: fileshare_dir referenced when cleaning up old files
         self.fileshare_dir = self._path_on_disk(
             f"{PRINT_FILE_DIR}/fileshare/", sd=False
@@ -324,6 +389,7 @@ class CPQPlugin(ContinuousPrintAPI):
             queues_db=Path(self._data_folder) / "queue.sqlite3",
             automation_db=Path(self._data_folder) / "automation.sqlite3",
             logger=self._logger,
+            storage_profile=self._get_key(Keys.STORAGE_PROFILE),
         )
 
         # Migrate from old JSON state if needed
@@ -363,8 +429,14 @@ class CPQPlugin(ContinuousPrintAPI):
         self._printer_profile = PRINTER_PROFILES.get(
             self._get_key(Keys.PRINTER_PROFILE)
         )
+        self._queue_metrics = QueueMetrics(
+            self._count_remaining_prints, self._queries.getRunTotals
+        )
         self.q = MultiQueue(
-            self._queries, Strategy.IN_ORDER, self._sync_history
+            self._queries,
+            Strategy.IN_ORDER,
+            self._sync_history,
+            metrics=self._queue_metrics,
         )  # TODO set strategy for this and all other queue creations
         for q in self._queries.getQueues():
             if q.addr is not None:
@@ -396,10 +468,54 @@ class CPQPlugin(ContinuousPrintAPI):
                         self._printer_profile,
                         self._path_on_disk,
                         self._add_folder,
+                        self._path_cache,
                     ),
                 )
 
+    def _init_sync_scheduler(self, cls=SyncScheduler):
+        self._sync_scheduler = cls(
+            super()._sync_state,
+            int(self._get_key(Keys.SYNC_WINDOW_MS, 0)) / 1000,
+            self._logger,
+        )
+
+    def _init_deadline_scheduler(self, cls=DeadlineScheduler):
+        self._deadline_scheduler = cls(self._on_deadline, self._logger)
+
+    def _on_deadline(self):
+        self._update(DA.TICK)
+
+    def _schedule_deadline(self):
+        if self._deadline_scheduler is None or not self._get_key(
+            Keys.EVENT_DRIVEN, False
+        ):
+            return
+        deadline = self.d.next_deadline()
+        if deadline is not None:
+            self._deadline_scheduler.schedule(deadline)
+
+    def _init_prefetcher(self, cls=GjobPrefetcher):
+        if self._fileshare is None or not hasattr(self._fileshare, "prefetch"):
+            return
+        self._prefetcher = cls(self._fileshare, self._logger)
+
+    def _prefetch_next(self, p):
+        # Starts fetching the next LAN job while printing, so it's ready once the
+        # bed is cleared. Predictions are refreshed on each tick.
+        if self._prefetcher is None or p != DP.BUSY:
+            return
+        target = None
+        if self._get_key(Keys.PREFETCH_LAN, True):
+            for q in self.q.queues.values():
+                if hasattr(q, "next_gjob"):
+                    target = q.next_gjob()
+                    if target is not None:
+                        break
+        rate = int(self._get_key(Keys.PREFETCH_RATE_KBPS, 0)) * 1024
+        self._prefetcher.want(target, rate)
+
     def _init_driver(self, srcls=ScriptRunner, dcls=Driver):
+        metrics = DriverMetrics()
         self._runner = srcls(
             self.popup,
             self._file_manager,
@@ -407,11 +523,13 @@ class CPQPlugin(ContinuousPrintAPI):
             self._printer,
             self._sync_state,
             self._fire_event,
+            metrics=metrics,
         )
         self.d = dcls(
             queue=self.q,
             script_runner=self._runner,
             logger=self._logger,
+            metrics=metrics,
         )
         self._update(DA.DEACTIVATE)  # Initializes and passes printer state
         self._on_settings_updated()
@@ -485,20 +603,66 @@ class CPQPlugin(ContinuousPrintAPI):
         # This loosely follows FileManager._determine_analysis_backlog to push un-analyzed files onto our custom AnalysisQueue - see
         # https://github.com/OctoPrint/OctoPrint/blob/f430257d7072a83692fc2392c683ed8c97ae47b6/src/octoprint/filemanager/__init__.py#L301
         self._logger.debug("Searching files for backlogged CPQ analysis")
-        counter = 0
         file_list = self._file_manager.list_files(destinations=FileDestinations.LOCAL)[
             FileDestinations.LOCAL
         ]
-        for path in self._backlog_from_file_list(file_list):
-            if self._enqueue(path):
-                counter += 1
-        if counter > 0:
-            self._logger.info(f"Enqueued {counter} files for CPQ analysis")
+        backlog = [
+            p
+            for p in self._backlog_from_file_list(file_list)
+            if not p.startswith(TEMP_FILE_DIR)
+        ]
+        if len(backlog) == 0:
+            return
 
-    def _enqueue(self, path, high_priority=False):
-        if path.startswith(TEMP_FILE_DIR):
-            return False  # Exclude temp files from analysis
-        queue_entry = QueueEntry(
+        # Files already in a queue are analyzed first, so their profiles are
+        # available before the queue reaches them
+        queued = self._queries.getQueuedSetPaths()
+        backlog.sort(key=lambda p: p not in queued)
+
+        workers = int(self._get_key(Keys.ANALYSIS_WORKERS, 1))
+        if workers <= 1:
+            counter = 0
+            for path in backlog:
+                if self._enqueue(path, high_priority=(path in queued)):
+                    counter += 1
+            if counter > 0:
+                self._logger.info(f"Enqueued {counter} files for CPQ analysis")
+            return
+
+        self._logger.info(
+            f"Analyzing {len(backlog)} files for CPQ analysis with {workers} workers"
+        )
+        self._backlog_analyzer = BacklogAnalyzer(
+            workers,
+            on_result=self._on_analysis_finished,
+            on_progress=self._on_backlog_progress,
+            is_printing=lambda: self._printer.is_printing()
+            or self._printer.is_paused(),
+            logger=self._logger,
+        )
+        # The start and end of the scan are shown as popups; periodic progress is
+        # shown in the queue tab
+        self._msg(
+            dict(
+                msg=f"Assigning printer profiles to {len(backlog)} files",
+                type="popup",
+            )
+        )
+        done = self._backlog_analyzer.run([self._queue_entry(p) for p in backlog])
+        self._sync("backlog", None)
+        self._msg(
+            dict(
+                msg=f"Assigned printer profiles for {done} of {len(backlog)} files",
+                type="popup",
+            )
+        )
+
+    def _on_backlog_progress(self, done, total):
+        self._logger.info(f"Assigned printer profiles for {done} of {total} files")
+        self._sync("backlog", dict(done=done, total=total))
+
+    def _queue_entry(self, path):
+        return QueueEntry(
             name=path.split("/")[-1],
             path=path,
             type="gcode",
@@ -507,7 +671,13 @@ class CPQPlugin(ContinuousPrintAPI):
             printer_profile=None,  # self._printer_profile_manager.get_default(),
             analysis=None,
         )
-        return self._analysis_queue.enqueue(queue_entry, high_priority=high_priority)
+
+    def _enqueue(self, path, high_priority=False):
+        if path.startswith(TEMP_FILE_DIR):
+            return False  # Exclude temp files from analysis
+        return self._analysis_queue.enqueue(
+            self._queue_entry(path), high_priority=high_priority
+        )
 
     def _on_analysis_finished(self, entry, result):
         self._file_manager.set_additional_metadata(
@@ -526,6 +696,8 @@ class CPQPlugin(ContinuousPrintAPI):
         # This cleans up all non-useful fileshare files across all network queues, so they aren't just taking up space.
         # First we collect all non-local queue items hosted by us - these are excluded from cleanup as someone may need to fetch them.
         keep_hashes = set()
+        if self._prefetcher is not None:
+            keep_hashes |= self._prefetcher.hashes()
         for name, q in self.q.queues.items():
             if name == ARCHIVE_QUEUE or name == DEFAULT_QUEUE:
                 continue
@@ -557,9 +729,50 @@ class CPQPlugin(ContinuousPrintAPI):
         # Catch/pass all exceptions to prevent errors from stopping the repeated timer.
         try:
             self._update(DA.TICK)
+            self._maintain_db()
         except Exception:
             traceback.print_exc()
 
+    def _maintain_db(self, now=None):
+        # Applies retention limits, compacts the queue DB and removes stale event
+        # script files, at most once per MAINTENANCE_INTERVAL. This runs on the tick
+        # thread while nothing is printing, so the driver can't start a print until
+        # it finishes.
+        if now is None:
+            now = time.time()
+        if self._next_maintenance is None:
+            self._next_maintenance = now + self.MAINTENANCE_STARTUP_DELAY
+        if now < self._next_maintenance:
+            return
+        if self.d.state not in (self.d._state_inactive, self.d._state_idle) or (
+            self._printer.is_printing() or self._printer.is_paused()
+        ):
+            return
+        self._next_maintenance = now + self.MAINTENANCE_INTERVAL
+
+        n = self._runner.cleanup_artifacts()
+        if n > 0:
+            self._logger.info(f"Deleted {n} stale event script files")
+
+        export_dir = None
+        if self._get_key(Keys.RETENTION_EXPORT, True):
+            export_dir = Path(self._data_folder) / self.ARCHIVE_EXPORT_DIR
+        result = applyRetention(
+            run_days=int(self._get_key(Keys.RETENTION_RUN_DAYS, 0)),
+            max_runs=int(self._get_key(Keys.RETENTION_MAX_RUNS, 0)),
+            archive_days=int(self._get_key(Keys.RETENTION_ARCHIVE_DAYS, 0)),
+            max_archived=int(self._get_key(Keys.RETENTION_MAX_ARCHIVED, 0)),
+            export_dir=export_dir,
+        )
+        if result["runs_deleted"] == 0 and result["jobs_deleted"] == 0:
+            optimize_db(DB.queues, self._logger)
+            return
+
+        self._logger.info(f"Applied retention policy: {result}")
+        compact_db(DB.queues, self._logger)
+        self._sync_history()
+        self._sync_state()
+
     def _delete_timelapse(self, full_path):
         # This borrows heavily from `octoprint.timelapse.deleteTimelapse`
         # (https://github.com/OctoPrint/OctoPrint/blob/f430257d7072a83692fc2392c683ed8c97ae47b6/src/octoprint/server/api/timelapse.py#L175)
@@ -576,7 +789,31 @@ class CPQPlugin(ContinuousPrintAPI):
             self._logger.debug(traceback.format_exc())
             return False
 
+    def _invalidate_path_cache(self, event, payload):
+        if event in (Events.FILE_MOVED, Events.FOLDER_MOVED):
+            paths = [
+                (payload.get("source_storage"), payload.get("source_path")),
+                (payload.get("destination_storage"), payload.get("destination_path")),
+            ]
+        else:
+            paths = [(payload.get("storage"), payload.get("path"))]
+        for (storage, path) in paths:
+            if path is None or storage not in (None, FileDestinations.LOCAL):
+                continue  # SD card existence isn't cached
+            disk_path = self._path_on_disk(path, False)
+            if disk_path is not None:
+                self._path_cache.invalidate(disk_path)
+
     def on_event(self, event, payload):
+        if event in (
+            Events.FILE_ADDED,
+            Events.FILE_REMOVED,
+            Events.FILE_MOVED,
+            Events.FOLDER_ADDED,
+            Events.FOLDER_REMOVED,
+            Events.FOLDER_MOVED,
+        ):
+            self._invalidate_path_cache(event, payload)
         if not hasattr(self, "d"):  # Ignore any messages arriving before init
             return
         if event is None:
@@ -607,8 +844,9 @@ class CPQPlugin(ContinuousPrintAPI):
             event == Events.FILE_ADDED
             and self._profile_from_path(payload["path"]) is None
         ):
-            # Added files should be checked for metadata and enqueued into CPQ custom analysis
-            if self._enqueue(payload["path"]):
+            # Added files should be checked for metadata and enqueued into CPQ custom analysis.
+            # They go first, as an upload action may be waiting on the result.
+            if self._enqueue(payload["path"], high_priority=True):
                 self._logger.debug(f"Enqueued newly added file {payload['path']}")
             return
 
@@ -627,6 +865,7 @@ class CPQPlugin(ContinuousPrintAPI):
                     self._get_queue(DEFAULT_QUEUE).import_job(
                         payload["path"], draft=(upload_action != "add_printable")
                     )
+                    self._on_queue_edited()
                     self._sync_state()
             else:
                 return
@@ -644,13 +883,14 @@ class CPQPlugin(ContinuousPrintAPI):
                 return
 
             thumb_path = octoprint.timelapse.create_thumbnail_path(payload["movie"])
-            if self._queries.annotateLastRun(
+            run = self._queries.annotateLastRun(
                 payload["gcode"], payload["movie"], thumb_path
-            ):
+            )
+            if run:
                 self._logger.info(
                     f"Annotated run of {payload['gcode']} with timelapse details"
                 )
-                self._sync_history()
+                self._sync_history(run)
             self._update(DA.TICK)
             return
         elif event == Events.MOVIE_FAILED:
@@ -682,16 +922,18 @@ class CPQPlugin(ContinuousPrintAPI):
         ):
             self._update(DA.SPAGHETTI)
         elif event == self.EVENT_SPOOL_SELECTED:
+            self._materials = None
             self._update(DA.TICK)
         elif event == self.EVENT_SPOOL_DESELECTED:
+            self._materials = None
             self._update(DA.TICK)
         elif is_current_path and event == Events.PRINT_PAUSED:
             self._update(DA.TICK)
         elif is_current_path and event == Events.PRINT_RESUMED:
             self._update(DA.TICK)
-        elif (
-            event == Events.PRINTER_STATE_CHANGED
-            and self._printer.get_state_id() == "OPERATIONAL"
+        elif event == Events.PRINTER_STATE_CHANGED and (
+            self._printer.get_state_id() == "OPERATIONAL"
+            or self._get_key(Keys.EVENT_DRIVEN, False)
         ):
             self._update(DA.TICK)
         elif event == Events.SETTINGS_UPDATED:
@@ -702,6 +944,7 @@ class CPQPlugin(ContinuousPrintAPI):
     #  ---------------------- Begin ContinuousPrintAPI -------------------
 
     def _update(self, a: DA):
+        start = time.perf_counter()
         # Access current file via `get_current_job` instead of `is_current_file` because the latter may go away soon
         # See https://docs.octoprint.org/en/master/modules/printer.html#octoprint.printer.PrinterInterface.is_current_file
         # Avoid using payload.get('path') as some events may not express path info.
@@ -715,46 +958,104 @@ class CPQPlugin(ContinuousPrintAPI):
 
         self._handle_printer_state_reconnect(pstate)
 
-        materials = []
-        if self._spool_manager is not None:
-            # We need *all* selected spools for all tools, so we must look it up from the plugin itself
-            # (event payload also excludes color hex string which is needed for our identifiers)
-            try:
-                materials = self._spool_manager.api_getSelectedSpoolInformations()
-                materials = [
-                    f"{m['material']}_{m['colorName']}_{m['color']}"
-                    if m is not None
-                    else None
-                    for m in materials
-                ]
-            except Exception:
-                self._logger.warning(
-                    "SpoolManager getSelectedSpoolInformations() returned error; skipping material assignment"
-                )
+        materials = self._selected_materials()
 
         bed_temp = self._printer.get_current_temperatures().get("bed")
         if bed_temp is not None:
             bed_temp = bed_temp.get("actual", 0)
 
         timelapse_start_ts = None
-        timelapsesEnabled = (
-            self._settings.global_get(["webcam", "timelapse", "type"]) != "off"
-        )
-        if timelapsesEnabled:
+        # Read on every update (an in-memory lookup): the timelapse tab saves this
+        # setting without firing SETTINGS_UPDATED
+        if self._settings.global_get(["webcam", "timelapse", "type"]) != "off":
             timelapse_start_ts = self._timelapse_start_ts
 
         if self.d.action(a, p, path, materials, bed_temp, timelapse_start_ts):
             self._sync_state()
+        self._schedule_deadline()
 
+        # LAN queues only broadcast this when it differs from what was last sent
         run = self.q.get_run()
         if run is not None:
             run = run.as_dict()
         netname = self._get_key(Keys.NETWORK_NAME)
         self.q.update_peer_state(netname, p.name, run, self._printer_profile)
+        if a == DA.TICK:
+            self._prefetch_next(p)
+        self._record_update_time(a, time.perf_counter() - start)
+
+    def _selected_materials(self):
+        # SpoolManager is only queried again after a spool (de)selection event
+        if self._spool_manager is None:
+            return []
+        if self._materials is None:
+            # We need *all* selected spools for all tools, so we must look it up from the plugin itself
+            # (event payload also excludes color hex string which is needed for our identifiers)
+            try:
+                materials = self._spool_manager.api_getSelectedSpoolInformations()
+            except Exception:
+                self._logger.warning(
+                    "SpoolManager getSelectedSpoolInformations() returned error; skipping material assignment"
+                )
+                return []
+            self._materials = [
+                f"{m['material']}_{m['colorName']}_{m['color']}"
+                if m is not None
+                else None
+                for m in materials
+            ]
+        return self._materials
+
+    def _record_update_time(self, a: DA, elapsed):
+        ms = elapsed * 1000
+        t = self._update_timing
+        t["count"] += 1
+        t["total_ms"] += ms
+        t["max_ms"] = max(t["max_ms"], ms)
+        t["last_ms"] = ms
+        if elapsed > self.SLOW_UPDATE_SEC:
+            self._logger.warning(f"Slow driver update ({a.name}): {ms:.0f}ms")
+
+    def _update_timing_dict(self):
+        t = self._update_timing
+        return dict(
+            t,
+            mean_ms=(t["total_ms"] / t["count"]) if t["count"] > 0 else 0.0,
+            transitions=self.d.metrics.recent_transitions(),
+            workers=self._worker_counters(),
+        )
 
-    def _state_json(self):
-        # IMPORTANT: Non-additive changes to this response string must be released in a MAJOR version bump
-        # (e.g. 1.4.1 -> 2.0.0).
+    def _worker_counters(self):
+        workers = dict(
+            sync=self._sync_scheduler,
+            deadline=self._deadline_scheduler,
+            prefetch=self._prefetcher,
+        )
+        return dict((k, w.counters()) for k, w in workers.items() if w is not None)
+
+    def _count_remaining_prints(self):
+        counts = dict((name, 0) for name in self.q.queues)
+        counts.update(self._queries.getRemainingPrints())
+        for name, q in self.q.queues.items():
+            if hasattr(q, "remaining_prints"):
+                counts[name] = q.remaining_prints()
+        return counts
+
+    def _metrics_text(self):
+        lines = self.d.metrics.render()
+        if self._queue_metrics is not None:
+            peers = dict(
+                (name, q.peer_count())
+                for name, q in self.q.queues.items()
+                if hasattr(q, "peer_count")
+            )
+            lines += self._queue_metrics.render(
+                peers, getattr(self._fileshare, "bytes_served", 0)
+            )
+        lines += render_worker_counters(self._worker_counters())
+        return "\n".join(lines) + "\n"
+
+    def _state_dict(self):
         db_qs = dict([(q.name, q.rank) for q in self._queries.getQueues()])
         qs = [
             dict(q.as_dict(), rank=db_qs[name])
@@ -771,18 +1072,40 @@ class CPQPlugin(ContinuousPrintAPI):
             "statusType": "INIT" if not hasattr(self, "d") else self.d.status_type.name,
             "queues": qs,
         }
-        return json.dumps(resp)
+        return resp
 
-    def _history_json(self):
-        h = self._queries.getHistory()
+    def _state_delta(self):
+        return self._state_tracker.update(self._state_dict())
+
+    def _state_json(self):
+        # IMPORTANT: Non-additive changes to this response string must be released in a MAJOR version bump
+        # (e.g. 1.4.1 -> 2.0.0).
+        resp, delta = self._state_tracker.snapshot(self._state_dict())
+        if delta is not None:
+            # Keep other clients in step, as they may be waiting on this sequence number
+            self._sync("statedelta", delta)
+        return resp
+
+    def _active_run_id(self):
+        return getattr(self.q.run, "id", self.q.run)
+
+    def _history_json(self, **filters):
+        h = self._queries.getHistory(**filters)
 
         if self.q.run is not None:
+            run_id = self._active_run_id()
             for row in h:
-                if row["run_id"] == self.q.run:
+                if row["run_id"] == run_id:
                     row["active"] = True
                     break
         return json.dumps(h)
 
+    def _history_row(self, run):
+        row = self._queries.getRun(run.id)
+        if row is not None and row["run_id"] == self._active_run_id():
+            row["active"] = True
+        return row
+
     def _get_queue(self, name):
         return self.q.get(name)
 
@@ -810,4 +1133,5 @@ class CPQPlugin(ContinuousPrintAPI):
 
         # We trigger state update rather than returning it here, because this is called by the settings viewmodel
         # (not the main viewmodel that displays the queues)
+        self._on_queue_edited()
         self._sync_state()
@@ -6,13 +6,15 @@ from .storage.queries import getJobsAndSets
 from .storage.database import DEFAULT_QUEUE, ARCHIVE_QUEUE
 from unittest.mock import MagicMock, patch, ANY, call
 from octoprint.filemanager.analysis import QueueEntry
-from .driver import Action as DA
+from .driver import Driver, Action as DA
 from octoprint.events import Events
 import logging
 import tempfile
+import time
 import json
 from .data import Keys, TEMP_FILE_DIR
 from .plugin import CPQPlugin
+from .metrics import DriverMetrics, QueueMetrics
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -38,10 +40,12 @@ class MockSettings:
 
 
 def mockplugin():
+    file_manager = MagicMock()
+    file_manager.path_on_disk.return_value = "/nonexistent"
     return CPQPlugin(
         printer=MagicMock(),
         settings=MockSettings(),
-        file_manager=MagicMock(),
+        file_manager=file_manager,
         plugin_manager=MagicMock(),
         fire_event=MagicMock(),
         queries=MagicMock(),
@@ -165,6 +169,68 @@ class TestStartup(unittest.TestCase):
         p._init_queues(lancls=MagicMock(), localcls=MagicMock())
         self.assertEqual(len(p.q.queues), 2)  # 2 queues created, archive skipped
 
+    def testSyncScheduler(self):
+        p = mockplugin()
+        p._settings.set([Keys.SYNC_WINDOW_MS.setting], 0)
+        p._state_delta = MagicMock(return_value=dict(seq=1))
+        p._init_sync_scheduler()
+        self.addCleanup(p._sync_scheduler.stop)
+
+        p._sync_state()
+        self.assertTrue(p._sync_scheduler.wait_idle(timeout=5))
+        p._plugin_manager.send_plugin_message.assert_called_once()
+        self.assertEqual(p._sync_scheduler.counters(), dict(requested=1, emitted=1))
+
+    def testWatchdogInterval(self):
+        p = mockplugin()
+        self.assertEqual(p.watchdog_interval(), p.WATCHDOG_INTERVAL)
+        p._settings.set([Keys.EVENT_DRIVEN.setting], True)
+        self.assertEqual(p.watchdog_interval(), p.WATCHDOG_SLOW_INTERVAL)
+
+    def testScheduleDeadline(self):
+        p = mockplugin()
+        p.d = MagicMock()
+        p.d.next_deadline.return_value = 123
+        p._init_deadline_scheduler(cls=MagicMock())
+        p._schedule_deadline()
+        p._deadline_scheduler.schedule.assert_not_called()  # Disabled by default
+
+        p._settings.set([Keys.EVENT_DRIVEN.setting], True)
+        p._schedule_deadline()
+        p._deadline_scheduler.schedule.assert_called_with(123)
+
+        p._deadline_scheduler.schedule.reset_mock()
+        p.d.next_deadline.return_value = None
+        p._schedule_deadline()
+        p._deadline_scheduler.schedule.assert_not_called()
+
+    def testCooldownUpdatesKeepOneDeadline(self):
+        p = mockplugin()
+        p.q = MagicMock()
+        p._sync_state = MagicMock()
+        p._printer_profile = None
+        p._spool_manager = None
+        p._settings.set([Keys.EVENT_DRIVEN.setting], True)
+        p._printer.get_state_id.return_value = "OPERATIONAL"
+        p._printer.get_current_job.return_value = dict()
+        p._printer.get_current_temperatures.return_value = dict(bed=dict(actual=30))
+        p.d = Driver(queue=p.q, script_runner=MagicMock(), logger=logging.getLogger())
+        p.d.set_managed_cooldown(True, 20, 60)
+        p.d.state = p.d._state_cooldown
+        p.d.cooldown_start = time.time()
+        p._init_deadline_scheduler()
+        self.addCleanup(p._deadline_scheduler.stop)
+
+        # Watchdog ticks and events during cooldown each re-request a poll; these
+        # must not start more than one chain of wakeups
+        for i in range(5):
+            p._update(DA.TICK)
+        self.assertEqual(p.d.state.__name__, p.d._state_cooldown.__name__)
+        self.assertEqual(p._deadline_scheduler.counters()["scheduled"], 1)
+        self.assertLessEqual(
+            p._deadline_scheduler.pending(), time.time() + Driver.COOLDOWN_POLL_SEC
+        )
+
     def testDriver(self):
         p = mockplugin()
         p.q = MagicMock()
@@ -197,6 +263,30 @@ class TestEventHandling(unittest.TestCase):
         self.p.tick()  # does *not* raise exception
         self.p.d.action.assert_called()
 
+    def testFileEventsInvalidatePathCache(self):
+        self.p._path_cache = MagicMock()
+        self.p._file_manager.path_on_disk.side_effect = lambda d, p: f"/disk/{p}"
+        self.p.on_event(Events.FILE_REMOVED, dict(storage="local", path="a.gcode"))
+        self.p._path_cache.invalidate.assert_called_with("/disk/a.gcode")
+
+        self.p._path_cache.reset_mock()
+        self.p.on_event(
+            Events.FOLDER_MOVED,
+            dict(
+                source_storage="local",
+                source_path="b",
+                destination_storage="local",
+                destination_path="c",
+            ),
+        )
+        self.p._path_cache.invalidate.assert_has_calls(
+            [call("/disk/b"), call("/disk/c")]
+        )
+
+        self.p._path_cache.reset_mock()
+        self.p.on_event(Events.FILE_REMOVED, dict(storage="sdcard", path="a.gcode"))
+        self.p._path_cache.invalidate.assert_not_called()
+
     def testMetadataAnalysisFinishedNonePending(self):
         self.p._set_key(Keys.INFER_PROFILE, True)
         self.p.on_event(
@@ -242,6 +332,19 @@ class TestEventHandling(unittest.TestCase):
             },
         )
 
+    @patch("continuousprint.analysis.content_hash")
+    def testUploadNotHashedOnEventThread(self, ch):
+        # Uploads are hashed once, by the analysis queue; adding the set waits on it
+        self.p._set_key(Keys.INFER_PROFILE, True)
+        self.p._set_key(Keys.UPLOAD_ACTION, "add_draft")
+        self.p._file_manager.get_additional_metadata.return_value = None
+        self.p._analysis_queue = MagicMock()
+        self.p.on_event(Events.FILE_ADDED, dict(path="a.gcode", storage="local"))
+        self.p.on_event(Events.UPLOAD, dict(path="a.gcode", target="local"))
+        ch.assert_not_called()
+        self.p._analysis_queue.enqueue.assert_called_once_with(ANY, high_priority=True)
+        self.p._get_queue(DEFAULT_QUEUE).add_set.assert_not_called()
+
     def testUploadNoAction(self):
         self.p.on_event(Events.UPLOAD, dict())
         self.p.d.action.assert_not_called()
@@ -279,6 +382,9 @@ class TestEventHandling(unittest.TestCase):
         self.p._sync_history = MagicMock()
         self.p.on_event(Events.MOVIE_DONE, dict(gcode="a.gcode", movie="a.mp4"))
         self.p._queries.annotateLastRun.assert_called_with("a.gcode", "a.mp4", ANY)
+        self.p._sync_history.assert_called_with(
+            self.p._queries.annotateLastRun.return_value
+        )
 
     def testPrintDone(self):
         self.p._cleanup_fileshare = lambda: 0
@@ -328,6 +434,127 @@ class TestEventHandling(unittest.TestCase):
         self.p.on_event("spool_desel", dict())
         self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, ANY)
 
+    def testSpoolManagerQueriedOnlyOnSpoolEvents(self):
+        self.p.EVENT_SPOOL_SELECTED = "spool_selected"
+        sm = MagicMock()
+        sm.api_getSelectedSpoolInformations.return_value = [
+            dict(material="PLA", colorName="red", color="FF0000"),
+            None,
+        ]
+        self.p._spool_manager = sm
+        self.p._update(DA.TICK)
+        self.p._update(DA.TICK)
+        sm.api_getSelectedSpoolInformations.assert_called_once()
+        self.p.d.action.assert_called_with(
+            DA.TICK, ANY, ANY, ["PLA_red_FF0000", None], ANY, ANY
+        )
+
+        self.p.on_event("spool_selected", dict())
+        self.assertEqual(sm.api_getSelectedSpoolInformations.call_count, 2)
+
+    def testSpoolManagerErrorNotCached(self):
+        sm = MagicMock()
+        sm.api_getSelectedSpoolInformations.side_effect = [Exception("testing"), []]
+        self.p._spool_manager = sm
+        self.p._update(DA.TICK)
+        self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, [], ANY, ANY)
+        self.p._update(DA.TICK)
+        self.assertEqual(sm.api_getSelectedSpoolInformations.call_count, 2)
+
+    def testTimelapseSettingReadEachUpdate(self):
+        # The timelapse tab saves settings without firing SETTINGS_UPDATED
+        self.p._timelapse_start_ts = 123
+        self.p._settings.global_set(["webcam", "timelapse", "type"], "timed")
+        self.p._update(DA.TICK)
+        self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, 123)
+
+        self.p._settings.global_set(["webcam", "timelapse", "type"], "off")
+        self.p._update(DA.TICK)
+        self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, None)
+
+    def testMetricsText(self):
+        self.p.d.metrics = DriverMetrics()
+        self.p.d.metrics.transition("idle", "printing", "TICK", 1.0, 0)
+        self.p._sync_scheduler = MagicMock()
+        self.p._sync_scheduler.counters.return_value = dict(requested=3, emitted=1)
+        text = self.p._metrics_text()
+        self.assertTrue(text.endswith("\n"))
+        self.assertIn("continuousprint_driver_transitions_total{", text)
+        self.assertIn(
+            'continuousprint_worker_events_total{worker="sync",event="requested"} 3',
+            text,
+        )
+        self.assertEqual(
+            self.p._update_timing_dict()["workers"],
+            dict(sync=dict(requested=3, emitted=1)),
+        )
+
+    def testShutdownStopsWorkers(self):
+        for attr in ("_sync_scheduler", "_deadline_scheduler", "_prefetcher"):
+            setattr(self.p, attr, MagicMock())
+        self.p.shutdown()
+        for attr in ("_sync_scheduler", "_deadline_scheduler", "_prefetcher"):
+            getattr(self.p, attr).stop.assert_called_once()
+
+    def testMetricsTextWithQueues(self):
+        self.p.d.metrics = DriverMetrics()
+        lan = MagicMock()
+        lan.peer_count.return_value = 2
+        lan.remaining_prints.return_value = 5
+        self.p.q.queues = dict(LAN=lan, local=object())
+        self.p._queries.getRemainingPrints.return_value = dict(local=3)
+        self.p._queries.getRunTotals.return_value = []
+        self.p._fileshare = MagicMock(bytes_served=42)
+        self.p._queue_metrics = QueueMetrics(
+            self.p._count_remaining_prints, self.p._queries.getRunTotals
+        )
+        text = self.p._metrics_text()
+        self.assertIn('continuousprint_queue_remaining_prints{queue="LAN"} 5', text)
+        self.assertIn('continuousprint_queue_remaining_prints{queue="local"} 3', text)
+        self.assertIn('continuousprint_lan_peers{queue="LAN"} 2', text)
+        self.assertIn("continuousprint_fileshare_served_bytes_total 42", text)
+
+    def testRemainingPrintsRecountedOnlyAfterEdits(self):
+        self.p._sync_scheduler = MagicMock()
+        self.p._queries.getRemainingPrints.return_value = dict(local=3)
+        self.p.q.queues = dict(local=object())
+        self.p._queue_metrics = QueueMetrics(self.p._count_remaining_prints, list)
+        self.assertEqual(self.p._queue_metrics.remaining(), dict(local=3))
+
+        self.p._queue_metrics.decremented("local")
+        self.p._sync_state()
+        self.assertEqual(self.p._queue_metrics.remaining(), dict(local=2))
+
+        self.p._on_queue_update(MagicMock())
+        self.assertEqual(self.p._queue_metrics.remaining(), dict(local=3))
+        self.assertEqual(self.p._queries.getRemainingPrints.call_count, 2)
+
+    def testPrefetchWhilePrinting(self):
+        self.p._prefetcher = MagicMock()
+        lan = MagicMock()
+        lan.next_gjob.return_value = ("peer:1", "h1")
+        self.p.q.queues = dict(local=object(), LAN=lan)
+        self.p._settings.set([Keys.PREFETCH_RATE_KBPS.setting], 10)
+
+        self.p._printer.get_state_id.return_value = "OPERATIONAL"
+        self.p._update(DA.TICK)
+        self.p._prefetcher.want.assert_not_called()
+
+        self.p._printer.get_state_id.return_value = "PRINTING"
+        self.p._update(DA.TICK)
+        self.p._prefetcher.want.assert_called_with(("peer:1", "h1"), 10 * 1024)
+
+        self.p._settings.set([Keys.PREFETCH_LAN.setting], False)
+        self.p._update(DA.TICK)
+        self.p._prefetcher.want.assert_called_with(None, 10 * 1024)
+
+    def testUpdateTiming(self):
+        self.p._update(DA.TICK)
+        self.p._update(DA.TICK)
+        t = self.p._update_timing_dict()
+        self.assertEqual(t["count"], 2)
+        self.assertGreaterEqual(t["max_ms"], t["mean_ms"])
+
     def testPrintPaused(self):
         self.p._printer.get_current_job.return_value = dict(
             file=dict(name="test.gcode")
@@ -349,6 +576,15 @@ class TestEventHandling(unittest.TestCase):
         self.p.on_event(Events.PRINTER_STATE_CHANGED, dict())
         self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, ANY)
 
+    def testPrinterStateChangedEventDriven(self):
+        self.p._printer.get_state_id.return_value = "PRINTING"
+        self.p.on_event(Events.PRINTER_STATE_CHANGED, dict())
+        self.p.d.action.assert_not_called()
+
+        self.p._settings.set([Keys.EVENT_DRIVEN.setting], True)
+        self.p.on_event(Events.PRINTER_STATE_CHANGED, dict())
+        self.p.d.action.assert_called_with(DA.TICK, ANY, ANY, ANY, ANY, ANY)
+
     def testSettingsUpdated(self):
         self.p.on_event(Events.SETTINGS_UPDATED, dict())
         self.p.d.set_retry_on_pause.assert_called()
@@ -401,9 +637,35 @@ class TestGetters(unittest.TestCase):
                 "queues": [{"name": "local", "rank": 1}, {"name": "asdf", "rank": 5}],
                 "status": "test",
                 "statusType": "testing",
+                "seq": 1,
             },
         )
 
+    def testStateDeltaOnlyChanges(self):
+        self.p._queries.getQueues.return_value = []
+        self.p.q.queues = dict()
+        self.p.d.status = "test"
+        self.p.d.status_type.name = "testing"
+        self.p._state_json()
+        self.assertEqual(self.p._state_delta(), None)
+
+        self.p.d.status = "changed"
+        self.assertEqual(
+            self.p._state_delta(),
+            dict(seq=2, base=1, fields=dict(status="changed")),
+        )
+
+    def testSyncHistoryRow(self):
+        run = namedtuple("Run", ["id"])(2)
+        self.p.q.run = run
+        self.p._queries.getRun.return_value = dict(run_id=2)
+        self.p._sync_history(run)
+        self.p._queries.getRun.assert_called_with(2)
+        self.p._plugin_manager.send_plugin_message.assert_called_with(
+            None,
+            dict(type="sethistoryrow", historyrow=dict(run_id=2, active=True)),
+        )
+
     def testHistoryJSON(self):
         self.p._queries.getHistory.return_value = [dict(run_id=1), dict(run_id=2)]
         self.p.q.run = 2
@@ -465,6 +727,84 @@ class TestAutoReconnect(unittest.TestCase):
         self.p._printer.connect.assert_not_called()
 
 
+class TestMaintainDB(unittest.TestCase):
+    def setUp(self):
+        self.p = mockplugin()
+        self.p._data_folder = "/data"
+        self.p.d = MagicMock()
+        self.p.d.state = self.p.d._state_idle
+        self.p._printer.is_printing.return_value = False
+        self.p._printer.is_paused.return_value = False
+        self.p._sync_history = MagicMock()
+        self.p._sync_state = MagicMock()
+        self.p._runner = MagicMock()
+        self.p._runner.cleanup_artifacts.return_value = 0
+        self.p._next_maintenance = 0  # Startup delay has passed
+
+    @patch("continuousprint.plugin.optimize_db")
+    @patch("continuousprint.plugin.applyRetention")
+    def testDelayedAfterStartup(self, ar, opt):
+        ar.return_value = dict(runs_deleted=0, jobs_deleted=0, exported=[])
+        self.p._next_maintenance = None
+        self.p._maintain_db(now=100)
+        ar.assert_not_called()
+        self.p._maintain_db(now=100 + self.p.MAINTENANCE_STARTUP_DELAY)
+        ar.assert_called_once()
+
+    @patch("continuousprint.plugin.optimize_db")
+    @patch("continuousprint.plugin.applyRetention")
+    def testSkippedWhilePrinting(self, ar, opt):
+        self.p._printer.is_printing.return_value = True
+        self.p._maintain_db(now=100)
+        ar.assert_not_called()
+
+        self.p._printer.is_printing.return_value = False
+        self.p.d.state = self.p.d._state_printing
+        self.p._maintain_db(now=100)
+        ar.assert_not_called()
+
+    @patch("continuousprint.plugin.optimize_db")
+    @patch("continuousprint.plugin.applyRetention")
+    def testRunsOncePerInterval(self, ar, opt):
+        ar.return_value = dict(runs_deleted=0, jobs_deleted=0, exported=[])
+        self.p._maintain_db(now=100)
+        self.p._maintain_db(now=200)
+        ar.assert_called_once_with(
+            run_days=0, max_runs=0, archive_days=0, max_archived=0, export_dir=ANY
+        )
+        opt.assert_called_once()
+        self.p._runner.cleanup_artifacts.assert_called_once()
+        self.p._sync_history.assert_not_called()
+
+        self.p._maintain_db(now=100 + self.p.MAINTENANCE_INTERVAL)
+        self.assertEqual(ar.call_count, 2)
+
+    @patch("continuousprint.plugin.compact_db")
+    @patch("continuousprint.plugin.applyRetention")
+    def testCompactsAfterDelete(self, ar, compact):
+        self.p._set_key(Keys.RETENTION_RUN_DAYS, "30")
+        ar.return_value = dict(runs_deleted=5, jobs_deleted=0, exported=[])
+        self.p._maintain_db(now=100)
+        ar.assert_called_once_with(
+            run_days=30,
+            max_runs=0,
+            archive_days=0,
+            max_archived=0,
+            export_dir=Path("/data/archives"),
+        )
+        compact.assert_called_once()
+        self.p._sync_history.assert_called_once()
+        self.p._sync_state.assert_called_once()
+
+    @patch("continuousprint.plugin.optimize_db")
+    @patch("continuousprint.plugin.applyRetention")
+    def testExportDisabled(self, ar, opt):
+        self.p._set_key(Keys.RETENTION_EXPORT, False)
+        ar.return_value = dict(runs_deleted=0, jobs_deleted=0, exported=[])
+        self.p._maintain_db(now=100)
+        self.assertEqual(ar.call_args[1]["export_dir"], None)
+
+
 class TestAnalysis(unittest.TestCase):
     def setUp(self):
         self.p = mockplugin()
@@ -507,6 +847,7 @@ class TestAnalysis(unittest.TestCase):
                 ),
             )
         )
+        self.p._set_key(Keys.ANALYSIS_WORKERS, 1)
         self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
         self.p._analysis_queue.register_finish_callback.assert_called()
         # Note that python injects some __bool__() calls which is apparently due to threading checks
@@ -541,6 +882,61 @@ class TestAnalysis(unittest.TestCase):
             any_order=True,
         )
 
+    def _set_backlog(self, paths):
+        self.p._file_manager.list_files.return_value = dict(
+            local=dict((p, dict(type="machinecode", path=p)) for p in paths)
+        )
+
+    def testBacklogPrioritizesQueuedFiles(self):
+        self._set_backlog(["a.gcode", "b.gcode", TEMP_FILE_DIR + "/c.gcode"])
+        self.p._queries.getQueuedSetPaths.return_value = {"b.gcode"}
+        self.p._set_key(Keys.ANALYSIS_WORKERS, 1)
+        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
+        self.assertEqual(
+            [
+                (c[0][0].path, c[1]["high_priority"])
+                for c in self.p._analysis_queue.enqueue.call_args_list
+            ],
+            [("b.gcode", True), ("a.gcode", False)],
+        )
+
+    @patch("continuousprint.plugin.BacklogAnalyzer")
+    def testBacklogParallel(self, ba):
+        self._set_backlog(["a.gcode", "b.gcode"])
+        self.p._queries.getQueuedSetPaths.return_value = {"b.gcode"}
+        self.p._set_key(Keys.ANALYSIS_WORKERS, 4)
+        ba.return_value.run.return_value = 2
+        self.p._init_analysis_queue(cls=MagicMock(), async_backlog=False)
+        self.p._analysis_queue.enqueue.assert_not_called()
+        self.assertEqual(ba.call_args[0][0], 4)
+        entries = ba.return_value.run.call_args[0][0]
+        self.assertEqual([e.path for e in entries], ["b.gcode", "a.gcode"])
+        self.assertEqual(
+            [
+                c[0][1].get("msg", c[0][1].get("backlog"))
+                for c in self.p._plugin_manager.send_plugin_message.call_args_list
+            ],
+            [
+                "Assigning printer profiles to 2 files",
+                None,  # Progress cleared from the queue tab
+                "Assigned printer profiles for 2 of 2 files",
+            ],
+        )
+
+        self.p.shutdown()
+        ba.return_value.abort.assert_called_once()
+
+    def testBacklogProgressSynced(self):
+        self.p._on_backlog_progress(5, 10)
+        self.p._plugin_manager.send_plugin_message.assert_called_with(
+            None, dict(type="setbacklog", backlog=dict(done=5, total=10))
+        )
+
+    def testProfileFromPathNoMetadata(self):
+        self.p._file_manager.get_additional_metadata.return_value = None
+        self.assertEqual(self.p._profile_from_path("a.gcode"), None)
+        self.p._file_manager.set_additional_metadata.assert_not_called()
+
     def testAnalysisCompleted(self):
         entry = MagicMock()
         entry.path = "a.gcode"
@@ -585,6 +981,17 @@ class TestCleanupFileshare(unittest.TestCase):
         self.assertFalse((p / "c.gcode").exists())
         self.assertFalse((p / "d").exists())
 
+    def testCleanupKeepsPrefetched(self):
+        p = Path(self.p.fileshare_dir)
+        (p / "d").mkdir()
+        (p / "d.gjob").touch()
+        (p / "d.part").touch()  # In-progress downloads are ignored
+        self.p._prefetcher = MagicMock()
+        self.p._prefetcher.hashes.return_value = {"d"}
+        self.assertEqual(self.p._cleanup_fileshare(), 0)
+        self.assertTrue((p / "d").exists())
+        self.assertTrue((p / "d.gjob").exists())
+
 
 class TestLocalAddressResolution(unittest.TestCase):
     def setUp(self):
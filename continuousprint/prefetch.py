@@ -0,0 +1,77 @@
+import threading
+import traceback
+from .worker import Worker
+
+
+class GjobPrefetcher(Worker):
+    """Fetches the LAN job predicted to print next on a background thread, so that
+    starting it doesn't wait on the transfer.
+
+    Targets are (fileshare address, hash) pairs. One job is fetched at a time, and
+    changing the target cancels a fetch that is in progress."""
+
+    def __init__(self, fileshare, logger):
+        super().__init__("Prefetch", logger, ("fetched", "cancelled", "failed"))
+        self._fs = fileshare
+        self._cancel = threading.Event()
+        self._target = None
+        self._rate = 0
+        self._active = None
+        self._last = None  # Most recent target fetched (or failed)
+        self._start()
+
+    def want(self, target, rate=0):
+        """Sets the job to prefetch (None for none) and the rate limit in bytes/sec"""
+        with self._cv:
+            self._rate = rate
+            if target == self._target:
+                return
+            self._target = target
+            if self._active is not None and self._active != target:
+                self._cancel.set()
+            self._cv.notify_all()
+
+    def hashes(self) -> set:
+        # Jobs which should survive fileshare cleanup
+        with self._cv:
+            return set(
+                t[1] for t in (self._target, self._active, self._last) if t is not None
+            )
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True  # So nothing is taken after the cancel
+            self._cancel.set()
+        super().stop()
+
+    def _has_work(self):
+        return self._target not in (None, self._last)
+
+    def _take(self):
+        self._active = self._target
+        self._cancel.clear()
+        return (self._active, self._rate)
+
+    def _work(self, item):
+        (target, rate) = item
+        try:
+            return self._fs.prefetch(target[0], target[1], self._cancel, rate)
+        except Exception:
+            self._logger.warning(
+                f"Prefetch of {target[1]} failed: {traceback.format_exc()}"
+            )
+
+    def _finished(self, item, result):
+        target = item[0]
+        self._active = None
+        if result is not None:
+            self._count("fetched")
+            self._last = target
+            self._logger.info(f"Prefetched job {target[1]}")
+        elif self._cancel.is_set():
+            self._count("cancelled")
+        else:
+            # Not retried until the prediction changes; starting the
+            # print still fetches the job as usual
+            self._count("failed")
+            self._last = target
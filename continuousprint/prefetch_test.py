@@ -0,0 +1,65 @@
+import unittest
+import threading
+import logging
+from unittest.mock import MagicMock
+from .prefetch import GjobPrefetcher
+
+
+class FakeFileshare:
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.calls = []
+
+    def prefetch(self, peer, hash_, cancel, rate):
+        self.calls.append((peer, hash_, rate))
+        self.started.set()
+        while not self.release.wait(0.01):
+            if cancel.is_set():
+                return None
+        return f"/dir/{hash_}"
+
+
+class TestGjobPrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.fs = FakeFileshare()
+        self.p = GjobPrefetcher(self.fs, logging.getLogger())
+        self.addCleanup(self.p.stop)
+        self.addCleanup(self.fs.release.set)
+
+    def testFetchesTarget(self):
+        self.fs.release.set()
+        self.p.want(("peer:1", "h1"), 1024)
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.p.want(("peer:1", "h1"), 1024)  # Already fetched
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.assertEqual(self.fs.calls, [("peer:1", "h1", 1024)])
+        self.assertEqual(self.p.counters(), dict(fetched=1, cancelled=0, failed=0))
+        self.assertEqual(self.p.hashes(), {"h1"})
+
+    def testPredictionChangeCancels(self):
+        self.p.want(("peer:1", "h1"))
+        self.assertTrue(self.fs.started.wait(5))
+        self.p.want(("peer:1", "h2"))
+        while len(self.fs.calls) < 2:
+            self.fs.started.wait(0.01)
+        self.fs.release.set()
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.assertEqual([c[1] for c in self.fs.calls], ["h1", "h2"])
+        self.assertEqual(self.p.counters(), dict(fetched=1, cancelled=1, failed=0))
+
+    def testNoneCancels(self):
+        self.p.want(("peer:1", "h1"))
+        self.assertTrue(self.fs.started.wait(5))
+        self.p.want(None)
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.assertEqual(self.p.counters(), dict(fetched=0, cancelled=1, failed=0))
+
+    def testFailureNotRetried(self):
+        self.fs.prefetch = MagicMock(side_effect=Exception("testing"))
+        self.p.want(("peer:1", "h1"))
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.p.want(("peer:1", "h1"))
+        self.assertTrue(self.p.wait_idle(timeout=5))
+        self.fs.prefetch.assert_called_once()
+        self.assertEqual(self.p.counters(), dict(fetched=0, cancelled=0, failed=1))
@@ -74,6 +74,11 @@ class AbstractEditableQueue(AbstractQueue):
     def mv_job(self, job_id, after_id):
         pass
 
+    @abstractmethod
+    def mv_jobs(self, job_ids, after_id):
+        """Moves job_ids, in order, to directly after after_id (or the front if None)"""
+        pass
+
     @abstractmethod
     def edit_job(self, job_id, data):
         pass
@@ -99,6 +104,10 @@ class AbstractFactoryQueue(AbstractEditableQueue):
     def add_set(self, job_id, data) -> SetView:
         pass
 
+    @abstractmethod
+    def add_jobs(self, jobs: list) -> list:
+        pass  # Bulk insert of job dicts (with sets); returns the new job & set IDs
+
     @abstractmethod
     def import_job(self, gjob_path, out_dir) -> dict:
         pass
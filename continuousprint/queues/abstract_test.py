@@ -117,6 +117,25 @@ class EditableQueueTests(JobEqualityTests):
         jids = [j["id"] for j in self.q.as_dict()["jobs"]]
         self.assertEqual(jids, [self.jids[i] for i in (0, 1, 3, 2)])
 
+    def test_mv_jobs(self):
+        self.q.mv_jobs([self.jids[3], self.jids[0]], self.jids[1])
+        jids = [j["id"] for j in self.q.as_dict()["jobs"]]
+        self.assertEqual(jids, [self.jids[i] for i in (1, 3, 0, 2)])
+
+    def test_mv_jobs_full_ordering(self):
+        want = [self.jids[i] for i in (2, 0, 3, 1)]
+        self.q.mv_jobs(want, None)
+        self.assertEqual([j["id"] for j in self.q.as_dict()["jobs"]], want)
+
+    def test_mv_jobs_invalid(self):
+        for (job_ids, after_id) in [
+            ([self.jids[0], self.jids[0]], None),  # Duplicate
+            ([self.jids[0]], self.jids[0]),  # After itself
+        ]:
+            with self.subTest(job_ids=job_ids, after_id=after_id):
+                with self.assertRaises(ValueError):
+                    self.q.mv_jobs(job_ids, after_id)
+
     def test_edit_job(self):
         result = self.q.edit_job(self.jids[0], dict(draft=True))
         self.assertEqual(result, self.q.as_dict()["jobs"][0])
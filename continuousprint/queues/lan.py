@@ -1,4 +1,5 @@
 import uuid
+import time
 from typing import Optional
 from bisect import bisect_left
 from peerprint.lan_queue import LANPrintQueue, ChangeType
@@ -13,7 +14,35 @@ class ValidationError(Exception):
     pass
 
 
+def _longest_increasing(items, key) -> set:
+    """Returns the largest subset of items whose key[] values increase in list order"""
+    tails = []  # tails[i] is the smallest key ending an increasing run of length i+1
+    tail_idx = []
+    prev = [None] * len(items)
+    for i, item in enumerate(items):
+        k = key[item]
+        j = bisect_left(tails, k)
+        if j == len(tails):
+            tails.append(k)
+            tail_idx.append(i)
+        else:
+            tails[j] = k
+            tail_idx[j] = i
+        prev[i] = tail_idx[j - 1] if j > 0 else None
+
+    result = set()
+    i = tail_idx[-1] if tail_idx else None
+    while i is not None:
+        result.add(items[i])
+        i = prev[i]
+    return result
+
+
 class LANQueue(AbstractEditableQueue):
+    # Unchanged peer state is re-sent at this interval so peers (which drop us
+    # after peerprint's 60 second PEER_TIMEOUT) still see us as online
+    PEER_HEARTBEAT_SEC = 20
+
     def __init__(
         self,
         ns,
@@ -34,6 +63,8 @@ class LANQueue(AbstractEditableQueue):
         self.lan = None
         self.job_id = None
         self.set_id = None
+        self._peer_state = None
+        self._peer_state_ts = 0
         self.update_cb = update_cb
         self._fileshare = fileshare
         self._path_on_disk = path_on_disk_fn
@@ -72,18 +103,27 @@ class LANQueue(AbstractEditableQueue):
     def destroy(self):
         self.lan.destroy()
 
-    def update_peer_state(self, name, status, run, profile):
-        if self.lan is not None and self.lan.q is not None:
-            self.lan.q.syncPeer(
-                dict(
-                    active_set=self._active_set(),
-                    name=name,
-                    status=status,
-                    run=run,
-                    profile=profile,
-                    fs_addr=f"{self._fileshare.host}:{self._fileshare.port}",
-                )
-            )
+    def update_peer_state(self, name, status, run, profile, now=None):
+        if self.lan is None or self.lan.q is None:
+            return
+        now = now if now is not None else time.time()
+        state = dict(
+            # The acquired set ID stands in for _active_set(), which rebuilds the job
+            active_set=self.set_id if self.job_id is not None else None,
+            name=name,
+            status=status,
+            run=run,
+            profile=profile,
+            fs_addr=f"{self._fileshare.host}:{self._fileshare.port}",
+        )
+        if (
+            state == self._peer_state
+            and now < self._peer_state_ts + self.PEER_HEARTBEAT_SEC
+        ):
+            return
+        self._peer_state = state
+        self._peer_state_ts = now
+        self.lan.q.syncPeer(dict(state))
 
     def set_job(self, jid: str, manifest: dict):
         # Preserve peer address of job if present in the manifest
@@ -149,13 +189,38 @@ class LANQueue(AbstractEditableQueue):
                 if s.id == self.set_id:
                     return s
 
+    def _schedulable(self, data) -> bool:
+        # Jobs acquired by somebody else aren't considered for scheduling
+        acq = data.get("acquired_by_")
+        return acq is None or acq == self.addr
+
+    def next_gjob(self):
+        # (fileshare address, hash) of the first job after the current one which
+        # could be acquired, for prefetching. Unlike _peek(), this never modifies jobs.
+        if self.lan is None or self.lan.q is None:
+            return None
+        peers = None
+        for data in self._get_jobs():
+            if data["id"] == self.job_id or not self._schedulable(data):
+                continue
+            job = LANJobView(data, self)
+            if job.hash is None or job.remaining_prints() == 0:
+                continue
+            if not job._next_set(self._profile, None)[1]:
+                continue  # Nothing printable with our profile
+            if peers is None:
+                peers = self._get_peers()
+            peer = peers.get(job.peer)
+            if peer is not None and peer.get("fs_addr") is not None:
+                return (peer["fs_addr"], job.hash)
+        return None
+
     def _peek(self):
         if self.lan is None or self.lan.q is None:
             return (None, None)
         for data in self._get_jobs():
-            acq = data.get("acquired_by_")
-            if acq is not None and acq != self.addr:
-                continue  # Acquired by somebody else, so don't consider for scheduling
+            if not self._schedulable(data):
+                continue
             job = LANJobView(data, self)
             s = job.next_set(self._profile)
             if s is not None:
@@ -199,6 +264,16 @@ class LANQueue(AbstractEditableQueue):
         else:
             raise Exception("Cannot decrement; no job acquired")
 
+    def peer_count(self) -> int:
+        if self.lan is None or self.lan.q is None:
+            return 0
+        return len(self.lan.q.getPeers())
+
+    def remaining_prints(self) -> int:
+        if self.lan is None or self.lan.q is None:
+            return 0
+        return sum(LANJobView(j, self).remaining_prints() for j in self._get_jobs())
+
     def _active_set(self):
         assigned = self.get_set()
         if assigned is not None:
@@ -273,6 +348,30 @@ class LANQueue(AbstractEditableQueue):
     def mv_job(self, job_id, after_id):
         self.lan.q.jobs.mv(job_id, after_id)
 
+    def mv_jobs(self, job_ids, after_id):
+        # Each move is a separate replicated operation, so only jobs which are out of
+        # place get moved; the longest run of jobs already in order stays put.
+        current = [jid for (jid, _) in self.lan.q.jobs.ordered_items()]
+        moving = set(job_ids)
+        if len(moving) != len(job_ids) or not moving.issubset(current):
+            raise ValueError(f"Job IDs must be unique and within queue {self.ns}")
+        rest = [jid for jid in current if jid not in moving]
+        if after_id is None:
+            idx = 0
+        elif after_id in rest:
+            idx = rest.index(after_id) + 1
+        else:
+            raise ValueError(f"Job {after_id} is not an unmoved job in queue {self.ns}")
+        target = rest[:idx] + list(job_ids) + rest[idx:]
+
+        pos = dict((jid, i) for i, jid in enumerate(current))
+        keep = _longest_increasing(target, pos)
+        prev = None
+        for jid in target:
+            if jid not in keep:
+                self.lan.q.jobs.mv(jid, prev)
+            prev = jid
+
     def _path_exists(self, fullpath):
         return Path(fullpath).exists()
 
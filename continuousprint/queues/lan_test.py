@@ -2,14 +2,14 @@ import unittest
 import logging
 import tempfile
 from datetime import datetime
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 from .abstract import Strategy
 from .abstract_test import (
     AbstractQueueTests,
     EditableQueueTests,
     testJob as makeAbstractTestJob,
 )
-from .lan import LANQueue, ValidationError
+from .lan import LANQueue, ValidationError, _longest_increasing
 from ..storage.database import JobView, SetView
 from peerprint.lan_queue_test import LANQueueLocalTest as PeerPrintLANTest
 
@@ -59,6 +59,32 @@ class TestEditableImpl(EditableQueueTests, LANQueueTest):
             for i in range(EditableQueueTests.NUM_TEST_JOBS)
         ]
 
+    def test_mv_jobs_moves_only_out_of_place(self):
+        jobs = self.q.lan.q.jobs
+        with patch.object(jobs, "mv", wraps=jobs.mv) as mv:
+            # Reverse-rotating by one only requires moving the last job
+            self.q.mv_jobs([self.jids[i] for i in (3, 0, 1, 2)], None)
+        mv.assert_called_once_with(self.jids[3], None)
+        jids = [j["id"] for j in self.q.as_dict()["jobs"]]
+        self.assertEqual(jids, [self.jids[i] for i in (3, 0, 1, 2)])
+
+
+class TestLongestIncreasing(unittest.TestCase):
+    def test_longest_increasing(self):
+        for items, want in [
+            ([], set()),
+            (["a"], {"a"}),
+            (["d", "a", "b", "c"], {"a", "b", "c"}),
+            (["b", "a", "d", "c", "e"], {"a", "c", "e"}),
+        ]:
+            key = dict((k, ord(k)) for k in items)
+            with self.subTest(items=items):
+                got = _longest_increasing(items, key)
+                self.assertEqual(len(got), len(want))
+                self.assertEqual(
+                    [i for i in items if i in got], sorted(got, key=key.get)
+                )
+
 
 class TestLANQueueNoConnection(LANQueueTest):
     def test_update_peer_state(self):
@@ -79,6 +105,61 @@ class TestLANQueueConnected(LANQueueTest):
             "a": dict(fs_addr="123", profile=dict(name="abc")),
         }
 
+    def test_peer_count(self):
+        self.assertEqual(self.q.peer_count(), 1)
+
+    def test_remaining_prints(self):
+        self.q.lan.q.getLocks.return_value = {}
+        sets = [
+            dict(path="a.gcode", count=2, remaining=1),
+            dict(path="b.gcode", count=1, remaining=0),
+        ]
+        self.q.lan.q.getJobs.return_value = [
+            ("j1", ("peer", dict(id="j1", count=3, remaining=2, sets=sets))),
+            ("j2", ("peer", dict(id="j2", count=1, draft=True, sets=sets))),
+        ]
+        self.assertEqual(self.q.remaining_prints(), 1 + 3)
+
+    def test_next_gjob(self):
+        self.q.lan.q.getLocks.return_value = {"j2": "otherpeer"}
+        sets = [dict(path="a.gcode", count=1, profiles=["profile"])]
+        job = lambda jid, **kw: (
+            jid,
+            ("a", dict(dict(id=jid, hash=f"h{jid}", count=1, sets=sets), **kw)),
+        )
+        self.q.lan.q.getJobs.return_value = [
+            job("j1"),  # Currently acquired by us
+            job("j2"),  # Acquired by somebody else
+            job("j3", draft=True),
+            job("j4", remaining=0),
+            job("j5", sets=[dict(path="b.gcode", count=1, profiles=["other"])]),
+            job("j6"),
+        ]
+        self.q.job_id = "j1"
+        self.assertEqual(self.q.next_gjob(), ("123", "hj6"))
+        self.q.lan.q.setJob.assert_not_called()
+
+    def test_next_gjob_none(self):
+        self.q.lan.q.getLocks.return_value = {}
+        self.q.lan.q.getJobs.return_value = []
+        self.assertEqual(self.q.next_gjob(), None)
+
+    def test_update_peer_state_skips_unchanged(self):
+        self.q.update_peer_state("HI", "IDLE", None, {}, now=100)
+        self.q.update_peer_state("HI", "IDLE", None, {}, now=101)
+        self.q.lan.q.syncPeer.assert_called_once()
+
+        self.q.update_peer_state("HI", "BUSY", None, {}, now=102)
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+        self.assertEqual(self.q.lan.q.syncPeer.call_args[0][0]["status"], "BUSY")
+
+    def test_update_peer_state_heartbeat(self):
+        self.q.update_peer_state("HI", "IDLE", None, {}, now=100)
+        self.q.update_peer_state(
+            "HI", "IDLE", None, {}, now=100 + LANQueue.PEER_HEARTBEAT_SEC
+        )
+        self.assertEqual(self.q.lan.q.syncPeer.call_count, 2)
+
     def test_get_gjob_dirpath_failed_bad_peer(self):
         with self.assertRaises(Exception):
             self.q.get_gjob_dirpath("b", "hash")
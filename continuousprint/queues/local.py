@@ -17,10 +17,12 @@ class LocalQueue(AbstractFactoryQueue):
         profile: dict,
         path_on_disk_fn,
         mkdir_fn,
+        path_cache=None,
     ):
         super().__init__()
         self._path_on_disk = path_on_disk_fn
         self._mkdir = mkdir_fn
+        self._path_cache = path_cache
         self.ns = queueName
         self._profile = profile
         j = queries.getAcquiredJob()
@@ -40,6 +42,8 @@ class LocalQueue(AbstractFactoryQueue):
             path is None
         ):  # For SD cards etc. assume existence if we can't interrogate the storage layer
             return True
+        if self._path_cache is not None:
+            return self._path_cache.exists(path)
         return Path(path).exists()
 
     # --------------------- Begin AbstractQueue ------------------
@@ -74,6 +78,9 @@ class LocalQueue(AbstractFactoryQueue):
             self.ns, self._profile, self._set_path_exists
         )
         if has_work and earliest_job == self.job and self.job.acquired:
+            # The earliest job is a freshly loaded snapshot with its sets
+            # already fetched, so use it in place of our stale copy.
+            self.job = earliest_job
             self.set = self.job.next_set(self._profile, self._set_path_exists)
             return True
         else:
@@ -122,21 +129,14 @@ class LocalQueue(AbstractFactoryQueue):
             for s in manifest["sets"]:
                 s["path"] = os.path.join(dest_dir, s["path"])
 
-        # TODO make transaction, move to storage/queries.py
-        j = self.add_job()
-        for (k, v) in manifest.items():
-            if k in ("peer_", "sets", "id", "acquired", "queue"):
-                continue
-            setattr(j, k, v)
-        j.save()
-        for s in manifest["sets"]:
-            del s["id"]
-            self.add_set(j.id, s)
-        return j.id
+        return self.add_jobs([manifest])[0]["job_id"]
 
     def mv_job(self, job_id, after_id):
         return self.queries.moveJob(job_id, after_id)
 
+    def mv_jobs(self, job_ids, after_id):
+        return self.queries.reorderJobs(self.ns, job_ids, after_id)
+
     def edit_job(self, job_id, data):
         return self.queries.updateJob(job_id, data)
 
@@ -150,6 +150,9 @@ class LocalQueue(AbstractFactoryQueue):
     def add_set(self, job_id, data) -> SetView:
         return self.queries.appendSet(self.ns, job_id, data)
 
+    def add_jobs(self, jobs: list) -> list:
+        return self.queries.bulkImport(self.ns, jobs)
+
     def import_job(self, gjob_path: str, draft=True) -> dict:
         out_dir = str(Path(gjob_path).stem)
         self._mkdir(out_dir)
@@ -3,7 +3,6 @@ import logging
 from ..storage.database_test import QueuesDBTest
 from ..storage import queries
 from ..storage.lan import LANJobView
-from ..storage.database import JobView
 from unittest.mock import MagicMock
 from .abstract import Strategy, QueueData
 from .abstract_test import (
@@ -70,10 +69,7 @@ class TestLocalQueueImportFromLAN(unittest.TestCase):
         # gcode files copied from the remote peer, in a way which
         # doesn't get auto-cleaned (as in the fileshare/ directory)
         lq = MagicMock()
-        j = JobView()
-        j.id = "567"
-        j.save = MagicMock()
-        self.q.queries.newEmptyJob.return_value = j
+        self.q.queries.bulkImport.return_value = [dict(job_id=567, set_ids=[1])]
         manifest = dict(
             name="test_job",
             id="123",
@@ -83,12 +79,12 @@ class TestLocalQueueImportFromLAN(unittest.TestCase):
         )
         cp = MagicMock()
         lq.get_gjob_dirpath.return_value = "gjob_dirpath"
-        self.q.import_job_from_view(LANJobView(manifest, lq), cp)
+        self.assertEqual(self.q.import_job_from_view(LANJobView(manifest, lq), cp), 567)
 
         wantdir = "ContinuousPrint/imports/test_job_123"
         cp.assert_called_with("gjob_dirpath", wantdir)
-        _, args, _ = self.q.queries.appendSet.mock_calls[-1]
-        self.assertEqual(args[2]["path"], wantdir + "/a.gcode")
+        _, args, _ = self.q.queries.bulkImport.mock_calls[-1]
+        self.assertEqual(args[1][0]["sets"][0]["path"], wantdir + "/a.gcode")
 
 
 class TestLocalQueueInOrderNoInitialJob(unittest.TestCase):
@@ -190,3 +186,22 @@ class TestSD(unittest.TestCase):
 
     def testSDPrintExists(self):
         self.skipTest("TODO")
+
+
+class TestLocalQueuePathCache(unittest.TestCase):
+    def testSetPathExistsUsesCache(self):
+        queries = MagicMock()
+        queries.getAcquiredJob.return_value = None
+        cache = MagicMock()
+        cache.exists.return_value = False
+        q = LocalQueue(
+            queries,
+            "testQueue",
+            Strategy.IN_ORDER,
+            dict(name="profile"),
+            lambda p, sd: f"/disk/{p}",
+            MagicMock(),
+            cache,
+        )
+        self.assertEqual(q._set_path_exists(dict(path="a.gcode", sd=False)), False)
+        cache.exists.assert_called_with("/disk/a.gcode")
@@ -8,8 +8,9 @@ import dataclasses
 # Note that runs are implemented at this level and not lower queue levels,
 # so that history can be appropriately preserved for all queue types
 class MultiQueue(AbstractQueue):
-    def __init__(self, queries, strategy, update_cb):
+    def __init__(self, queries, strategy, update_cb, metrics=None):
         super().__init__()
+        self.metrics = metrics
         self.queries = queries
         self.strategy = strategy
         self.queues = {}
@@ -60,7 +61,9 @@ class MultiQueue(AbstractQueue):
                 self.get_job().name,
                 self.get_set().path,
             )
-            self.update_cb()
+            if self.metrics is not None:
+                self.metrics.invalidate_runs()
+            self.update_cb(self.run)
 
     def get_run(self) -> Optional[Run]:
         return self.run
@@ -68,8 +71,10 @@ class MultiQueue(AbstractQueue):
     def end_run(self, result) -> None:
         if self.run is not None:
             self.queries.endRun(self.run, result)
+            if self.metrics is not None:
+                self.metrics.invalidate_runs()
             self.decrement()
-            self.update_cb()
+            self.update_cb(self.run)
 
     # ---------- AbstractQueue Implementation -----------
 
@@ -94,6 +99,8 @@ class MultiQueue(AbstractQueue):
 
     def decrement(self) -> bool:
         if self.active_queue is not None:
+            if self.metrics is not None:
+                self.metrics.decremented(self.active_queue.ns)
             continue_job = self.active_queue.decrement()
             if not continue_job:
                 self.active_queue = None
@@ -9,7 +9,7 @@ from .multi import MultiQueue
 
 class TestMultiQueue(unittest.TestCase):
     def setUp(self):
-        def onupdate():
+        def onupdate(run=None):
             pass
 
         self.q = MultiQueue(MagicMock(), Strategy.IN_ORDER, onupdate)
@@ -45,3 +45,12 @@ class TestMultiQueue(unittest.TestCase):
         self.q.end_run("result")
         self.q.queries.endRun.assert_called()
         self.q.queries.release.assert_not_called()
+
+    def test_metrics_updated(self):
+        self.q.metrics = MagicMock()
+        self.q.active_queue = MagicMock(ns="q1")
+        self.q.begin_run()
+        self.q.metrics.invalidate_runs.assert_called_once()
+        self.q.end_run("success")
+        self.assertEqual(self.q.metrics.invalidate_runs.call_count, 2)
+        self.q.metrics.decremented.assert_called_with("q1")
@@ -1,3 +1,7 @@
+import ast
+import hashlib
+import re
+import threading
 import time
 from io import BytesIO, StringIO
 
@@ -9,10 +13,46 @@ from octoprint.printer import InvalidFileLocation, InvalidFileType
 from octoprint.server import current_user
 from .storage.lan import ResolveError
 from .data import TEMP_FILE_DIR, CustomEvents
-from .storage.queries import genEventScript
+from .storage.database import DB
+from .storage.queries import getEventHooks, formatHookScript
+
+
+class CompiledHook:
+    """An event hook with its preprocessor parsed and script placeholders found up front,
+    so running the hook doesn't need to re-parse either."""
+
+    def __init__(self, hook):
+        self.hook = hook
+        pre = hook.preprocessor
+        self.pre_body = None
+        self.pre_ast = None
+        if pre is not None and pre.body.strip() != "":
+            self.pre_body = pre.body
+            try:
+                self.pre_ast = ast.parse(pre.body)
+            except SyntaxError:
+                pass  # Left to the interpreter to report when the hook runs
+        self.leftovers = re.findall(r"\{.*?\}", hook.script.body)
 
 
 class ScriptRunner:
+    # Generated scripts are stored by content hash, so re-running an unchanged
+    # script (e.g. bed clearing after every print) reuses the existing file.
+    # Artifacts unused for this long are removed by cleanup_artifacts().
+    ARTIFACT_TTL = 7 * 24 * 60 * 60
+
+    # Passed as the analysis result for generated scripts, so OctoPrint doesn't spin
+    # up its gcode analysis subprocess for every one. Temp scripts are also excluded
+    # from CPQ's own profile analysis (see plugin._enqueue).
+    ARTIFACT_ANALYSIS = dict(
+        printingArea=dict(),
+        dimensions=dict(),
+        travelArea=dict(),
+        travelDimensions=dict(),
+        estimatedPrintTime=None,
+        filament=dict(),
+    )
+
     def __init__(
         self,
         msg,
@@ -21,8 +61,10 @@ class ScriptRunner:
         printer,
         refresh_ui_state,
         fire_event,
+        metrics=None,
     ):
         self._msg = msg
+        self._metrics = metrics
         self._file_manager = file_manager
         self._logger = logger
         self._printer = printer
@@ -33,6 +75,12 @@ class ScriptRunner:
             external=dict(),
             metadata=dict(),
         )
+        self._interp = None
+        self._interp_lock = threading.Lock()
+        self._base_symtable = None
+        self._compiled = None
+        self._compiled_rev = None
+        self._artifact_used = dict()
 
     def _get_user(self):
         try:
@@ -43,20 +91,58 @@ class ScriptRunner:
     def _wrap_stream(self, name, gcode):
         return StreamWrapper(name, BytesIO(gcode.encode("utf-8")))
 
+    def _artifact_path(self, evt, gcode):
+        digest = hashlib.sha256(gcode.encode("utf-8")).hexdigest()[:16]
+        return str(Path(TEMP_FILE_DIR) / f"{evt.event}_{digest}.gcode")
+
     def _execute_gcode(self, evt, gcode):
-        file_wrapper = self._wrap_stream(evt.event, gcode)
-        path = str(Path(TEMP_FILE_DIR) / f"{evt.event}.gcode")
-        added_file = self._file_manager.add_file(
-            FileDestinations.LOCAL,
-            path,
-            file_wrapper,
-            allow_overwrite=True,
-        )
-        self._logger.info(f"Wrote file {path}")
+        path = self._artifact_path(evt, gcode)
+        if self._file_manager.file_exists(FileDestinations.LOCAL, path):
+            self._logger.info(f"Reusing file {path}")
+        else:
+            self._file_manager.add_file(
+                FileDestinations.LOCAL,
+                path,
+                self._wrap_stream(evt.event, gcode),
+                allow_overwrite=True,
+                analysis=self.ARTIFACT_ANALYSIS,
+            )
+            self._logger.info(f"Wrote file {path}")
+        self._artifact_used[path] = time.time()
         self._printer.select_file(
             path, sd=False, printAfterSelect=True, user=self._get_user()
         )
-        return added_file
+        return path
+
+    def cleanup_artifacts(self, now=None):
+        """Removes generated scripts which haven't been used within ARTIFACT_TTL,
+        except for the one currently selected. Returns the number removed."""
+        if now is None:
+            now = time.time()
+        try:
+            files = self._file_manager.list_files(
+                FileDestinations.LOCAL, path=TEMP_FILE_DIR, recursive=False
+            )[FileDestinations.LOCAL]
+        except Exception:
+            return 0  # Temp dir doesn't exist yet
+
+        current = (self._printer.get_current_job().get("file") or {}).get("path")
+        n = 0
+        for f in files.values():
+            path = f["path"]
+            if f["type"] == "folder" or path == current:
+                continue
+            last_used = max(self._artifact_used.get(path, 0), f.get("date") or 0)
+            if now - last_used < self.ARTIFACT_TTL:
+                continue
+            try:
+                self._file_manager.remove_file(FileDestinations.LOCAL, path)
+            except Exception:
+                self._logger.warning(f"Failed to remove script artifact {path}")
+                continue
+            self._artifact_used.pop(path, None)
+            n += 1
+        return n
 
     def _do_msg(self, evt, running=False):
         if evt == CustomEvents.FINISH:
@@ -95,36 +181,82 @@ class ScriptRunner:
         self._symbols["external"] = symbols
 
     def _get_interpreter(self):
+        # The interpreter is reused across events; resetting its symbol table to the
+        # defaults keeps state from leaking between events.
         out = StringIO()
         err = StringIO()
-        interp = Interpreter(writer=out, err_writer=err)
+        if self._interp is None:
+            self._interp = Interpreter(writer=out, err_writer=err)
+            self._base_symtable = dict(self._interp.symtable)
+        interp = self._interp
+        interp.writer = out
+        interp.err_writer = err
+        interp.error = []
+        interp.symtable.clear()
+        interp.symtable.update(self._base_symtable)
         # Merge in so default symbols (e.g. exceptions) are retained
         for (k, v) in self._symbols.items():
             interp.symtable[k] = v
         return interp, out, err
 
-    def run_script_for_event(self, evt, msg=None, msgtype=None):
-        interp, out, err = self._get_interpreter()
-        gcode = genEventScript(evt, interp, self._logger)
-        if len(interp.error) > 0:
-            for err in interp.error:
-                self._logger.error(err.get_error())
-                self._msg(
-                    f"CPQ {evt.displayName} Preprocessor:\n{err.get_error()}",
-                    type="error",
+    def _compiled_hooks(self):
+        rev = DB.automation_rev
+        if self._compiled is None or self._compiled_rev != rev:
+            self._compiled = dict(
+                (evt, [CompiledHook(h) for h in hooks])
+                for evt, hooks in getEventHooks().items()
+            )
+            self._compiled_rev = rev
+        return self._compiled
+
+    def _eval(self, interp, c):
+        if c.pre_ast is None:
+            return interp.eval(c.pre_body)
+        # The cached AST skips re-parsing, but eval() then only has the AST to quote
+        # in error messages - point them at the source instead.
+        result = interp.eval(c.pre_ast, show_errors=False)
+        for e in interp.error:
+            e.expr = c.pre_body
+        return result
+
+    def _gen_script(self, evt, interp):
+        result = []
+        for c in self._compiled_hooks().get(evt.event, []):
+            procval = True
+            if c.pre_body is not None:
+                procval = self._eval(interp, c)
+                self._logger.info(
+                    f"EventHook preprocessor for script {c.hook.script.name} ({c.hook.preprocessor.name}): {c.pre_body}\nSymbols: {self._symbols}\nResult: {procval}"
                 )
-            gcode = "@pause"  # Exceptions mean we must wait for the user to act
-        else:
-            err.seek(0)
-            err_output = err.read().strip()
-            if len(err_output) > 0:
-                self._logger.error(err_output)
-            out.seek(0)
-            interp_output = out.read().strip()
-            if len(interp_output) > 0:
-                self._msg(f"CPQ {evt.displayName} Preprocessor:\n{interp_output}")
+            formatted = formatHookScript(c.hook, procval, self._logger, c.leftovers)
+            if formatted is not None:
+                result.append(formatted)
+        return "\n".join(result)
+
+    def run_script_for_event(self, evt, msg=None, msgtype=None):
+        start = time.perf_counter()
+        with self._interp_lock:
+            interp, out, err = self._get_interpreter()
+            gcode = self._gen_script(evt, interp)
+            if len(interp.error) > 0:
+                for err in interp.error:
+                    self._logger.error(err.get_error())
+                    self._msg(
+                        f"CPQ {evt.displayName} Preprocessor:\n{err.get_error()}",
+                        type="error",
+                    )
+                gcode = "@pause"  # Exceptions mean we must wait for the user to act
             else:
-                self._do_msg(evt, running=(gcode != ""))
+                err.seek(0)
+                err_output = err.read().strip()
+                if len(err_output) > 0:
+                    self._logger.error(err_output)
+                out.seek(0)
+                interp_output = out.read().strip()
+                if len(interp_output) > 0:
+                    self._msg(f"CPQ {evt.displayName} Preprocessor:\n{interp_output}")
+                else:
+                    self._do_msg(evt, running=(gcode != ""))
 
         # Cancellation happens before custom scripts are run
         if evt == CustomEvents.PRINT_CANCEL:
@@ -137,6 +269,8 @@ class ScriptRunner:
             self._printer.set_temperature("bed", 0)  # turn bed off
 
         self._fire_event(evt)
+        if self._metrics is not None:
+            self._metrics.script_run(evt.name, time.perf_counter() - start)
         return result
 
     def start_print(self, item):
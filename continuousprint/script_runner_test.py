@@ -13,6 +13,7 @@ import logging
 
 LI = namedtuple("LocalItem", ["sd", "path", "job"])
 LJ = namedtuple("Job", ["name"])
+FINISH_PATH = "ContinuousPrint/tmp/continuousprint_finish_2c26b46b68ffc68f.gcode"
 
 
 class TestScriptRunner(unittest.TestCase):
@@ -30,26 +31,79 @@ class TestScriptRunner(unittest.TestCase):
         self.s._wrap_stream = MagicMock(return_value=None)
         self.s._get_interpreter = lambda: (MagicMock(error=[]), StringIO(), StringIO())
 
-    @patch("continuousprint.script_runner.genEventScript", return_value="foo")
+    @patch.object(ScriptRunner, "_gen_script", return_value="foo")
     def test_run_script_for_event(self, ges):
         # Note: default scripts are populated on db_init for FINISH and PRINT_SUCCESS
+        self.s._file_manager.file_exists.return_value = False
         self.s.run_script_for_event(CustomEvents.FINISH)
-        self.s._file_manager.add_file.assert_called()
+        self.s._file_manager.add_file.assert_called_with(
+            "local",
+            FINISH_PATH,
+            ANY,
+            allow_overwrite=True,
+            analysis=ScriptRunner.ARTIFACT_ANALYSIS,
+        )
         self.s._printer.select_file.assert_called_with(
-            "ContinuousPrint/tmp/continuousprint_finish.gcode",
+            FINISH_PATH,
             sd=False,
             printAfterSelect=True,
             user="foo",
         )
         self.s._fire_event.assert_called_with(CustomEvents.FINISH)
 
-    @patch("continuousprint.script_runner.genEventScript", return_value="")
+    @patch.object(ScriptRunner, "_gen_script", return_value="foo")
+    def test_run_script_for_event_records_latency(self, ges):
+        self.s._metrics = MagicMock()
+        self.s.run_script_for_event(CustomEvents.FINISH)
+        self.s._metrics.script_run.assert_called_with("FINISH", ANY)
+
+    @patch.object(ScriptRunner, "_gen_script", return_value="foo")
+    def test_run_script_for_event_reuses_file(self, ges):
+        self.s._file_manager.file_exists.return_value = True
+        self.s.run_script_for_event(CustomEvents.FINISH)
+        self.s._file_manager.add_file.assert_not_called()
+        self.s._printer.select_file.assert_called_with(
+            FINISH_PATH,
+            sd=False,
+            printAfterSelect=True,
+            user="foo",
+        )
+
+    def test_artifact_path_by_content(self):
+        a = self.s._artifact_path(CustomEvents.FINISH, "G0 X1")
+        self.assertEqual(a, self.s._artifact_path(CustomEvents.FINISH, "G0 X1"))
+        self.assertNotEqual(a, self.s._artifact_path(CustomEvents.FINISH, "G0 X2"))
+        self.assertNotEqual(a, self.s._artifact_path(CustomEvents.COOLDOWN, "G0 X1"))
+
+    def test_cleanup_artifacts(self):
+        ttl = ScriptRunner.ARTIFACT_TTL
+        files = dict(
+            (p, dict(path=f"ContinuousPrint/tmp/{p}", type="machinecode", date=d))
+            for p, d in (("old", 0), ("new", ttl), ("current", 0), ("used", 0))
+        )
+        files["dir"] = dict(path="ContinuousPrint/tmp/dir", type="folder", date=0)
+        self.s._file_manager.list_files.return_value = dict(local=files)
+        self.s._printer.get_current_job.return_value = dict(
+            file=dict(path="ContinuousPrint/tmp/current")
+        )
+        self.s._artifact_used["ContinuousPrint/tmp/used"] = ttl
+
+        self.assertEqual(self.s.cleanup_artifacts(now=ttl + 1), 1)
+        self.s._file_manager.remove_file.assert_called_once_with(
+            "local", "ContinuousPrint/tmp/old"
+        )
+
+    def test_cleanup_artifacts_no_dir(self):
+        self.s._file_manager.list_files.side_effect = Exception("not found")
+        self.assertEqual(self.s.cleanup_artifacts(), 0)
+
+    @patch.object(ScriptRunner, "_gen_script", return_value="")
     def test_run_script_for_event_cancel(self, ges):
         # Script run behavior is already tested in test_run_script_for_event
         self.s.run_script_for_event(CustomEvents.PRINT_CANCEL)
         self.s._printer.cancel_print.assert_called()
 
-    @patch("continuousprint.script_runner.genEventScript", return_value="")
+    @patch.object(ScriptRunner, "_gen_script", return_value="")
     def test_run_script_for_event_cooldown(self, ges):
         # Script run behavior is already tested in test_run_script_for_event
         self.s.run_script_for_event(CustomEvents.COOLDOWN)
@@ -153,6 +207,9 @@ class TestWithInterpreter(AutomationDBTest):
         self.s.run_script_for_event(CustomEvents.ACTIVATE)
         self.s._execute_gcode.assert_called_with(ANY, "@pause")
         self.assertRegex(self.s._msg.call_args[0][0], "testing exception")
+        # Errors quote the preprocessor source rather than its cached AST
+        self.assertIn("raise Exception(", self.s._msg.call_args[0][0])
+        self.assertNotIn("ast.Module", self.s._msg.call_args[0][0])
 
     def test_run_script_has_output(self):
         queries.assignAutomation(
@@ -164,3 +221,50 @@ class TestWithInterpreter(AutomationDBTest):
         self.s._execute_gcode.assert_called_with(ANY, "G0 X20")
         self.s._msg.assert_called_once()
         self.assertRegex(self.s._msg.call_args[0][0], "test message")
+
+    def test_hooks_compiled_once_until_changed(self):
+        queries.assignAutomation(
+            dict(foo="G0 X{direction}"),
+            dict(bar="{'direction': 5}"),
+            {CustomEvents.ACTIVATE.event: [dict(script="foo", preprocessor="bar")]},
+        )
+        with patch(
+            "continuousprint.script_runner.getEventHooks",
+            wraps=queries.getEventHooks,
+        ) as geh:
+            self.s.run_script_for_event(CustomEvents.ACTIVATE)
+            self.s.run_script_for_event(CustomEvents.ACTIVATE)
+            self.assertEqual(geh.call_count, 1)
+
+            queries.assignAutomation(
+                dict(foo="G0 Y{direction}"),
+                dict(bar="{'direction': 7}"),
+                {CustomEvents.ACTIVATE.event: [dict(script="foo", preprocessor="bar")]},
+            )
+            self.s.run_script_for_event(CustomEvents.ACTIVATE)
+            self.assertEqual(geh.call_count, 2)
+        self.s._execute_gcode.assert_called_with(ANY, "G0 Y7")
+
+    def test_interpreter_reused_without_leaking_symbols(self):
+        queries.assignAutomation(
+            dict(s1="G0 X{direction}"),
+            dict(
+                p1="if 'd' in dir(): d += 1\nelse: d = 1\n{'direction': d}",
+            ),
+            {CustomEvents.ACTIVATE.event: [dict(script="s1", preprocessor="p1")]},
+        )
+        self.s.run_script_for_event(CustomEvents.ACTIVATE)
+        interp = self.s._interp
+        self.s.run_script_for_event(CustomEvents.ACTIVATE)
+        self.assertIs(self.s._interp, interp)
+        self.s._execute_gcode.assert_called_with(ANY, "G0 X1")
+
+    def test_syntax_error_reported(self):
+        queries.assignAutomation(
+            dict(foo="G0 X20"),
+            dict(bar="1 +"),
+            {CustomEvents.ACTIVATE.event: [dict(script="foo", preprocessor="bar")]},
+        )
+        self.s.run_script_for_event(CustomEvents.ACTIVATE)
+        self.s._execute_gcode.assert_called_with(ANY, "@pause")
+        self.assertRegex(self.s._msg.call_args[0][0], "Syntax")
@@ -0,0 +1,138 @@
+"""Benchmarks header/footer scanning for profile inference over synthetic
+PrusaSlicer, Kiri:Moto and Cura files, comparing against the previous
+line-by-line implementation.
+
+Usage (from the repository root):
+    python3 -m continuousprint.scripts.benchmark_extract_profile [size_mb ...]
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+from continuousprint.scripts import extract_profile as ep
+
+DEFAULT_SIZES_MB = [1, 10, 100]
+THUMBNAIL_BYTES = 2 * 1024 * 1024  # Base64 thumbnail block in the header
+
+MOVES = b"".join(
+    f"G1 X{i % 200}.{i % 10} Y{(i * 7) % 200}.5 E{i * 0.01:.4f}\n".encode()
+    for i in range(1000)
+)
+
+
+def prusaslicer_header():
+    thumb = b"; " + b"A" * 76 + b"\n"
+    return (
+        b"; generated by PrusaSlicer 2.5.0+linux-x64 on 2022-10-01 at 12:00:00 UTC\n"
+        + b"\n; thumbnail begin 400x300 123456\n"
+        + thumb * (THUMBNAIL_BYTES // len(thumb))
+        + b'; thumbnail end\n\nM73 P0 R60\nM862.3 P "MK3S"\nG28 W\n'
+    )
+
+
+def prusaslicer_footer():
+    keys = [f"; setting_{i:03d} = {'x' * (i % 40)}\n" for i in range(300)]
+    keys[150] = "; printer_model = MK3S\n"
+    return b"M107\n; filament used [mm] = 1234.5\n; prusaslicer_config = begin\n" + (
+        "".join(keys).encode() + b"; prusaslicer_config = end\n"
+    )
+
+
+STYLES = dict(
+    prusaslicer=(prusaslicer_header, prusaslicer_footer),
+    kirimoto=(
+        lambda: b"; Generated by Kiri:Moto\n; Target: Creality.CR-30\n; --- process ---\nG28\n",
+        lambda: b"; --- shutdown ---\nM104 S0\n",
+    ),
+    cura=(
+        lambda: b";FLAVOR:Marlin\n;TIME:6666\n;Generated with Cura_SteamEngine 5.2.1\n"
+        + b";MACHINE_NAME:Creality Ender-3\nG28\n",
+        lambda: b"M107\n;End of Gcode\n" + b';SETTING_3 {"global_quality": 1}\n' * 50,
+    ),
+)
+
+
+def write_file(path, style, size):
+    header, footer = STYLES[style]
+    with open(path, "wb") as f:
+        f.write(header())
+        while f.tell() < size:
+            f.write(MOVES)
+        f.write(footer())
+
+
+# The line-by-line implementation which preceded the mmap scanner, for comparison
+_legacy_move_re = re.compile("^G[012] .*")
+_legacy_multiline_re = re.compile("\nG[012] .*", re.M)
+
+
+def legacy_header(path):
+    hdr = []
+    with open(path, errors="replace") as f:
+        for line in f:
+            if line.strip() == "":
+                continue
+            if _legacy_move_re.match(line):
+                return hdr
+            hdr.append(line)
+    return hdr
+
+
+def legacy_footer(path):
+    hdr = []
+    JUMP = 200
+    with open(path, "rb") as f:
+        try:
+            f.seek(-JUMP, os.SEEK_END)
+            while not _legacy_multiline_re.match(f.read(JUMP).decode("utf8")):
+                f.seek(-2 * JUMP, os.SEEK_CUR)
+            f.seek(-JUMP, os.SEEK_END)
+            for line in f:
+                ln = line.decode("utf8")
+                if ln.startswith(";"):
+                    hdr.append(ln)
+        except (OSError, UnicodeDecodeError):
+            pass
+    return hdr
+
+
+def timeit(fn, path, reps):
+    start = time.perf_counter()
+    for _ in range(reps):
+        result = fn(path)
+    return (time.perf_counter() - start) / reps, result
+
+
+def main(sizes_mb, reps=5):
+    print(
+        f"{'style':<13}{'size':>7}{'legacy (ms)':>14}{'mmap (ms)':>12}"
+        f"{'speedup':>10}  {'legacy profile':<18}profile"
+    )
+    with tempfile.TemporaryDirectory() as td:
+        for style in STYLES:
+            for mb in sizes_mb:
+                path = os.path.join(td, f"{style}_{mb}.gcode")
+                write_file(path, style, mb * 1024 * 1024)
+                before, (hdr, ftr) = timeit(
+                    lambda p: (legacy_header(p), legacy_footer(p)), path, reps
+                )
+                after, _ = timeit(
+                    lambda p: (ep.get_header(p), ep.get_footer(p)), path, reps
+                )
+                legacy_prof = ep.get_profile(hdr, ftr)
+                prof = ep.infer_profile(path)
+                os.remove(path)
+                print(
+                    f"{style:<13}{mb:>5}MB{before * 1000:>14.2f}{after * 1000:>12.2f}"
+                    f"{before / after:>9.1f}x  {str(legacy_prof):<18}{prof}"
+                )
+
+    print(f"\n{'processor':<13}{'calls':>7}{'per call (us)':>16}")
+    for name, (calls, seconds) in ep.processor_timings().items():
+        if calls > 0:
+            print(f"{name:<13}{calls:>7}{seconds / calls * 1e6:>16.1f}")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or DEFAULT_SIZES_MB)
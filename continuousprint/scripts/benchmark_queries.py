@@ -0,0 +1,110 @@
+"""Benchmarks hot queries against a synthetic queue DB, before and after
+the indexes added in schema v0.0.6.
+
+Usage (from the repository root):
+    python3 -m continuousprint.scripts.benchmark_queries [num_runs]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+from peewee import chunked
+from continuousprint.storage.database import (
+    init_queues,
+    migrateQueuesV5ToV6,
+    StorageDetails,
+    Queue,
+    Job,
+    Run,
+    DB,
+    DEFAULT_QUEUE,
+)
+from continuousprint.storage import queries
+
+NUM_JOBS = 1000
+NUM_PATHS = 50
+
+QUERIES = [
+    (
+        "getActiveRun",
+        lambda: queries.getActiveRun(DEFAULT_QUEUE, "job7", "part7.gcode"),
+    ),
+    ("getHistory", queries.getHistory),
+    ("annotateLastRun", lambda: queries.annotateLastRun("none.gcode", None, None)),
+    ("getAcquiredJob", queries.getAcquiredJob),
+]
+
+# Columns of the indexes added in v0.0.6, by table
+V6_INDEXES = dict(run=[["jobName", "end"], ["start"]], job=[["acquired"]])
+
+
+def populate(num_runs):
+    q = Queue.get(name=DEFAULT_QUEUE)
+    t0 = datetime.datetime(2022, 1, 1)
+    with DB.queues.atomic():
+        jobs = [
+            dict(queue=q.id, name=f"job{i}", rank=i, draft=False)
+            for i in range(NUM_JOBS)
+        ]
+        for batch in chunked(jobs, 100):
+            Job.insert_many(batch).execute()
+        Job.update(acquired=True).where(Job.id == NUM_JOBS // 2).execute()
+
+        runs = (
+            dict(
+                queueName=DEFAULT_QUEUE,
+                jobName=f"job{i % NUM_JOBS}",
+                path=f"part{i % NUM_PATHS}.gcode",
+                start=t0 + datetime.timedelta(minutes=30 * i),
+                end=t0 + datetime.timedelta(minutes=30 * i + 20),
+                result="success",
+            )
+            for i in range(num_runs)
+        )
+        for batch in chunked(runs, 100):
+            Run.insert_many(batch).execute()
+
+
+def drop_v6_indexes():
+    for table, cols in V6_INDEXES.items():
+        for idx in DB.queues.get_indexes(table):
+            if idx.columns in cols:
+                DB.queues.execute_sql(f'DROP INDEX "{idx.name}"')
+
+
+def timeit(fn, reps):
+    start = time.perf_counter()
+    for _ in range(reps):
+        fn()
+    return (time.perf_counter() - start) / reps
+
+
+def run_queries(reps):
+    return dict((name, timeit(fn, reps)) for name, fn in QUERIES)
+
+
+def main(num_runs, reps=20):
+    with tempfile.TemporaryDirectory() as td:
+        init_queues(os.path.join(td, "queue.sqlite3"))
+        print(f"Populating {num_runs} runs across {NUM_JOBS} jobs...")
+        populate(num_runs)
+
+        drop_v6_indexes()
+        before = run_queries(reps)
+
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.5"
+        migrateQueuesV5ToV6(details, None)
+        after = run_queries(reps)
+        DB.queues.close()
+
+    print(f"{'query':<20}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for name, _ in QUERIES:
+        b = before[name] * 1000
+        a = after[name] * 1000
+        print(f"{name:<20}{b:>14.3f}{a:>14.3f}{b/a:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,82 @@
+"""Benchmarks consecutive job moves within a large queue, reporting time and rows
+written per move.
+
+Usage (from the repository root):
+    python3 -m continuousprint.scripts.benchmark_ranks [num_moves] [num_jobs]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from peewee import chunked
+from continuousprint.storage.database import init_queues, Queue, Job, DB, DEFAULT_QUEUE
+from continuousprint.storage import queries
+
+
+def populate(num_jobs):
+    q = Queue.get(name=DEFAULT_QUEUE)
+    with DB.queues.atomic():
+        jobs = [
+            dict(queue=q.id, name=f"job{i}", rank=queries._rankEnd() + i)
+            for i in range(num_jobs)
+        ]
+        for batch in chunked(jobs, 100):
+            Job.insert_many(batch).execute()
+    return [j.id for j in Job.select(Job.id).order_by(Job.rank)]
+
+
+def same_gap(order, i):
+    # Worst case: every move lands in the same gap, halving it each time
+    return order[-1], order[len(order) // 2]
+
+
+def random_moves(order, i):
+    src = random.choice(order)
+    dest = random.choice(order + [None])
+    return src, (None if dest == src else dest)
+
+
+PATTERNS = [("same gap", same_gap), ("random", random_moves)]
+
+
+def changes():
+    return DB.queues.execute_sql("SELECT total_changes()").fetchone()[0]
+
+
+def run(pattern, num_moves, num_jobs):
+    with tempfile.TemporaryDirectory() as td:
+        init_queues(os.path.join(td, "queue.sqlite3"))
+        order = populate(num_jobs)
+        c0 = changes()
+        start = time.perf_counter()
+        for i in range(num_moves):
+            src, dest = pattern(order, i)
+            queries.moveJob(src, dest)
+            order.remove(src)
+            order.insert(0 if dest is None else order.index(dest) + 1, src)
+        elapsed = time.perf_counter() - start
+        written = changes() - c0
+        got = [j.id for j in Job.select(Job.id).order_by(Job.rank)]
+        DB.queues.close()
+    if got != order:
+        raise Exception("Job order does not match expected order after moves")
+    return elapsed, written
+
+
+def main(num_moves, num_jobs):
+    print(f"{num_moves} moves in a queue of {num_jobs} jobs")
+    print(f"{'pattern':<12}{'total (s)':>12}{'per move (ms)':>16}{'rows/move':>12}")
+    for name, pattern in PATTERNS:
+        elapsed, written = run(pattern, num_moves, num_jobs)
+        print(
+            f"{name:<12}{elapsed:>12.2f}{elapsed / num_moves * 1000:>16.3f}"
+            f"{written / num_moves:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+    )
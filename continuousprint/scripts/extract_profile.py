@@ -1,14 +1,34 @@
+import functools
+import logging
+import mmap
 import re
 import sys
 import os
+import time
 from continuousprint.data import PRINTER_PROFILES
 
+_logger = logging.getLogger(__name__)
+
+# Upper bounds on how much of a file is scanned for header and footer comments.
+# Headers can carry large thumbnail blocks, but slicer signatures come first.
+HEADER_BUDGET = 1024 * 1024
+FOOTER_BUDGET = 256 * 1024
+
 
 def _strip_nonalpha(s: str):
     assert type(s) is str
     return re.sub("[^0-9a-zA-Z]+", " ", s)
 
 
+class Cancelled(Exception):
+    pass
+
+
+def _check(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
 PROFILES = list(PRINTER_PROFILES.keys())
 CANDIDATES = [
     set(_strip_nonalpha(k).split()).union(
@@ -18,36 +38,88 @@ CANDIDATES = [
 ]
 
 
-class KiriMotoProcessor:
-    @classmethod
-    def match(self, hdr, ftr):
-        for line in hdr:
-            if line.startswith("; Generated by Kiri:Moto"):
-                return True
-        return False
+def _has_toplevel_alternation(pattern: str) -> bool:
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 1
+        elif in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+            if pattern[i + 1 : i + 2] == "^":
+                i += 1
+            if pattern[i + 1 : i + 2] == "]":
+                i += 1  # Leading "]" is a literal
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
 
-    @classmethod
-    def get_profile(self, hdr, ftr) -> str:
-        for line in hdr:
-            if line.startswith("; Target:"):
-                return re.match("; Target: (.*)", line)[1]
+
+def _literal_prefix(pattern: str) -> str:
+    # The leading part of a regex which every match must start with
+    if _has_toplevel_alternation(pattern):
         return ""
+    m = re.match(r"[^\\.^$*+?{}\[\]|()]*", pattern)
+    prefix = m[0]
+    if pattern[len(prefix) : len(prefix) + 1] in ("?", "*", "{"):
+        # The last literal character is optional or repeated a variable number
+        # of times (possibly zero)
+        prefix = prefix[:-1]
+    return prefix
 
 
-class PrusaSlicerProcessor:
-    @classmethod
-    def match(self, hdr, ftr):
-        for line in hdr:
-            if line.startswith("; generated by PrusaSlicer"):
-                return True
-        return False
+class Processor:
+    """Recognizes gcode from a particular slicer and extracts the printer it was
+    sliced for.
 
-    @classmethod
-    def get_profile(self, hdr, ftr) -> str:
-        for line in ftr:
-            if line.startswith("; printer_model = "):
-                return re.match("; printer_model = (.*)", line)[1]
-        return ""
+    `signatures` are prefixes of a header or footer line which identify the slicer,
+    and `keys` are regexes whose first group is the printer description; the
+    first key to match any header/footer line wins. Both are compiled once, on
+    construction. Timing of each processor's key extraction is accumulated in
+    `calls` and `seconds`."""
+
+    def __init__(self, name: str, signatures: list, keys: list):
+        self.name = name
+        self.signatures = tuple(signatures)
+        self._keys = [re.compile(k) for k in keys]
+        # Alternation of all keys, so each line is matched once; group names
+        # record which key matched. Lines are first filtered on the literal
+        # prefixes of the keys, which is much cheaper than a regex match.
+        self._key_re = re.compile(
+            "|".join(f"(?P<k{i}>{k.pattern})" for i, k in enumerate(self._keys))
+        )
+        self._prefixes = tuple(_literal_prefix(k) for k in keys)
+        self.calls = 0
+        self.seconds = 0.0
+
+    def get_profile(self, lines: list) -> str:
+        start = time.perf_counter()
+        try:
+            best = None
+            for line in lines:
+                if not line.startswith(self._prefixes):
+                    continue
+                m = self._key_re.match(line)
+                if m is None:
+                    continue
+                i = int(m.lastgroup[1:])
+                if best is None or i < best[0]:
+                    best = (i, self._keys[i].match(line)[1])
+                if i == 0:
+                    break
+            return "" if best is None else best[1].strip()
+        finally:
+            self.calls += 1
+            self.seconds += time.perf_counter() - start
 
 
 def token_string_match(profstr):
@@ -56,13 +128,12 @@ def token_string_match(profstr):
     p = set(_strip_nonalpha(profstr).split())
 
     scores = [len(p.intersection(c)) for c in CANDIDATES]
-    sys.stderr.write(f"Scoring '{profstr}':\n")
-    desc = sorted(zip(PROFILES, scores), key=lambda x: x[1], reverse=True)
-    for p, s in desc[:4]:
-        if s == 0:
-            continue
-        sys.stderr.write(f"- {p}: {s}\n")
-    sys.stderr.write("- ...\n")
+    if _logger.isEnabledFor(logging.DEBUG):
+        desc = sorted(zip(PROFILES, scores), key=lambda x: x[1], reverse=True)
+        _logger.debug(
+            f"Scoring '{profstr}': "
+            + ", ".join(f"{p}: {s}" for p, s in desc[:4] if s > 0)
+        )
     max_score = max(scores)
     if max_score < 1:
         return None
@@ -70,60 +141,260 @@ def token_string_match(profstr):
     return PROFILES[max_index]
 
 
+# Built-in processors, in order of precedence
 PROCESSORS = [
-    (cls.__name__, cls.match, cls.get_profile)
-    for cls in [KiriMotoProcessor, PrusaSlicerProcessor]
+    Processor("KiriMoto", ["; Generated by Kiri:Moto"], [r"; Target: (.*)"]),
+    Processor(
+        "PrusaSlicer", ["; generated by PrusaSlicer"], [r"; printer_model = (.*)"]
+    ),
+    Processor(
+        "SuperSlicer", ["; generated by SuperSlicer"], [r"; printer_model = (.*)"]
+    ),
+    Processor(
+        "OrcaSlicer",
+        ["; generated by OrcaSlicer"],
+        [r"; printer_model = (.*)", r"; printer_settings_id = (.*)"],
+    ),
+    Processor(
+        "BambuStudio",
+        ["; BambuStudio", "; generated by BambuStudio"],
+        [r"; printer_model = (.*)", r"; printer_settings_id = (.*)"],
+    ),
+    Processor("Cura", [";Generated with Cura_SteamEngine"], [r";MACHINE_NAME:(.*)"]),
+    Processor(
+        "Simplify3D",
+        ["; G-Code generated by Simplify3D"],
+        [r";\s+profileName,(.*)"],
+    ),
 ]
 
-gcode_move_re = re.compile("^G[012] .*")
-gcode_multiline_re = re.compile("\nG[012] .*", re.M)
+# Third party packages can add processors by exposing a Processor (or a list of
+# them) under this entry point group; these take precedence over the built-ins.
+ENTRY_POINT_GROUP = "continuousprint.slicer_processors"
+_registry = None
+
+
+def _entry_point_processors():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    try:
+        eps = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Python < 3.10
+        eps = entry_points().get(ENTRY_POINT_GROUP, [])
+    result = []
+    for ep in eps:
+        try:
+            p = ep.load()
+        except Exception:
+            _logger.exception(f"Failed to load slicer processor {ep.name}")
+            continue
+        result += p if isinstance(p, (list, tuple)) else [p]
+    return result
+
+
+def register_processor(p: Processor, first=True):
+    """Adds a processor to the registry, by default ahead of existing ones."""
+    reg = processors()
+    if first:
+        reg.insert(0, p)
+    else:
+        reg.append(p)
+    _signature_index.cache_clear()
+
+
+def processors() -> list:
+    global _registry
+    if _registry is None:
+        _registry = _entry_point_processors() + list(PROCESSORS)
+    return _registry
+
+
+def processor_timings() -> dict:
+    """Returns (calls, total seconds) of profile extraction for each processor."""
+    return dict((p.name, (p.calls, p.seconds)) for p in processors())
+
+
+@functools.lru_cache(maxsize=1)
+def _signature_index():
+    # All signature prefixes as a single tuple for str.startswith, plus the
+    # registry position of the processor each one belongs to.
+    sigs = []
+    owner = dict()
+    for i, p in enumerate(processors()):
+        for sig in p.signatures:
+            sigs.append(sig)
+            owner.setdefault(sig, i)
+    return tuple(sigs), owner
+
+
+def match_processor(lines: list):
+    """Returns the highest precedence processor whose signature prefixes one of
+    `lines`, or None."""
+    sigs, owner = _signature_index()
+    best = None
+    for line in lines:
+        if not line.startswith(sigs):
+            continue
+        for sig in sigs:
+            if line.startswith(sig) and (best is None or owner[sig] < best):
+                best = owner[sig]
+        if best == 0:
+            break
+    return None if best is None else processors()[best]
+
+
+GCODE_MOVE_CODES = (b"0 ", b"1 ", b"2 ")
+
+
+def _is_move(mm, pos):
+    # True if the line starting at `pos` is a G0/G1/G2 move
+    return mm[pos : pos + 1] == b"G" and mm[pos + 1 : pos + 3] in GCODE_MOVE_CODES
+
+
+def _find_move(mm, start, end):
+    # Returns the offset of the first move line starting in [start, end), or -1.
+    # Searching for b"\nG" runs in C and skips over thumbnails and other comments.
+    if start == 0 and _is_move(mm, 0):
+        return 0
+    pos = start
+    while True:
+        pos = mm.find(b"\nG", pos, end)
+        if pos == -1:
+            return -1
+        if _is_move(mm, pos + 1):
+            return pos + 1
+        pos += 1
+
+
+def _rfind_move(mm, start):
+    # Returns the offset of the last move line starting at or after `start`, or -1
+    end = len(mm)
+    while True:
+        pos = mm.rfind(b"\nG", start, end)
+        if pos == -1:
+            return 0 if start == 0 and _is_move(mm, 0) else -1
+        if _is_move(mm, pos + 1):
+            return pos + 1
+        end = pos + 1
+
+
+def _map(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return None  # Empty files can't be mapped
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
 
+def _next_line(mm, pos):
+    # Returns the offset of the line following the one containing `pos`
+    nl = mm.find(b"\n", pos)
+    return len(mm) if nl == -1 else nl + 1
 
-def get_header(path: str):
-    hdr = []
-    with open(path) as f:
-        for line in f:
-            if line.strip() == "":
-                continue
-            if gcode_move_re.match(line):
-                return hdr
-            hdr.append(line)
-    return hdr
 
+def _decode_lines(data: bytes):
+    # Splitting on newline bytes before decoding can't break up a multi-byte
+    # UTF-8 character; any invalid bytes are replaced rather than raising.
+    lines = data.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    return [ln.rstrip(b"\r").decode("utf8", errors="replace") + "\n" for ln in lines]
 
-def get_footer(path: str):
-    # Adapted from https://stackoverflow.com/a/54278929
-    # Skip back until we start seeing gcode
-    hdr = []
-    JUMP = 200  # Num bytes to jump back and search for gcode
+
+_THUMBNAIL_BEGIN = re.compile(rb"^; (thumbnail(?:_\w+)?) begin\b", re.MULTILINE)
+
+
+def _strip_thumbnails(data: bytes) -> bytes:
+    # Removes embedded thumbnail blocks ("; thumbnail begin" ... "; thumbnail end",
+    # and variants like "; thumbnail_JPG begin"), which can be megabytes of base64
+    # that no processor needs to look at. Config lines such as "; thumbnails = ..."
+    # are kept.
+    parts = []
+    pos = 0
+    while True:
+        m = _THUMBNAIL_BEGIN.search(data, pos)
+        if m is None:
+            break
+        parts.append(data[pos : m.start()])
+        end = re.compile(rb"^; " + m[1] + rb" end\b", re.MULTILINE).search(
+            data, m.end()
+        )
+        if end is None:
+            pos = len(data)  # Thumbnail runs past the header budget
+            break
+        pos = data.find(b"\n", end.end())
+        pos = len(data) if pos == -1 else pos + 1
+    if pos == 0:
+        return data
+    parts.append(data[pos:])
+    return b"".join(parts)
+
+
+def get_header(path: str, cancel=None, budget=HEADER_BUDGET):
+    # Returns non-blank lines before the first move, from at most `budget` bytes,
+    # excluding thumbnails
+    _check(cancel)
+    with open(path, "rb") as f:
+        mm = _map(f)
+        if mm is None:
+            return []
+        with mm:
+            end = min(len(mm), budget)
+            move = _find_move(mm, 0, end)
+            if move != -1:
+                end = move
+            elif end < len(mm):
+                end = mm.rfind(b"\n", 0, end) + 1  # Drop the partial last line
+            data = _strip_thumbnails(mm[:end])
+    return [ln for ln in _decode_lines(data) if ln.strip() != ""]
+
+
+def get_footer(path: str, cancel=None, budget=FOOTER_BUDGET):
+    # Returns comment lines after the last move, from at most `budget` bytes at
+    # the end of the file. Files without any moves have no footer.
+    _check(cancel)
     with open(path, "rb") as f:
-        try:  # catch OSError in case of a one line file
-            f.seek(-JUMP, os.SEEK_END)
-            while not gcode_multiline_re.match(f.read(JUMP).decode("utf8")):
-                f.seek(-2 * JUMP, os.SEEK_CUR)
-            f.seek(-JUMP, os.SEEK_END)
-            for line in f:
-                ln = line.decode("utf8")
-                if ln.startswith(";"):
-                    hdr.append(ln)
-        except OSError:
-            pass  # give up
-    return hdr
+        mm = _map(f)
+        if mm is None:
+            return []
+        with mm:
+            start = max(0, len(mm) - budget)
+            last = _rfind_move(mm, start)
+            if last != -1:
+                begin = _next_line(mm, last)
+            elif start > 0:
+                begin = _next_line(mm, start)  # Skip the partial first line
+            else:
+                return []
+            data = mm[begin:]
+    return [ln for ln in _decode_lines(data) if ln.startswith(";")]
 
 
 def get_profile(hdr: list, ftr: list):
-    for name, match, getprof in PROCESSORS:
-        if match(hdr, ftr):
-            sys.stderr.write(f"File matched with {name}\n")
-            profstr = getprof(hdr, ftr)
-            return token_string_match(profstr)
+    lines = list(hdr) + list(ftr)
+    p = match_processor(lines)
+    if p is None:
+        return None
+    _logger.debug(f"File matched with {p.name}")
+    return token_string_match(p.get_profile(lines))
+
+
+def infer_profile(path: str, cancel=None):
+    """Returns the name of the printer profile `path` was sliced for, or None if
+    unknown. Only the leading and trailing comments of the file are read.
+
+    `cancel` is an optional threading.Event; if it's set while reading, Cancelled
+    is raised."""
+    hdr = get_header(path, cancel)
+    _check(cancel)
+    ftr = get_footer(path, cancel)
+    return get_profile(hdr, ftr)
 
 
 if __name__ == "__main__":
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG, format="%(message)s")
     sys.stderr.write("=== Continuous Print Profile Inference ===\n")
-    hdr = get_header(sys.argv[1])
-    ftr = get_footer(sys.argv[1])
-    prof = get_profile(hdr, ftr)
+    prof = infer_profile(sys.argv[1])
     if prof is not None:
         sys.stdout.write(prof)
     sys.stdout.flush()
@@ -1,6 +1,16 @@
 import unittest
 import tempfile
-from .extract_profile import get_profile, get_header, get_footer
+import threading
+from unittest.mock import patch, MagicMock
+from . import extract_profile
+from .extract_profile import (
+    Processor,
+    get_profile,
+    get_header,
+    get_footer,
+    infer_profile,
+    Cancelled,
+)
 
 
 class TestProfileInference(unittest.TestCase):
@@ -25,6 +35,31 @@ class TestProfileInference(unittest.TestCase):
                 "; printer_model = MK3S\n",
                 "Prusa i3 MK3S+",
             ),
+            (
+                ";FLAVOR:Marlin\n;Generated with Cura_SteamEngine 5.2.1\n;MACHINE_NAME:Creality Ender-3\n",
+                "",
+                "Creality Ender 3",
+            ),
+            (
+                "; generated by SuperSlicer 2.4.58.5 on 2023-01-01\n",
+                "; printer_model = MK3S\n",
+                "Prusa i3 MK3S+",
+            ),
+            (
+                "; generated by OrcaSlicer 1.6.0 on 2023-01-01\n",
+                "; printer_settings_id = Creality Ender-5\n",
+                "Creality Ender 5",
+            ),
+            (
+                "; HEADER_BLOCK_START\n; BambuStudio 01.07.04.52\n",
+                "; printer_settings_id = Other\n; printer_model = Prusa MINI\n",
+                "Prusa Mini",
+            ),
+            (
+                "; G-Code generated by Simplify3D(R) Version 4.1.2\n;   profileName,Creality Ender-6\n",
+                "",
+                "Creality Ender 6",
+            ),
         ]:
             with self.subTest(header=header, footer=footer, want=want):
                 hdr = header.split("\n")
@@ -33,6 +68,54 @@ class TestProfileInference(unittest.TestCase):
                 self.assertEqual(result, want)
 
 
+class TestProcessorRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = extract_profile.processors()[:]
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        extract_profile._registry = self.registry
+        extract_profile._signature_index.cache_clear()
+
+    def testFirstKeyTakesPrecedence(self):
+        p = Processor("test", [";sig"], [r"; a=(.*)", r"; b=(.*)"])
+        self.assertEqual(p.get_profile(["; b=2\n", "; a=1\n"]), "1")
+        self.assertEqual(p.get_profile(["; b=2\n"]), "2")
+        self.assertEqual(p.get_profile(["; c=3\n"]), "")
+        self.assertEqual(p.calls, 3)
+
+    def testOptionalCharsNotInPrefilter(self):
+        p = Processor("test", [";sig"], [r"; ?printer_model = (.*)"])
+        self.assertEqual(p.get_profile([";printer_model = MK3S\n"]), "MK3S")
+        self.assertEqual(p.get_profile(["; printer_model = MK4\n"]), "MK4")
+        self.assertEqual(extract_profile._literal_prefix(r";x{0,2}a=(.*)"), ";")
+        self.assertEqual(extract_profile._literal_prefix(r";ab*c=(.*)"), ";a")
+        self.assertEqual(extract_profile._literal_prefix(r";ab+c=(.*)"), ";ab")
+        self.assertEqual(extract_profile._literal_prefix(r";b=(.*)|;c=(.*)"), "")
+        self.assertEqual(extract_profile._literal_prefix(r";(b|c)=(.*)"), ";")
+        self.assertEqual(extract_profile._literal_prefix(r";[|(]=(.*)"), ";")
+
+    def testRegisterProcessor(self):
+        p = Processor("test", ["; Generated by Kiri:Moto"], [r"; Printer: (.*)"])
+        extract_profile.register_processor(p)
+        hdr = ["; Generated by Kiri:Moto\n", "; Printer: Prusa Mini\n"]
+        self.assertEqual(extract_profile.match_processor(hdr), p)
+        self.assertEqual(get_profile(hdr, []), "Prusa Mini")
+        self.assertEqual(extract_profile.processor_timings()["test"][0], 1)
+
+    def testEntryPoints(self):
+        p = Processor("ep", [";ep"], [r";printer=(.*)"])
+        ep = MagicMock()
+        ep.load.return_value = [p]
+        bad = MagicMock()
+        bad.load.side_effect = ImportError()
+        extract_profile._registry = None
+        extract_profile._signature_index.cache_clear()
+        with patch("importlib.metadata.entry_points", return_value=[bad, ep]):
+            self.assertEqual(extract_profile.processors()[0], p)
+        self.assertEqual(get_profile([";ep\n", ";printer=CR30\n"], []), "Creality CR30")
+
+
 class TestFileParsing(unittest.TestCase):
     def testGetHeader(self):
         with tempfile.NamedTemporaryFile() as ntf:
@@ -55,3 +138,101 @@ class TestFileParsing(unittest.TestCase):
                     f.write(f"G0 X{i}\n")
                 f.write("; Line 1\n; Line 2\n")
             self.assertEqual(get_footer(ntf.name), ["; Line 1\n", "; Line 2\n"])
+
+    def write(self, ntf, data: bytes):
+        with open(ntf.name, "wb") as f:
+            f.write(data)
+
+    def testEmptyFile(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.assertEqual(get_header(ntf.name), [])
+            self.assertEqual(get_footer(ntf.name), [])
+
+    def testGetHeaderBudget(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.write(ntf, b"; sig\n" + b"; comment data\n" * 1000 + b"G0 X5\n")
+            hdr = get_header(ntf.name, budget=100)
+            self.assertEqual(hdr[0], "; sig\n")
+            self.assertEqual(hdr[-1], "; comment data\n")  # No partial lines
+            self.assertLess(sum(len(ln) for ln in hdr), 100)
+
+    def testGetHeaderSkipsThumbnails(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.write(
+                ntf,
+                b"; sig\n; thumbnail begin 16x16 100\n; AAAA\n; thumbnail end\n"
+                + b"; thumbnail_JPG begin 16x16 100\n; BBBB\n; thumbnail_JPG end\n"
+                + b"; after\nG0 X5\n",
+            )
+            self.assertEqual(get_header(ntf.name), ["; sig\n", "; after\n"])
+
+    def testGetHeaderKeepsThumbnailConfigLines(self):
+        cfg = b"; thumbnails = 16x16/QOI\n; thumbnails_format = PNG\n"
+        for data, want in [
+            (
+                b"; generated by PrusaSlicer\n" + cfg + b"; printer_model = MK3S\n",
+                [
+                    "; generated by PrusaSlicer\n",
+                    "; thumbnails = 16x16/QOI\n",
+                    "; thumbnails_format = PNG\n",
+                    "; printer_model = MK3S\n",
+                ],
+            ),
+            (
+                cfg
+                + b"; generated by PrusaSlicer\n; thumbnail begin 16x16 100\n; AAAA\n"
+                + b"; thumbnail end\n; printer_model = MK3S\n",
+                [
+                    "; thumbnails = 16x16/QOI\n",
+                    "; thumbnails_format = PNG\n",
+                    "; generated by PrusaSlicer\n",
+                    "; printer_model = MK3S\n",
+                ],
+            ),
+        ]:
+            with self.subTest(data=data), tempfile.NamedTemporaryFile() as ntf:
+                self.write(ntf, data + b"G0 X5\n")
+                hdr = get_header(ntf.name)
+                self.assertEqual(hdr, want)
+                self.assertEqual(get_profile(hdr, []), "Prusa i3 MK3S+")
+
+    def testGetFooterBudget(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.write(ntf, b"G0 X5\n" + b"; config = value\n" * 1000)
+            ftr = get_footer(ntf.name, budget=100)
+            self.assertEqual(ftr, ["; config = value\n"] * 5)
+
+    def testMultiByteAndCRLF(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.write(
+                ntf,
+                "; Target: Prüsa\r\nG0 X5\r\n; ü\r\n".encode("utf8") + b"; \xff\r\n",
+            )
+            self.assertEqual(get_header(ntf.name), ["; Target: Prüsa\n"])
+            self.assertEqual(get_footer(ntf.name), ["; ü\n", "; \ufffd\n"])
+
+    def testGetFooterSplitsMultiByteAtBudget(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            self.write(ntf, b"G0 X5\n" + "; üüü\n".encode("utf8") * 100)
+            for budget in range(10, 20):
+                with self.subTest(budget=budget):
+                    ftr = get_footer(ntf.name, budget=budget)
+                    self.assertEqual(set(ftr), {"; üüü\n"})
+
+    def testInferProfile(self):
+        with tempfile.NamedTemporaryFile() as ntf:
+            with open(ntf.name, "w") as f:
+                f.write("; generated by PrusaSlicer 2.4.2\n")
+                for i in range(1000):
+                    f.write(f"G0 X{i}\n")
+                f.write("; printer_model = MK3S\n")
+            self.assertEqual(infer_profile(ntf.name), "Prusa i3 MK3S+")
+
+    def testInferProfileCancelled(self):
+        cancel = threading.Event()
+        cancel.set()
+        with tempfile.NamedTemporaryFile() as ntf:
+            with open(ntf.name, "w") as f:
+                f.write("; Line 1\n")
+            with self.assertRaises(Cancelled):
+                infer_profile(ntf.name, cancel)
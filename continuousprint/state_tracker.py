@@ -0,0 +1,100 @@
+import json
+import threading
+from typing import Optional, Tuple
+
+# Nested collections within the state returned by `_state_json()`, along with the
+# field used to identify each item. The sets within a job are the leaves.
+LEVELS = (("queues", "name"), ("jobs", "id"), ("sets", "id"))
+
+
+def diff_node(old: dict, new: dict, depth=0) -> dict:
+    """Returns the changes needed to turn `old` into `new`.
+
+    The result is empty if nothing changed, otherwise it contains any of:
+    - fields: top-level values that were added or changed (removed keys are sent as None).
+      Child items lacking a unique key are sent here in full.
+    - order: the new ordering of child item keys; children not listed were removed
+    - children: list of {key, value} for new child items, or {key, delta} for changed ones
+    """
+    child_attr, child_key = LEVELS[depth] if depth < len(LEVELS) else (None, None)
+    result = dict()
+
+    fields = dict()
+    for k, v in new.items():
+        if k != child_attr and (k not in old or old[k] != v):
+            fields[k] = v
+    for k in old.keys():
+        if k != child_attr and k not in new:
+            fields[k] = None
+    if len(fields) > 0:
+        result["fields"] = fields
+
+    if child_attr is None:
+        return result
+
+    old_children = old.get(child_attr, [])
+    new_children = new.get(child_attr, [])
+    order = [c.get(child_key) for c in new_children]
+    old_order = [c.get(child_key) for c in old_children]
+    if None in order or len(set(order)) != len(order) or None in old_order:
+        # Children can't be matched up by key; replace them wholesale
+        if new_children != old_children:
+            result.setdefault("fields", dict())[child_attr] = new_children
+        return result
+    if order != old_order:
+        result["order"] = order
+
+    old_children = dict(zip(old_order, old_children))
+
+    children = []
+    for c in new_children:
+        prev = old_children.get(c[child_key])
+        if prev is None:
+            children.append(dict(key=c[child_key], value=c))
+            continue
+        d = diff_node(prev, c, depth + 1)
+        if len(d) > 0:
+            children.append(dict(key=c[child_key], delta=d))
+    if len(children) > 0:
+        result["children"] = children
+    return result
+
+
+class StateTracker:
+    """Tracks the last state sent to the UI so that only changes need to be pushed.
+
+    Every change bumps a sequence number. Clients apply a delta only if its `base`
+    matches the sequence number they last saw, and otherwise re-fetch the full state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = dict()
+        self._rendered = None
+        self.seq = 0
+
+    def _update(self, state: dict) -> Optional[dict]:
+        d = diff_node(self._last, state)
+        if len(d) == 0:
+            return None
+        self._last = state
+        self._rendered = None
+        self.seq += 1
+        return dict(d, seq=self.seq, base=self.seq - 1)
+
+    def update(self, state: dict) -> Optional[dict]:
+        """Records `state` as the latest state and returns the delta since the prior one,
+        or None if nothing changed. `state` must not be mutated after it is passed in."""
+        with self._lock:
+            return self._update(state)
+
+    def snapshot(self, state: dict) -> Tuple[str, Optional[dict]]:
+        """As `update()`, but also returns the full state as JSON tagged with the
+        sequence number it corresponds to. Both are taken under the same lock so a
+        concurrent update can't pair the state with a later sequence number. The JSON
+        is reused until the state next changes."""
+        with self._lock:
+            d = self._update(state)
+            if self._rendered is None:
+                self._rendered = json.dumps(dict(self._last, seq=self.seq))
+            return self._rendered, d
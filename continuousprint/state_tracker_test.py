@@ -0,0 +1,109 @@
+import json
+import unittest
+from .state_tracker import StateTracker, diff_node
+
+
+def state(*jobs, status="idle"):
+    return dict(
+        status=status,
+        queues=[dict(name="local", jobs=list(jobs))],
+    )
+
+
+def job(jid, *sets, remaining=1):
+    return dict(id=jid, name=f"job{jid}", remaining=remaining, sets=list(sets))
+
+
+def set_(sid, remaining=1):
+    return dict(id=sid, path=f"{sid}.gcode", remaining=remaining)
+
+
+class TestDiffNode(unittest.TestCase):
+    def testNoChange(self):
+        s = state(job(1, set_(1)))
+        self.assertEqual(diff_node(s, state(job(1, set_(1)))), dict())
+
+    def testFieldChanged(self):
+        self.assertEqual(
+            diff_node(state(status="idle"), state(status="printing")),
+            dict(fields=dict(status="printing")),
+        )
+
+    def testFieldRemoved(self):
+        self.assertEqual(
+            diff_node(dict(a=1, b=2), dict(a=1)), dict(fields=dict(b=None))
+        )
+
+    def testSetChanged(self):
+        got = diff_node(
+            state(job(1, set_(1), set_(2))),
+            state(job(1, set_(1), set_(2, remaining=0))),
+        )
+        self.assertEqual(
+            got,
+            dict(
+                children=[
+                    dict(
+                        key="local",
+                        delta=dict(
+                            children=[
+                                dict(
+                                    key=1,
+                                    delta=dict(
+                                        children=[
+                                            dict(
+                                                key=2,
+                                                delta=dict(fields=dict(remaining=0)),
+                                            )
+                                        ]
+                                    ),
+                                )
+                            ]
+                        ),
+                    )
+                ]
+            ),
+        )
+
+    def testJobAddedAndRemoved(self):
+        got = diff_node(state(job(1), job(2)), state(job(2), job(3)))
+        self.assertEqual(
+            got["children"][0]["delta"],
+            dict(order=[2, 3], children=[dict(key=3, value=job(3))]),
+        )
+
+    def testUnkeyedChildrenReplaced(self):
+        old = dict(queues=[dict(name="local", jobs=[dict(name="a")])])
+        new = dict(queues=[dict(name="local", jobs=[dict(name="b")])])
+        got = diff_node(old, new)
+        self.assertEqual(
+            got["children"][0]["delta"], dict(fields=dict(jobs=[dict(name="b")]))
+        )
+
+
+class TestStateTracker(unittest.TestCase):
+    def testSequence(self):
+        t = StateTracker()
+        d = t.update(state(job(1)))
+        self.assertEqual((d["seq"], d["base"]), (1, 0))
+        self.assertEqual(t.update(state(job(1))), None)
+        self.assertEqual(t.seq, 1)
+        d = t.update(state(job(1, remaining=0)))
+        self.assertEqual((d["seq"], d["base"]), (2, 1))
+
+    def testSnapshot(self):
+        t = StateTracker()
+        resp, d = t.snapshot(state(job(1)))
+        self.assertEqual(json.loads(resp), dict(state(job(1)), seq=1))
+        self.assertEqual(d["seq"], 1)
+
+        # Unchanged state reuses the prior rendering
+        resp2, d = t.snapshot(state(job(1)))
+        self.assertIs(resp2, resp)
+        self.assertEqual(d, None)
+
+        # Changes made via update() are reflected in the next snapshot
+        t.update(state(job(1, remaining=0)))
+        resp, d = t.snapshot(state(job(1, remaining=0)))
+        self.assertEqual(json.loads(resp)["seq"], 2)
+        self.assertEqual(d, None)
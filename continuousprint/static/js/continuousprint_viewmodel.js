@@ -43,6 +43,7 @@ function CPViewModel(parameters) {
     self.defaultQueue = null;
     self.expanded = ko.observable(null);
     self.profile = ko.observable('');
+    self.backlogProgress = ko.observable(null); // {done, total} while profiles are assigned to existing files
 
     self.api = parameters[5] || new CPAPI();
 
@@ -200,8 +201,58 @@ function CPViewModel(parameters) {
       self.queues(result);
     };
 
+    // Full state as last received from the server, to which deltas are applied
+    self._stateSnapshot = null;
+    self._stateSeq = null;
+
+    // Nested collections in the state, along with the field identifying each item.
+    // Must match LEVELS in state_tracker.py
+    self.STATE_LEVELS = [["queues", "name"], ["jobs", "id"], ["sets", "id"]];
+
+    self._applyNodeDelta = function(node, delta, depth) {
+      for (let [k, v] of Object.entries(delta.fields || {})) {
+        node[k] = v;
+      }
+      if (depth >= self.STATE_LEVELS.length) {
+        return;
+      }
+      let [attr, key] = self.STATE_LEVELS[depth];
+      let byKey = {};
+      for (let c of (node[attr] || [])) {
+        byKey[c[key]] = c;
+      }
+      for (let c of (delta.children || [])) {
+        if (c.value !== undefined) {
+          byKey[c.key] = c.value;
+        } else {
+          self._applyNodeDelta(byKey[c.key], c.delta, depth+1);
+        }
+      }
+      if (delta.order !== undefined) {
+        node[attr] = delta.order.map((k) => byKey[k]);
+      }
+    };
+
+    self._applyStateDelta = function(delta) {
+      if (self._stateSnapshot === null || self._stateSeq === undefined || self._stateSeq === null) {
+        return self._loadState();
+      }
+      if (delta.seq <= self._stateSeq) {
+        return; // Already reflected in our state
+      }
+      if (delta.base !== self._stateSeq) {
+        return self._loadState(); // Missed an update; resync
+      }
+      let state = JSON.parse(JSON.stringify(self._stateSnapshot));
+      self._applyNodeDelta(state, delta, 0);
+      state.seq = delta.seq;
+      self._setState(state);
+    };
+
     self._setState = function(state) {
         //self.log.info(`[${self.PLUGIN_ID}] updating queues (len ${state.queues.length})`);
+        self._stateSnapshot = JSON.parse(JSON.stringify(state));
+        self._stateSeq = state.seq;
         self._updateQueues(state.queues);
         self.active(state.active);
         self.active_set(state.active_set);
@@ -323,9 +374,15 @@ function CPViewModel(parameters) {
             case "setstate":
                 data = JSON.parse(data["state"]);
                 return self._setState(data);
+            case "setstatedelta":
+                return self._applyStateDelta(data["statedelta"]);
             case "sethistory":
                 data = JSON.parse(data["history"]);
                 return self._setHistory(data);
+            case "sethistoryrow":
+                return self._upsertHistoryRow(data["historyrow"]);
+            case "setbacklog":
+                return self.backlogProgress(data["backlog"]);
             default:
                 theme = "info";
                 break;
@@ -392,7 +449,9 @@ function CPViewModel(parameters) {
       return data instanceof CPHistoryDivider;
     };
 
+    self._historyRows = [];
     self._setHistory = function(data) {
+      self._historyRows = data;
       let result = [];
       let job = null;
       let set = null;
@@ -406,6 +465,19 @@ function CPViewModel(parameters) {
       }
       self.history(result);
     };
+    self._upsertHistoryRow = function(row) {
+      let rows = self._historyRows.slice();
+      let idx = rows.findIndex((r) => r.run_id === row.run_id);
+      if (idx !== -1) {
+        rows[idx] = row;
+      } else if (rows.some((r) => r.end === null)) {
+        // Starting a run aborts any unfinished runs, so refetch to pick up their results
+        return self.refreshHistory();
+      } else {
+        rows.unshift(row);
+      }
+      self._setHistory(rows);
+    };
     self.refreshHistory = function() {
       self.api.get(self.api.HISTORY, self._setHistory);
     };
@@ -174,6 +174,47 @@ test('sortEnd job to end', () => {
   expect(data.after_id).toEqual(1);
 });
 
+describe('_applyStateDelta', () => {
+  let initSeq = () => {
+    let v = new VM(mocks());
+    v._setState({
+      seq: 1,
+      active: false,
+      status: 'Test Status',
+      queues: [{name: 'local', jobs: items(2)}],
+    });
+    return v;
+  };
+
+  it('applies set changes and reordering', () => {
+    let v = initSeq();
+    v._applyStateDelta({seq: 2, base: 1, fields: {status: 'printing'}, children: [
+      {key: 'local', delta: {order: [2, 1], children: [
+        {key: 1, delta: {children: [{key: 1, delta: {fields: {remaining: 0}}}]}},
+      ]}},
+    ]});
+    expect(v.status()).toBe('printing');
+    let jobs = v.queues()[0].jobs();
+    expect(jobs.map((j) => j.id())).toEqual([2, 1]);
+    expect(jobs[1].sets()[0].remaining()).toBe(0);
+    expect(v.api.get).not.toHaveBeenCalled();
+  });
+
+  it('ignores stale deltas', () => {
+    let v = initSeq();
+    v._applyStateDelta({seq: 1, base: 0, fields: {status: 'stale'}});
+    expect(v.status()).toBe('Test Status');
+    expect(v.api.get).not.toHaveBeenCalled();
+  });
+
+  it('resyncs when an update was missed', () => {
+    let v = initSeq();
+    v._applyStateDelta({seq: 3, base: 2, fields: {status: 'later'}});
+    expect(v.status()).toBe('Test Status');
+    expect(v.api.get).toHaveBeenCalled();
+  });
+});
+
 test('refreshHistory', () => {
   let v = new VM(mocks());
   v.refreshHistory();
@@ -196,6 +237,35 @@ test('_setHistory', () => {
   expect(ents.length).toEqual(4); // Include dividers
 });
 
+describe('_upsertHistoryRow', () => {
+  let rows = () => [
+    {run_id: 2, job_name: "j1", set_path: "s1", end: 5, result: "success"},
+    {run_id: 1, job_name: "j1", set_path: "s1", end: 3, result: "success"},
+  ];
+
+  it('updates an existing row in place', () => {
+    let v = new VM(mocks());
+    v._setHistory(rows());
+    v._upsertHistoryRow({run_id: 1, job_name: "j1", set_path: "s1", end: 3, result: "failure"});
+    expect(v._historyRows.map((r) => r.result)).toEqual(["success", "failure"]);
+  });
+
+  it('prepends new rows', () => {
+    let v = new VM(mocks());
+    v._setHistory(rows());
+    v._upsertHistoryRow({run_id: 3, job_name: "j2", set_path: "s2", end: null, result: null});
+    expect(v._historyRows.map((r) => r.run_id)).toEqual([3, 2, 1]);
+    expect(v.api.get).not.toHaveBeenCalled();
+  });
+
+  it('refetches if unfinished runs may have been aborted', () => {
+    let v = new VM(mocks());
+    v._setHistory([{run_id: 1, job_name: "j1", set_path: "s1", end: null, result: null}]);
+    v._upsertHistoryRow({run_id: 2, job_name: "j1", set_path: "s1", end: null, result: null});
+    expect(v.api.get).toHaveBeenCalled();
+  });
+});
+
 test('removeFile shows dialog', () => {
   let m = mocks();
   let rmfile = m[2].removeFile;
@@ -230,3 +300,11 @@ test('removeConfirm calls removeFile', () => {
 
   expect(rmfile).toHaveBeenCalled();
 });
+
+test('setbacklog message shows profile assignment progress', () => {
+  let v = new VM(mocks());
+  v.onDataUpdaterPluginMessage("continuousprint", {type: "setbacklog", backlog: {done: 5, total: 10}});
+  expect(v.backlogProgress()).toEqual({done: 5, total: 10});
+  v.onDataUpdaterPluginMessage("continuousprint", {type: "setbacklog", backlog: null});
+  expect(v.backlogProgress()).toEqual(null);
+});
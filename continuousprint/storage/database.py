@@ -13,6 +13,7 @@ from peewee import (
     CompositeKey,
     JOIN,
     Check,
+    fn,
 )
 from playhouse.migrate import SqliteMigrator, migrate
 
@@ -33,8 +34,28 @@ class DB:
     queues = SqliteDatabase(None, pragmas={"foreign_keys": 1})
     automation = SqliteDatabase(None, pragmas={"foreign_keys": 1})
 
+    # Incremented whenever the automation DB is (re)initialized or its contents change,
+    # so that compiled copies of event hooks know to reload.
+    automation_rev = 0
+
+
+# Pragmas applied on top of foreign_keys, selected via the storage profile setting.
+# WAL with synchronous=NORMAL avoids an fsync per transaction; commits stay atomic
+# but the most recent ones may be lost on power failure.
+STORAGE_PROFILES = dict(
+    legacy=dict(journal_mode="delete", synchronous="full"),
+    durable=dict(journal_mode="wal", synchronous="full"),
+    balanced=dict(
+        journal_mode="wal",
+        synchronous="normal",
+        mmap_size=32 * 1024 * 1024,
+        cache_size=-4000,  # KiB
+        temp_store="memory",
+    ),
+)
+
 
-CURRENT_SCHEMA_VERSION = "0.0.4"
+CURRENT_SCHEMA_VERSION = "0.0.9"
 DEFAULT_QUEUE = "local"
 LAN_QUEUE = "LAN"
 ARCHIVE_QUEUE = "archive"
@@ -71,6 +92,7 @@ class EventHook(Model):
 
     class Meta:
         database = DB.automation
+        indexes = ((("name", "rank"), False),)
 
 
 class StorageDetails(Model):
@@ -126,6 +148,14 @@ class JobView:
         else:
             return nxt
 
+    def remaining_prints(self) -> int:
+        # Set prints left in this and all later passes through the job
+        if self.draft or self.remaining <= 0:
+            return 0
+        return sum(s.remaining for s in self.sets) + (self.remaining - 1) * sum(
+            s.count for s in self.sets
+        )
+
     def _next_set(self, profile, custom_filter):
         # Return value: (set: SetView, any_printable: bool)
         # Second argument is whether there's any printable sets
@@ -174,6 +204,7 @@ class Job(Model, JobView):
         default=1, constraints=[Check("remaining >= 0"), Check("remaining <= count")]
     )
     created = DateTimeField(default=datetime.datetime.now)
+    archived = DateTimeField(null=True)  # When the job was moved to the archive
 
     # These members relate to status of the job in the UI / driver
     draft = BooleanField(default=True)
@@ -181,6 +212,7 @@ class Job(Model, JobView):
 
     class Meta:
         database = DB.queues
+        indexes = ((("queue", "rank"), False),)
 
     @classmethod
     def from_dict(self, data: dict):
@@ -190,6 +222,15 @@ class Job(Model, JobView):
 
     def refresh_sets(self):
         Set.update(remaining=Set.count, completed=0).where(Set.job == self).execute()
+        # Sets loaded via prefetch are stored on the instance rather than
+        # queried through the backref, so they must be refreshed in place.
+        for s in self.__dict__.get("sets", []):
+            s.remaining = s.count
+            s.completed = 0
+
+
+# Partial index; at most one job is acquired at a time
+Job.add_index(Job.index(Job.acquired, where=Job.acquired))
 
 
 class SetView:
@@ -269,10 +310,25 @@ class Set(Model, SetView):
     material_keys = CharField(default="")
 
     # A CSV of printer profiles (names as defined in printer_profiles.yaml)
+    # Changes to this field must be followed by update_profile_index()
     profile_keys = CharField(default="")
 
     class Meta:
         database = DB.queues
+        indexes = ((("job", "rank"), False),)
+
+    def decrement(self, profile):
+        # Set and job counters must be updated together, even if we crash partway
+        with DB.queues.atomic():
+            return super().decrement(profile)
+
+    def update_profile_index(self):
+        SetProfile.delete().where(SetProfile.set == self.id).execute()
+        rows = [(self.id, p) for p in sorted(set(self.profiles()))]
+        if len(rows) > 0:
+            SetProfile.insert_many(
+                rows, fields=[SetProfile.set, SetProfile.profile]
+            ).execute()
 
     @classmethod
     def from_dict(self, s):
@@ -286,6 +342,17 @@ class Set(Model, SetView):
         return Set(**s)
 
 
+class SetProfile(Model):
+    # Normalized copy of Set.profile_keys, so that the sets compatible with
+    # a printer profile can be found with an indexed query.
+    set = ForeignKeyField(Set, backref="profile_index", on_delete="CASCADE")
+    profile = CharField()
+
+    class Meta:
+        database = DB.queues
+        indexes = ((("profile", "set"), True),)
+
+
 class Run(Model):
     # Runs are totally decoupled from queues, jobs, and sets - this ensures that
     # the run history persists even if the other items are deleted
@@ -304,6 +371,10 @@ class Run(Model):
 
     class Meta:
         database = DB.queues
+        indexes = (
+            (("jobName", "end"), False),  # Active run lookup
+            (("start",), False),  # History
+        )
 
     def as_dict(self):
         d = dict(
@@ -321,6 +392,84 @@ class Run(Model):
         return d
 
 
+class RunStats(Model):
+    # Daily rollup of finished runs, kept up to date as runs end so that
+    # history statistics don't need to scan every row in the run table.
+    queueName = CharField()
+    jobName = CharField()
+    path = CharField()
+    day = DateField()
+    result = CharField()
+    count = IntegerField(default=0)
+    duration = FloatField(default=0)  # Total seconds across all counted runs
+
+    class Meta:
+        database = DB.queues
+        indexes = ((("day", "queueName", "jobName", "path", "result"), True),)
+
+    @classmethod
+    def record(cls, run):
+        day = run.start.date()
+        duration = (run.end - run.start).total_seconds()
+        cls.insert(
+            queueName=run.queueName,
+            jobName=run.jobName,
+            path=run.path,
+            day=day,
+            result=run.result,
+            count=1,
+            duration=duration,
+        ).on_conflict(
+            conflict_target=[cls.day, cls.queueName, cls.jobName, cls.path, cls.result],
+            update={
+                cls.count: cls.count + 1,
+                cls.duration: cls.duration + duration,
+            },
+        ).execute()
+
+    @classmethod
+    def backfill(cls):
+        day = fn.date(Run.start).coerce(False)
+        cls.insert_from(
+            Run.select(
+                Run.queueName,
+                Run.jobName,
+                Run.path,
+                day,
+                Run.result,
+                fn.COUNT(Run.id),
+                fn.SUM(run_duration()),
+            )
+            .where(Run.end.is_null(False) & Run.result.is_null(False))
+            .group_by(Run.queueName, Run.jobName, Run.path, day, Run.result),
+            fields=[
+                cls.queueName,
+                cls.jobName,
+                cls.path,
+                cls.day,
+                cls.result,
+                cls.count,
+                cls.duration,
+            ],
+        ).execute()
+
+
+class ProfileCache(Model):
+    # Printer profiles inferred from gcode files, keyed by a hash of the file's
+    # contents so that moved, re-uploaded or LAN-fetched copies aren't re-analyzed.
+    hash = CharField(primary_key=True)
+    profile = CharField()  # Empty if no profile could be inferred
+    created = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        database = DB.queues
+
+
+def run_duration():
+    # Seconds between the start and end of a run, computed in SQL
+    return (fn.julianday(Run.end) - fn.julianday(Run.start)) * 86400
+
+
 def file_exists(path: str) -> bool:
     try:
         return os.stat(path).st_size > 0
@@ -328,7 +477,7 @@ def file_exists(path: str) -> bool:
         return False
 
 
-MODELS = [Queue, Job, Set, Run, StorageDetails]
+MODELS = [Queue, Job, Set, SetProfile, Run, RunStats, ProfileCache, StorageDetails]
 AUTOMATION = [Script, EventHook, Preprocessor]
 
 
@@ -350,21 +499,63 @@ def populate_automation():
         Preprocessor.create(name=pp["name"], body=pp["body"])
 
 
-def init_db(automation_db, queues_db, logger=None):
-    init_automation(automation_db, logger)
-    init_queues(queues_db, logger)
+def _pragmas(storage_profile, logger=None):
+    pragmas = {"foreign_keys": 1}
+    if storage_profile is None:
+        return pragmas
+    if storage_profile not in STORAGE_PROFILES:
+        if logger is not None:
+            logger.warning(
+                f"Unknown storage profile {storage_profile}; using SQLite defaults"
+            )
+        return pragmas
+    pragmas.update(STORAGE_PROFILES[storage_profile])
+    return pragmas
 
 
-def init_automation(db_path, logger=None):
+def optimize_db(db, logger=None):
+    # Run at startup: folds any WAL contents back into the main DB file (so it
+    # doesn't grow without bound) and refreshes query planner statistics.
+    if db.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal":
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.execute_sql("PRAGMA optimize")
+    if logger is not None:
+        logger.debug(f"Optimized {db.database}")
+
+
+def compact_db(db, logger=None):
+    # Reclaims space freed by deleted rows and refreshes planner statistics.
+    # VACUUM rewrites the whole file, so this should only run while idle.
+    db.execute_sql("ANALYZE")
+    db.execute_sql("VACUUM")
+    if db.execute_sql("PRAGMA journal_mode").fetchone()[0] == "wal":
+        db.execute_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    if logger is not None:
+        logger.info(f"Compacted {db.database}")
+
+
+def init_db(automation_db, queues_db, logger=None, storage_profile=None):
+    init_automation(automation_db, logger, storage_profile)
+    init_queues(queues_db, logger, storage_profile)
+    for db in (DB.automation, DB.queues):
+        optimize_db(db, logger)
+
+
+def init_automation(db_path, logger=None, storage_profile=None):
     db = DB.automation
     needs_init = not file_exists(db_path)
     db.init(None)
-    db.init(db_path)
+    db.init(db_path, pragmas=_pragmas(storage_profile, logger))
     db.connect()
     if needs_init:
         if logger is not None:
             logger.debug("Initializing automation DB")
         populate_automation()
+    else:
+        # The automation DB isn't versioned, so add any missing indexes directly
+        for m in AUTOMATION:
+            m._schema.create_indexes(safe=True)
+    DB.automation_rev += 1
 
 
 def migrateQueuesV2ToV3(details, logger):
@@ -405,11 +596,75 @@ def migrateQueuesV2ToV3(details, logger):
     details.save()
 
 
-def init_queues(db_path, logger=None):
+def migrateQueuesV4ToV5(details, logger):
+    # Adds indexes for next-set lookup, plus a normalized profile table
+    # which is backfilled from the CSV profile_keys of existing sets.
+    if logger is not None:
+        logger.warning(f"Updating schema from {details.schemaVersion} to 0.0.5")
+    db = DB.queues
+    with db.atomic():
+        SetProfile.create_table(safe=True)
+        Job._schema.create_indexes(safe=True)
+        Set._schema.create_indexes(safe=True)
+        for s in Set.select().where(Set.profile_keys != ""):
+            s.update_profile_index()
+        details.schemaVersion = "0.0.5"
+        details.save()
+
+
+def migrateQueuesV5ToV6(details, logger):
+    # Adds indexes for run lookups/history and the acquired job
+    if logger is not None:
+        logger.warning(f"Updating schema from {details.schemaVersion} to 0.0.6")
+    db = DB.queues
+    with db.atomic():
+        Run._schema.create_indexes(safe=True)
+        Job._schema.create_indexes(safe=True)
+        details.schemaVersion = "0.0.6"
+        details.save()
+
+
+def migrateQueuesV6ToV7(details, logger):
+    # Adds the run statistics rollup, backfilled from existing run history
+    if logger is not None:
+        logger.warning(f"Updating schema from {details.schemaVersion} to 0.0.7")
+    db = DB.queues
+    with db.atomic():
+        RunStats.create_table(safe=True)
+        RunStats.delete().execute()
+        RunStats.backfill()
+        details.schemaVersion = "0.0.7"
+        details.save()
+
+
+def migrateQueuesV7ToV8(details, logger):
+    # Adds the time each job was moved to the archive, used for retention limits
+    if logger is not None:
+        logger.warning(f"Updating schema from {details.schemaVersion} to 0.0.8")
+    migrator = SqliteMigrator(DB.queues)
+    with DB.queues.atomic():
+        migrate(
+            migrator.add_column("job", "archived", Job.archived),
+        )
+        details.schemaVersion = "0.0.8"
+        details.save()
+
+
+def migrateQueuesV8ToV9(details, logger):
+    # Adds the content-addressed profile inference cache
+    if logger is not None:
+        logger.warning(f"Updating schema from {details.schemaVersion} to 0.0.9")
+    with DB.queues.atomic():
+        ProfileCache.create_table(safe=True)
+        details.schemaVersion = "0.0.9"
+        details.save()
+
+
+def init_queues(db_path, logger=None, storage_profile=None):
     db = DB.queues
     needs_init = not file_exists(db_path)
     db.init(None)
-    db.init(db_path)
+    db.init(db_path, pragmas=_pragmas(storage_profile, logger))
     db.connect()
 
     if needs_init:
@@ -445,6 +700,21 @@ def init_queues(db_path, logger=None):
                 details.schemaVersion = "0.0.4"
                 details.save()
 
+            if details.schemaVersion == "0.0.4":
+                migrateQueuesV4ToV5(details, logger)
+
+            if details.schemaVersion == "0.0.5":
+                migrateQueuesV5ToV6(details, logger)
+
+            if details.schemaVersion == "0.0.6":
+                migrateQueuesV6ToV7(details, logger)
+
+            if details.schemaVersion == "0.0.7":
+                migrateQueuesV7ToV8(details, logger)
+
+            if details.schemaVersion == "0.0.8":
+                migrateQueuesV8ToV9(details, logger)
+
             if details.schemaVersion != CURRENT_SCHEMA_VERSION:
                 raise Exception(
                     "DB schema version is not current: " + details.schemaVersion
@@ -473,6 +743,7 @@ def migrateScriptsFromSettings(clearing_script, finished_script, cooldown_script
             s = Script.create(name=name, body=body)
             EventHook.delete().where(EventHook.name == evt.event).execute()
             EventHook.create(name=evt.event, script=s, rank=0)
+    DB.automation_rev += 1
 
 
 def migrateFromSettings(data: list):
@@ -1,24 +1,41 @@
 import unittest
 from unittest.mock import ANY
 import logging
+import datetime
 from .database import (
     migrateFromSettings,
     migrateScriptsFromSettings,
     init_db,
+    optimize_db,
+    compact_db,
     init_queues,
     init_automation,
     Queue,
     migrateQueuesV2ToV3,
+    migrateQueuesV4ToV5,
+    migrateQueuesV5ToV6,
+    migrateQueuesV6ToV7,
+    migrateQueuesV7ToV8,
+    migrateQueuesV8ToV9,
     Job,
     Set,
+    SetProfile,
     Run,
+    RunStats,
+    ProfileCache,
     Script,
     EventHook,
     StorageDetails,
     DEFAULT_QUEUE,
+    CURRENT_SCHEMA_VERSION,
+    DB,
 )
 from ..data import CustomEvents
 import tempfile
+import subprocess
+import sys
+import os
+from pathlib import Path
 
 # logging.basicConfig(level=logging.DEBUG)
 
@@ -174,6 +191,182 @@ class TestMigration(QueuesDBTest):
         s2 = Set.get(s.id)
         self.assertEqual(s2.completed, s.count - s.remaining)
 
+    def testMigrationSchemav4tov5(self):
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.4"
+        details.save()
+        SetProfile.drop_table()
+        q = Queue.get(name=DEFAULT_QUEUE)
+        j = Job.create(name="j", queue_id=q.id, rank=0)
+        s = Set.create(
+            path="foo.gcode",
+            remaining=1,
+            count=1,
+            sd=False,
+            job_id=j.id,
+            rank=1,
+            profile_keys="a,b",
+        )
+
+        migrateQueuesV4ToV5(details, logger=logging.getLogger())
+
+        got = sorted(
+            sp.profile for sp in SetProfile.select().where(SetProfile.set == s)
+        )
+        self.assertEqual(got, ["a", "b"])
+        self.assertEqual(details.schemaVersion, "0.0.5")
+
+
+class TestMigrationV6(QueuesDBTest):
+    def testMigrationSchemav5tov6(self):
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.5"
+        details.save()
+
+        def indexed_columns(table):
+            return [i.columns for i in DB.queues.get_indexes(table)]
+
+        want = dict(run=[["jobName", "end"], ["start"]], job=[["acquired"]])
+        for idx in DB.queues.get_indexes("run") + DB.queues.get_indexes("job"):
+            if idx.columns in want[idx.table]:
+                DB.queues.execute_sql(f'DROP INDEX "{idx.name}"')
+
+        migrateQueuesV5ToV6(details, logger=logging.getLogger())
+
+        for table, cols in want.items():
+            for c in cols:
+                self.assertIn(c, indexed_columns(table))
+        self.assertEqual(details.schemaVersion, "0.0.6")
+
+
+class TestMigrationV7(QueuesDBTest):
+    def testMigrationSchemav6tov7(self):
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.6"
+        details.save()
+        RunStats.drop_table()
+
+        t0 = datetime.datetime(2022, 1, 1, 12)
+        for i in range(3):
+            Run.create(
+                queueName=DEFAULT_QUEUE,
+                jobName="j1",
+                path="a.gcode",
+                start=t0,
+                end=t0 + datetime.timedelta(minutes=30) if i < 2 else None,
+                result="success" if i < 2 else None,
+            )
+
+        migrateQueuesV6ToV7(details, logger=logging.getLogger())
+
+        rs = RunStats.get()
+        self.assertEqual(rs.day, t0.date())
+        self.assertEqual(rs.count, 2)
+        self.assertAlmostEqual(rs.duration, 3600, places=1)
+        self.assertEqual(RunStats.select().count(), 1)
+        self.assertEqual(details.schemaVersion, "0.0.7")
+
+
+class TestMigrationV8(QueuesDBTest):
+    def testMigrationSchemav7tov8(self):
+        DB.queues.execute_sql('ALTER TABLE "job" DROP COLUMN "archived"')
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.7"
+        details.save()
+
+        migrateQueuesV7ToV8(details, logger=logging.getLogger())
+        cols = [c.name for c in DB.queues.get_columns("job")]
+        self.assertIn("archived", cols)
+        self.assertEqual(StorageDetails.get().schemaVersion, "0.0.8")
+
+
+class TestMigrationV9(QueuesDBTest):
+    def testMigrationSchemav8tov9(self):
+        ProfileCache.drop_table()
+        details = StorageDetails.select().limit(1).execute()[0]
+        details.schemaVersion = "0.0.8"
+        details.save()
+        migrateQueuesV8ToV9(details, logger=None)
+        self.assertIn("profilecache", DB.queues.get_tables())
+        self.assertEqual(details.schemaVersion, "0.0.9")
+
+
+class TestCompaction(QueuesDBTest):
+    def testCompactReclaimsSpace(self):
+        Run.insert_many(
+            [dict(queueName="q", jobName="j", path="a" * 200) for _ in range(2000)]
+        ).execute()
+        size = os.stat(self.tmpQueues.name).st_size
+        Run.delete().execute()
+        compact_db(DB.queues)
+        self.assertLess(os.stat(self.tmpQueues.name).st_size, size)
+
+
+class TestStorageProfile(unittest.TestCase):
+    # Runs in a separate process so that it can be killed partway through an update
+    CHILD = """
+import os, sys
+from continuousprint.storage.database import init_queues, Set, Job
+init_queues(sys.argv[1], storage_profile="balanced")
+if sys.argv[2] == "crash":
+    Job.refresh_sets = lambda self: os._exit(1)
+Set.get(id=1).decrement(dict(name="profile"))
+os._exit(0)  # Exit without closing the DB or checkpointing the WAL
+"""
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.addCleanup(self.td.cleanup)
+        self.path = os.path.join(self.td.name, "queues.sqlite3")
+        init_queues(self.path, storage_profile="balanced")
+        self.addCleanup(DB.queues.close)
+        q = Queue.get(name=DEFAULT_QUEUE)
+        j = Job.create(name="j", queue=q, rank=0, count=2, remaining=2, draft=False)
+        Set.create(path="a.gcode", sd=False, job=j, rank=0, count=1, remaining=1)
+
+    def runChild(self, mode):
+        return subprocess.run(
+            [sys.executable, "-c", self.CHILD, self.path, mode],
+            cwd=Path(__file__).parents[2],
+        ).returncode
+
+    def counters(self):
+        init_queues(self.path, storage_profile="balanced")
+        self.assertEqual(
+            DB.queues.execute_sql("PRAGMA integrity_check").fetchone()[0], "ok"
+        )
+        s = Set.get(id=1)
+        return (s.job.remaining, s.remaining, s.completed)
+
+    def testPragmasApplied(self):
+        self.assertEqual(
+            DB.queues.execute_sql("PRAGMA journal_mode").fetchone()[0], "wal"
+        )
+        self.assertEqual(DB.queues.execute_sql("PRAGMA synchronous").fetchone()[0], 1)
+        self.assertEqual(DB.queues.execute_sql("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def testCrashMidDecrementRollsBack(self):
+        self.assertEqual(self.runChild("crash"), 1)
+        self.assertEqual(self.counters(), (2, 1, 0))
+
+    def testCommittedDecrementSurvivesCrash(self):
+        self.assertEqual(self.runChild("ok"), 0)
+        self.assertTrue(os.path.exists(self.path + "-wal"))
+        # Job decremented and set refreshed for the next run
+        self.assertEqual(self.counters(), (1, 1, 0))
+
+    def testOptimizeCheckpointsWAL(self):
+        self.assertEqual(self.runChild("ok"), 0)
+        init_queues(self.path, storage_profile="balanced")
+        optimize_db(DB.queues)
+        self.assertEqual(os.path.getsize(self.path + "-wal"), 0)
+        self.assertEqual(self.counters(), (1, 1, 0))
+
+    def testUnknownProfileUsesDefaults(self):
+        DB.queues.close()
+        init_queues(self.path, storage_profile="nonexistent")
+        self.assertEqual(DB.queues.execute_sql("PRAGMA foreign_keys").fetchone()[0], 1)
+
 
 class TestEmptyJob(QueuesDBTest):
     def setUp(self):
@@ -1,4 +1,4 @@
-from peewee import IntegrityError, JOIN, fn
+from peewee import IntegrityError, JOIN, Case, fn, prefetch, chunked
 from typing import Optional
 from datetime import datetime
 import re
@@ -10,7 +10,11 @@ from .database import (
     Queue,
     Job,
     Set,
+    SetProfile,
     Run,
+    RunStats,
+    ProfileCache,
+    run_duration,
     DB,
     DEFAULT_QUEUE,
     ARCHIVE_QUEUE,
@@ -23,6 +27,10 @@ from ..data import CustomEvents
 
 MAX_COUNT = 999999
 
+# Rows per multi-row INSERT, kept well under SQLite's default limit of 999 bound
+# parameters per statement.
+BULK_INSERT_BATCH = 50
+
 
 def getint(d, k, default=0):
     v = d.get(k, default)
@@ -31,11 +39,21 @@ def getint(d, k, default=0):
     return v
 
 
+def getbool(d, k, default=False):
+    v = d.get(k, default)
+    if type(v) == str:
+        v = v.lower() == "true"
+    return v is True
+
+
 def clearOldState():
     # On init, scrub the local DB for any state that may have been left around
     # due to an improper shutdown
-    Job.update(acquired=False).execute()
-    Run.update(end=datetime.now(), result="aborted").where(Run.end.is_null()).execute()
+    with DB.queues.atomic():
+        Job.update(acquired=False).execute()
+        # Aborted one at a time via endRun() so they're counted in RunStats
+        for r in Run.select().where(Run.end.is_null()):
+            endRun(r, "aborted")
 
 
 def getQueues():
@@ -53,27 +71,18 @@ def releaseJob(j) -> bool:
 
 
 def importJob(qname, manifest: dict, dirname: str, draft=False):
-    q = Queue.get(name=qname)
-
     # Manifest may have "remaining" values set incorrectly for new job; ensure
     # these are set to the whole count for both job and sets.
-    j = Job.from_dict(manifest)
-    j.remaining = j.count
-    j.id = None
-    j.queue = q
-    j.rank = _rankEnd()
-    j.draft = draft
-    j.save()
-    for s in j.sets:
+    job = dict(manifest, draft=draft, sets=[])
+    job.pop("remaining", None)
+    for s in manifest["sets"]:
+        s = dict(s, sd=False)
         # Prepend new folder as initial path is relative to root
-        s.path = str(Path(dirname) / s.path)
-        s.remaining = s.count
-        s.sd = False
-        s.id = None
-        s.job = j.id
-        s.rank = _rankEnd()
-        s.save()
-    return j
+        s["path"] = str(Path(dirname) / s["path"])
+        s.pop("remaining", None)
+        job["sets"].append(s)
+    result = bulkImport(qname, [job])
+    return Job.get(id=result[0]["job_id"])
 
 
 def getAcquiredJob():
@@ -135,23 +144,86 @@ def assignQueues(queues):
 
 
 def getJobsAndSets(queue):
+    # Loads a snapshot of all jobs in the queue along with their queue and sets.
+    # Sets are prefetched in a single additional query rather than lazily
+    # fetched per job, so iterating `job.sets` on the result is free.
     if type(queue) == str:
         queue = Queue.get(name=queue)
-    return (
-        Job.select()
-        .join(Set, JOIN.LEFT_OUTER)
+    return prefetch(
+        Job.select(Job, Queue)
+        .join(Queue)
         .where(Job.queue == queue)
-        .group_by(Job.id)
-        .order_by(Job.rank.asc())
-    ).execute()
+        .order_by(Job.rank.asc()),
+        Set.select().order_by(Set.rank.asc(), Set.id.asc()),
+    )
+
+
+def getQueuedSetPaths() -> set:
+    # Paths of local files referenced by sets in any queue other than the archive
+    return set(
+        s.path
+        for s in Set.select(Set.path)
+        .join(Job)
+        .join(Queue)
+        .where((Queue.name != ARCHIVE_QUEUE) & (~Set.sd))
+        .distinct()
+    )
+
+
+def getRemainingPrints() -> dict:
+    # Set prints left in each local queue's non-draft jobs, by queue name; matches
+    # JobView.remaining_prints() summed in SQL so jobs needn't be loaded
+    n = fn.SUM(Set.remaining + Set.count * (Job.remaining - 1))
+    return dict(
+        Set.select(Queue.name, n)
+        .join(Job)
+        .join(Queue)
+        .where((Queue.name != ARCHIVE_QUEUE) & (~Job.draft) & (Job.remaining > 0))
+        .group_by(Queue.name)
+        .tuples()
+    )
 
 
 def getJob(jid):
     return Job.get(id=jid)
 
 
+def _candidateJobs(queue, profile):
+    # Jobs which could yield a printable set for the given profile, in rank order.
+    # Exhausted, draft, archived and incompatible jobs are excluded here
+    # so they never need to be loaded and scanned.
+    pname = profile["name"] if profile is not None else None
+    printable = Set.select(Set.id).where(
+        (Set.job == Job.id)
+        & (
+            (Set.profile_keys == "")
+            | fn.EXISTS(
+                SetProfile.select(SetProfile.id).where(
+                    (SetProfile.set == Set.id) & (SetProfile.profile == pname)
+                )
+            )
+        )
+    )
+    return (
+        Job.select(Job, Queue)
+        .join(Queue)
+        .where(
+            (Job.queue == queue)
+            & (Queue.name != ARCHIVE_QUEUE)
+            & (~Job.draft)
+            & (Job.remaining > 0)
+            & fn.EXISTS(printable)
+        )
+        .order_by(Job.rank.asc())
+    )
+
+
 def getNextJobInQueue(q, profile, custom_filter=None):
-    for job in getJobsAndSets(q):
+    if type(q) == str:
+        q = Queue.get(name=q)
+    for job in list(_candidateJobs(q, profile)):
+        # Sets are only loaded for jobs we actually examine
+        job.sets = list(job.sets.order_by(Set.rank.asc(), Set.id.asc()))
         ns = job.next_set(
             profile, custom_filter
         )  # Only return a job which has a compatible next set
@@ -193,6 +265,7 @@ def _upsertSet(set_id, data, job):
         ["" if p is None else p for p in data.get("profiles", [])]
     )
     s.save()
+    s.update_profile_index()
 
 
 def updateJob(job_id, data, queue=DEFAULT_QUEUE):
@@ -231,23 +304,60 @@ def updateJob(job_id, data, queue=DEFAULT_QUEUE):
         return Job.get(id=job_id).as_dict()
 
 
-MAX_RANK = 1000000.0  # Arbitrary
+# Spacing between job ranks after rebalancing, and when moving to either end of a queue
+RANK_GAP = 1024.0
+# Neighboring ranks closer than this are spread out again when rebalancing
+MIN_RANK_GAP = 1.0
+# Initial number of jobs on each side of a collision to spread out when rebalancing
+REBALANCE_WINDOW = 16
+# Rows per UPDATE ... CASE statement (3 bound parameters each)
+RANK_UPDATE_BATCH = 300
 
 
-def _genRank(n):
-    maxval = MAX_RANK
-    stride = int(maxval / (n + 1))  # n+1 to allow for space at beginning
-    for i in range(stride, int(maxval + 1), stride):
-        yield i
+def _setRanks(ranks: dict):
+    for batch in chunked(list(ranks.items()), RANK_UPDATE_BATCH):
+        Job.update(rank=Case(Job.id, batch)).where(
+            Job.id.in_([jid for jid, _ in batch])
+        ).execute()
 
 
-def _rankBalance(cls):
-    with DB.queues.atomic():
-        # TODO discriminate by queue - may case weirdness with archived jobs
-        ranker = _genRank(cls.select().count())
-        for (l, c) in zip(ranker, cls.select().order_by(cls.rank)):
-            c.rank = l
-            c.save()
+def _rankBalance(queue, rank, exclude_id):
+    """Spreads out the ranks of jobs in `queue` around `rank`, so that a job can be placed
+    just after it. Only a window of neighbors is rewritten; the window doubles until its
+    jobs can be spaced at least MIN_RANK_GAP apart, or it spans the whole queue."""
+    others = Job.select(Job.id, Job.rank).where(
+        (Job.queue == queue) & (Job.id != exclude_id)
+    )
+    window = REBALANCE_WINDOW
+    while True:
+        below = list(
+            others.where(Job.rank <= rank).order_by(Job.rank.desc()).limit(window + 1)
+        )[::-1]
+        above = list(others.where(Job.rank > rank).order_by(Job.rank).limit(window + 1))
+
+        # The outermost job on each side stays put as a bound, unless the window
+        # reached the end of the queue on that side
+        rows = below + above
+        lo = hi = None
+        if len(below) > window:
+            lo = rows.pop(0).rank
+        if len(above) > window:
+            hi = rows.pop().rank
+
+        if lo is None and hi is None:
+            ranks = [RANK_GAP * (i + 1) for i in range(len(rows))]
+        elif lo is None:
+            ranks = [hi - RANK_GAP * (len(rows) - i) for i in range(len(rows))]
+        elif hi is None:
+            ranks = [lo + RANK_GAP * (i + 1) for i in range(len(rows))]
+        elif (hi - lo) / (len(rows) + 1) >= MIN_RANK_GAP:
+            step = (hi - lo) / (len(rows) + 1)
+            ranks = [lo + step * (i + 1) for i in range(len(rows))]
+        else:
+            window *= 2
+            continue
+        _setRanks(dict((r.id, nr) for r, nr in zip(rows, ranks)))
+        return len(rows)
 
 
 def _rankEnd():
@@ -255,44 +365,31 @@ def _rankEnd():
 
 
 def _moveImpl(src, dest_id, retried=False):
-    if dest_id is None:
-        destRank = 0
-    else:
-        dest_id = int(dest_id)
-        destRank = Job.get(id=dest_id).rank
-
-    # Get the next object having a rank beyond the destination rank,
-    # so we can then split the difference
-    # Note the unary '&' operator and the expressions wrapped in parens (a limitation of peewee)
-    postRank = (
-        Job.select(Job.rank)
-        .where(
-            (Job.rank > destRank)
-            & (Job.id != src.id)
-            & (Job.queue.name != ARCHIVE_QUEUE)
-        )
-        .order_by(Job.rank)
-        .limit(1)
-        .execute()
+    # Ranks only need to be ordered within a queue, so neighbors come from src's queue.
+    # A move writes only src's rank unless there's no room left between its neighbors.
+    others = Job.select(Job.rank).where(
+        (Job.queue == src.queue_id) & (Job.id != src.id)
     )
-    if len(postRank) > 0:
-        postRank = postRank[0].rank
+    if dest_id is None:
+        first = others.order_by(Job.rank).limit(1).execute()
+        candidate = first[0].rank - RANK_GAP if len(first) > 0 else src.rank
     else:
-        postRank = MAX_RANK
-    # Pick the target value as the midpoint between the two ranks
-    candidate = abs(postRank - destRank) / 2 + min(postRank, destRank)
-
-    # We may end up with an invalid candidate if we hit a singularity - in this case, rebalance all the
-    # rows and try again
-    if candidate <= destRank or candidate >= postRank:
-        if not retried:
-            _rankBalance(Job)
-            _moveImpl(src, dest_id, retried=True)
+        destRank = Job.get(id=int(dest_id)).rank
+        post = others.where(Job.rank > destRank).order_by(Job.rank).limit(1).execute()
+        if len(post) == 0:
+            candidate = destRank + RANK_GAP
         else:
-            raise Exception("Could not rebalance job rank to move job")
-    else:
-        src.rank = candidate
-        src.save()
+            candidate = (destRank + post[0].rank) / 2
+            # Floats run out of precision after enough moves into the same gap
+            if candidate <= destRank or candidate >= post[0].rank:
+                if retried:
+                    raise Exception("Could not rebalance job rank to move job")
+                with DB.queues.atomic():
+                    _rankBalance(src.queue_id, destRank, src.id)
+                    return _moveImpl(src, dest_id, retried=True)
+
+    src.rank = candidate
+    src.save(only=[Job.rank])
 
 
 def moveJob(src_id: int, dest_id: int):
@@ -300,6 +397,49 @@ def moveJob(src_id: int, dest_id: int):
     return _moveImpl(j, dest_id)
 
 
+def reorderJobs(queue: str, job_ids: list, after_id=None):
+    """Moves `job_ids`, in the given order, to directly after `after_id` (or the front of
+    the queue if None) in a single transaction. Other jobs keep their relative order.
+
+    Only the listed jobs are written, unless there's no room between their new neighbors;
+    then the whole queue is re-spread."""
+    job_ids = [int(jid) for jid in job_ids]
+    with DB.queues.atomic():
+        q = Queue.get(name=queue)
+        ranks = dict(
+            (j.id, j.rank)
+            for j in Job.select(Job.id, Job.rank)
+            .where(Job.queue == q)
+            .order_by(Job.rank)
+        )
+        moving = set(job_ids)
+        if len(moving) != len(job_ids) or not moving.issubset(ranks.keys()):
+            raise ValueError(f"Job IDs must be unique and within queue {queue}")
+        rest = [jid for jid in ranks.keys() if jid not in moving]
+        if after_id is None:
+            idx = 0
+        elif int(after_id) in rest:
+            idx = rest.index(int(after_id)) + 1
+        else:
+            raise ValueError(f"Job {after_id} is not an unmoved job in queue {queue}")
+
+        n = len(job_ids)
+        lo = ranks[rest[idx - 1]] if idx > 0 else None
+        hi = ranks[rest[idx]] if idx < len(rest) else None
+        if lo is None and hi is None:
+            new = [RANK_GAP * (i + 1) for i in range(n)]
+        elif lo is None:
+            new = [hi - RANK_GAP * (n - i) for i in range(n)]
+        elif hi is None:
+            new = [lo + RANK_GAP * (i + 1) for i in range(n)]
+        elif (hi - lo) / (n + 1) >= MIN_RANK_GAP:
+            new = [lo + (hi - lo) / (n + 1) * (i + 1) for i in range(n)]
+        else:
+            job_ids = rest[:idx] + job_ids + rest[idx:]
+            new = [RANK_GAP * (i + 1) for i in range(len(job_ids))]
+        _setRanks(dict(zip(job_ids, new)))
+
+
 def newEmptyJob(q, name="", rank=_rankEnd):
     if type(q) == str:
         q = Queue.get(name=q)
@@ -344,10 +484,91 @@ def appendSet(queue: str, jid, data: dict, rank=_rankEnd):
         completed=getint(data, "completed"),
         job=j,
     )
+    s.update_profile_index()
 
     return dict(job_id=j.id, set_=s.as_dict())
 
 
+def _insertMany(model, rows, fields=None):
+    # Returns the IDs of the inserted rows, in order. Within a transaction SQLite assigns
+    # sequential rowids to the rows of a multi-row INSERT, so they can be derived
+    # from the last inserted rowid.
+    ids = []
+    for batch in chunked(rows, BULK_INSERT_BATCH):
+        last = model.insert_many(batch, fields=fields).execute()
+        ids += range(last - len(batch) + 1, last + 1)
+    return ids
+
+
+def _csvField(d, listform, csvform):
+    if d.get(listform) is not None:
+        return ",".join(["" if v is None else v for v in d[listform]])
+    return d.get(csvform, "")
+
+
+def bulkImport(queue: str, jobs: list, rank=_rankEnd):
+    """Inserts jobs (dicts as given by JobView.as_dict()) and their sets in a single
+    transaction, using multi-row inserts. Returns a list of dict(job_id, set_ids) in the
+    same order as `jobs`."""
+    # Ranks must be distinct and increasing; the step is small enough that a
+    # subsequent time-based rank still sorts after the imported items.
+    step = 1e-6
+    with DB.queues.atomic():
+        q = Queue.get(name=queue)
+        base = rank()
+        job_rows = []
+        for i, j in enumerate(jobs):
+            count = min(getint(j, "count", 1), MAX_COUNT)
+            row = dict(
+                queue=q.id,
+                name=j.get("name", ""),
+                rank=base + i * step,
+                count=count,
+                remaining=min(getint(j, "remaining", count), count),
+                draft=getbool(j, "draft", True),
+            )
+            if j.get("created") is not None:
+                row["created"] = j["created"]
+            job_rows.append(row)
+        job_ids = _insertMany(Job, job_rows)
+
+        set_rows = []
+        for jid, j in zip(job_ids, jobs):
+            for s in j.get("sets", []):
+                count = min(getint(s, "count", 1), MAX_COUNT)
+                set_rows.append(
+                    dict(
+                        job=jid,
+                        path=s["path"],
+                        sd=getbool(s, "sd"),
+                        rank=base + len(set_rows) * step,
+                        count=count,
+                        remaining=min(getint(s, "remaining", count), MAX_COUNT),
+                        completed=getint(s, "completed"),
+                        metadata=s.get("metadata"),
+                        material_keys=_csvField(s, "materials", "material_keys"),
+                        profile_keys=_csvField(s, "profiles", "profile_keys"),
+                    )
+                )
+        set_ids = _insertMany(Set, set_rows)
+
+        profile_rows = []
+        for sid, s in zip(set_ids, set_rows):
+            profiles = set(s["profile_keys"].split(",")) - set([""])
+            profile_rows += [(sid, p) for p in sorted(profiles)]
+        _insertMany(
+            SetProfile, profile_rows, fields=[SetProfile.set, SetProfile.profile]
+        )
+
+    result = []
+    set_ids = iter(set_ids)
+    for jid, j in zip(job_ids, jobs):
+        result.append(
+            dict(job_id=jid, set_ids=[next(set_ids) for _ in j.get("sets", [])])
+        )
+    return result
+
+
 def remove(queue_ids: list = [], job_ids: list = [], set_ids: list = []):
     result = {}
     with DB.queues.atomic():
@@ -360,7 +581,9 @@ def remove(queue_ids: list = [], job_ids: list = [], set_ids: list = []):
         q = Queue.get(name="archive")
         if len(job_ids) > 0:
             result["jobs_deleted"] = (
-                Job.update(queue=q).where(Job.id.in_(job_ids)).execute()
+                Job.update(queue=q, archived=datetime.now())
+                .where(Job.id.in_(job_ids))
+                .execute()
             )
 
         # Only delete sets if we haven't already archived their job
@@ -390,19 +613,36 @@ def resetJobs(job_ids: list):
 
 
 def beginRun(qname, jname, spath):
-    # Abort any unfinished runs before beginning a new run in the job
-    Run.update({Run.end: datetime.now(), Run.result: "aborted"}).where(
-        (Run.jobName == jname) & (Run.end.is_null())
-    ).execute()
-    return Run.create(
-        queueName=qname, jobName=jname, path=spath
-    )  # start defaults to now()
+    with DB.queues.atomic():
+        # Abort any unfinished runs before beginning a new run in the job
+        for r in Run.select().where((Run.jobName == jname) & (Run.end.is_null())):
+            endRun(r, "aborted")
+        return Run.create(
+            queueName=qname, jobName=jname, path=spath
+        )  # start defaults to now()
 
 
 def endRun(r, result: str, txn=None):
-    r.end = datetime.now()
-    r.result = result
-    r.save()
+    with DB.queues.atomic():
+        r.end = datetime.now()
+        r.result = result
+        r.save()
+        RunStats.record(r)
+
+
+def getRunTotals() -> list:
+    # (queueName, result, runs, total seconds) for all finished runs, from the
+    # RunStats rollup rather than the run table
+    return list(
+        RunStats.select(
+            RunStats.queueName,
+            RunStats.result,
+            fn.SUM(RunStats.count),
+            fn.SUM(RunStats.duration),
+        )
+        .group_by(RunStats.queueName, RunStats.result)
+        .tuples()
+    )
 
 
 def annotateLastRun(gcode, movie_path, thumb_path):
@@ -422,31 +662,155 @@ def annotateLastRun(gcode, movie_path, thumb_path):
         return False
     run.movie_path = movie_path
     run.thumb_path = thumb_path
-    return run.save() > 0
-
-
-def getHistory():
-    cur = (Run.select().order_by(Run.start.desc()).limit(100)).execute()
-
-    result = [
-        dict(
-            start=int(c.start.timestamp()),
-            end=int(c.end.timestamp()) if c.end is not None else None,
-            result=c.result,
-            queue_name=c.queueName,
-            job_name=c.jobName,
-            set_path=c.path,
-            run_id=c.id,
-            movie_path=c.movie_path,
-            thumb_path=c.thumb_path,
+    if run.save() > 0:
+        return run
+
+
+MAX_HISTORY_PAGE = 1000
+
+
+def _historyRow(r) -> dict:
+    return dict(
+        start=int(r.start.timestamp()),
+        end=int(r.end.timestamp()) if r.end is not None else None,
+        result=r.result,
+        queue_name=r.queueName,
+        job_name=r.jobName,
+        set_path=r.path,
+        run_id=r.id,
+        movie_path=r.movie_path,
+        thumb_path=r.thumb_path,
+    )
+
+
+def getHistory(
+    before=None,
+    limit=100,
+    queue=None,
+    job=None,
+    result=None,
+    since=None,
+    until=None,
+):
+    """Returns runs newest first. To fetch the next page, pass the run_id of the last
+    row as `before`. `since` and `until` are unix timestamps bounding the run start,
+    inclusive and exclusive respectively."""
+    q = Run.select()
+    if before is not None:
+        # Keyset pagination on (start, id) so pages stay stable as new runs are added.
+        # The leading `start <=` term lets SQLite seek into the start index.
+        cursor = Run.get_or_none(id=before)
+        if cursor is None:
+            q = q.where(Run.id < before)
+        else:
+            q = q.where(
+                (Run.start <= cursor.start)
+                & ((Run.start < cursor.start) | (Run.id < cursor.id))
+            )
+    if queue is not None:
+        q = q.where(Run.queueName == queue)
+    if job is not None:
+        q = q.where(Run.jobName == job)
+    if result is not None:
+        q = q.where(Run.result == result)
+    if since is not None:
+        q = q.where(Run.start >= datetime.fromtimestamp(since))
+    if until is not None:
+        q = q.where(Run.start < datetime.fromtimestamp(until))
+    limit = max(0, min(int(limit), MAX_HISTORY_PAGE))
+    cur = q.order_by(Run.start.desc(), Run.id.desc()).limit(limit)
+    return [_historyRow(c) for c in cur]
+
+
+def getRun(run_id):
+    r = Run.get_or_none(id=run_id)
+    if r is not None:
+        return _historyRow(r)
+
+
+# Ways in which getHistoryStats() can group runs
+STATS_GROUPS = ("path", "job", "queue", "day")
+
+
+def _statsKey(model, group):
+    if group == "day":
+        return model.day if model is RunStats else fn.date(Run.start).coerce(False)
+    return getattr(model, dict(path="path", job="jobName", queue="queueName")[group])
+
+
+def getHistoryStats(group="path", queue=None, since=None, until=None):
+    """Aggregates finished runs by `group`, one of STATS_GROUPS.
+
+    Counts come from the daily RunStats rollup, unless `since` or `until` (unix
+    timestamps bounding the run start, as in getHistory()) are given - then the matching runs are
+    aggregated directly so the window isn't rounded to whole days."""
+    if group not in STATS_GROUPS:
+        raise ValueError(f"Invalid stats group {group}, options: {STATS_GROUPS}")
+
+    if since is None and until is None:
+        m = RunStats
+        runs = fn.SUM(RunStats.count)
+        duration = fn.SUM(RunStats.duration)
+        nresult = lambda res: fn.SUM(Case(RunStats.result, ((res, RunStats.count),), 0))
+    else:
+        m = Run
+        runs = fn.COUNT(Run.id)
+        duration = fn.SUM(run_duration())
+        nresult = lambda res: fn.SUM(Case(Run.result, ((res, 1),), 0))
+
+    key = _statsKey(m, group)
+    q = m.select(
+        key.alias("key"),
+        runs.alias("runs"),
+        nresult("success").alias("success"),
+        nresult("failure").alias("failure"),
+        nresult("aborted").alias("aborted"),
+        duration.alias("duration"),
+    )
+    if m is Run:
+        q = q.where(Run.end.is_null(False) & Run.result.is_null(False))
+        if since is not None:
+            q = q.where(Run.start >= datetime.fromtimestamp(since))
+        if until is not None:
+            q = q.where(Run.start < datetime.fromtimestamp(until))
+    if queue is not None:
+        q = q.where(m.queueName == queue)
+
+    result = []
+    for r in q.group_by(key).order_by(key).dicts():
+        row = dict(
+            key=str(r["key"]),
+            runs=r["runs"],
+            success=r["success"],
+            failure=r["failure"],
+            aborted=r["aborted"],
+            duration=round(r["duration"], 1),
+            mean_duration=round(r["duration"] / r["runs"], 1),
+            success_rate=r["success"] / r["runs"],
         )
-        for c in cur
-    ]
+        if group == "day":
+            # Fraction of the day spent printing
+            row["utilization"] = min(1.0, r["duration"] / 86400)
+        result.append(row)
     return result
 
 
 def resetHistory():
-    Run.delete().execute()
+    with DB.queues.atomic():
+        Run.delete().execute()
+        RunStats.delete().execute()
+
+
+def getCachedProfile(content_hash: str) -> Optional[str]:
+    # Returns None on a cache miss, or "" if no profile could be inferred
+    pc = ProfileCache.get_or_none(ProfileCache.hash == content_hash)
+    return None if pc is None else pc.profile
+
+
+def cacheProfile(content_hash: str, profile: Optional[str]):
+    ProfileCache.insert(
+        hash=content_hash, profile=profile or ""
+    ).on_conflict_replace().execute()
 
 
 def assignAutomation(scripts, preprocessors, events):
@@ -472,6 +836,7 @@ def assignAutomation(scripts, preprocessors, events):
                 EventHook.create(
                     name=k, script=s[a["script"]], preprocessor=pre, rank=i
                 )
+    DB.automation_rev += 1
 
 
 def getAutomation():
@@ -499,15 +864,59 @@ def getAutomation():
     return dict(scripts=scripts, events=events, preprocessors=preprocessors)
 
 
-def genEventScript(evt: CustomEvents, interp=None, logger=None) -> str:
-    result = []
-    for e in (
-        EventHook.select()
+def getEventHooks(event=None) -> dict:
+    """Returns event hooks (all of them, unless `event` is given) in a single query, as
+    {event: [EventHook, ...]} in rank order with script and preprocessor joined."""
+    q = (
+        EventHook.select(EventHook, Script, Preprocessor)
         .join_from(EventHook, Script, JOIN.LEFT_OUTER)
         .join_from(EventHook, Preprocessor, JOIN.LEFT_OUTER)
-        .where(EventHook.name == evt.event)
-        .order_by(EventHook.rank)
-    ):
+    )
+    if event is not None:
+        q = q.where(EventHook.name == event)
+    hooks = dict()
+    for e in q.order_by(EventHook.rank):
+        hooks.setdefault(e.name, []).append(e)
+    return hooks
+
+
+def formatHookScript(e, procval, logger=None, leftovers=None):
+    """Returns the script body of EventHook `e` given its preprocessor result, or None if
+    the script should be skipped. Pass `leftovers` (the placeholders in the unformatted
+    body) to skip searching for them when the body is used unformatted."""
+    if procval is None or procval is False:
+        return None
+    elif procval is True:
+        formatted = e.script.body
+        if leftovers is None:
+            leftovers = re.findall(r"\{.*?\}", formatted)
+    elif type(procval) is dict:
+        if logger:
+            logger.info(
+                f"Appending script {e.script.name} using formatting data {procval}"
+            )
+        formatted = e.script.body.format(**procval)
+        leftovers = re.findall(r"\{.*?\}", formatted)
+    else:
+        raise Exception(
+            f"Invalid return type {type(procval)} for peprocessor {e.preprocessor.name}"
+        )
+
+    if len(leftovers) > 0:
+        ppname = (
+            f"f from preprocessor {e.preprocessor.name}"
+            if e.preprocessor is not None
+            else ""
+        )
+        raise Exception(
+            f"Unformatted placeholders in {e.script.name}{ppname}: {leftovers}"
+        )
+    return formatted
+
+
+def genEventScript(evt: CustomEvents, interp=None, logger=None) -> str:
+    result = []
+    for e in getEventHooks(evt.event).get(evt.event, []):
         procval = True
         if e.preprocessor is not None and e.preprocessor.body.strip() != "":
             procval = interp(e.preprocessor.body)
@@ -515,31 +924,7 @@ def genEventScript(evt: CustomEvents, interp=None, logger=None) -> str:
                 logger.info(
                     f"EventHook preprocessor for script {e.script.name} ({e.preprocessor.name}): {e.preprocessor.body}\nSymbols: {interp.symtable}\nResult: {procval}"
                 )
-
-        if procval is None or procval is False:
-            continue
-        elif procval is True:
-            formatted = e.script.body
-        elif type(procval) is dict:
-            if logger:
-                logger.info(
-                    f"Appending script {e.script.name} using formatting data {procval}"
-                )
-            formatted = e.script.body.format(**procval)
-        else:
-            raise Exception(
-                f"Invalid return type {type(procval)} for peprocessor {e.preprocessor.name}"
-            )
-
-        leftovers = re.findall(r"\{.*?\}", formatted)
-        if len(leftovers) > 0:
-            ppname = (
-                f"f from preprocessor {e.preprocessor.name}"
-                if e.preprocessor is not None
-                else ""
-            )
-            raise Exception(
-                f"Unformatted placeholders in {e.script.name}{ppname}: {leftovers}"
-            )
-        result.append(formatted)
+        formatted = formatHookScript(e, procval, logger)
+        if formatted is not None:
+            result.append(formatted)
     return "\n".join(result)
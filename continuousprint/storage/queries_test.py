@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import ANY
+from unittest.mock import ANY, patch
 from pathlib import Path
 from ..data import CustomEvents
 import logging
@@ -13,13 +13,16 @@ import time
 from .database import (
     Job,
     Set,
+    SetProfile,
     Run,
+    RunStats,
     Queue,
     DEFAULT_QUEUE,
     ARCHIVE_QUEUE,
     EventHook,
     Script,
     Preprocessor,
+    DB,
 )
 from .database_test import QueuesDBTest, AutomationDBTest
 from ..storage import queries as q
@@ -42,6 +45,16 @@ class TestEmptyQueue(QueuesDBTest):
         q.clearOldState()
         self.assertEqual(Job.select().where(Job.acquired).count(), 0)
         self.assertEqual(Run.select().where(Run.end.is_null()).count(), 0)
+        # Aborted runs are included in the rollup
+        stats = q.getHistoryStats(group="queue")
+        self.assertEqual([(s["runs"], s["aborted"]) for s in stats], [(1, 1)])
+
+    def testProfileCache(self):
+        self.assertEqual(q.getCachedProfile("abc"), None)
+        q.cacheProfile("abc", None)
+        self.assertEqual(q.getCachedProfile("abc"), "")
+        q.cacheProfile("abc", "Prusa Mini")
+        self.assertEqual(q.getCachedProfile("abc"), "Prusa Mini")
 
     def testImportJob(self):
         q.importJob(
@@ -54,6 +67,67 @@ class TestEmptyQueue(QueuesDBTest):
         self.assertEqual(j.remaining, 5)  # Overridden
         self.assertEqual(j.sets[0].path, "dirname/a.gcode")  # Prepended dirname
 
+    def testBulkImport(self):
+        got = q.bulkImport(
+            DEFAULT_QUEUE,
+            [
+                dict(
+                    name="j1",
+                    count=2,
+                    draft=False,
+                    sets=[
+                        dict(path="a.gcode", count=3, profiles=["p1", "p2"]),
+                        dict(path="b.gcode", sd="true", materials=["m1"]),
+                    ],
+                ),
+                dict(name="j2", sets=[]),
+            ]
+            + [dict(name=f"j{i}", sets=[dict(path="c.gcode")]) for i in range(3, 103)],
+        )
+        self.assertEqual(len(got), 102)
+        self.assertEqual(got[0], dict(job_id=1, set_ids=[1, 2]))
+        self.assertEqual(got[1], dict(job_id=2, set_ids=[]))
+        self.assertEqual(got[-1], dict(job_id=102, set_ids=[102]))
+
+        j = Job.get(id=1)
+        self.assertEqual((j.name, j.count, j.remaining, j.draft), ("j1", 2, 2, False))
+        self.assertEqual(Job.get(id=2).draft, True)
+        self.assertEqual(
+            [s.as_dict() for s in j.sets],
+            [
+                dict(
+                    path="a.gcode",
+                    count=3,
+                    metadata=None,
+                    materials=[],
+                    profiles=["p1", "p2"],
+                    id=1,
+                    rank=ANY,
+                    sd=False,
+                    remaining=3,
+                    completed=0,
+                ),
+                dict(
+                    path="b.gcode",
+                    count=1,
+                    metadata=None,
+                    materials=["m1"],
+                    profiles=[],
+                    id=2,
+                    rank=ANY,
+                    sd=True,
+                    remaining=1,
+                    completed=0,
+                ),
+            ],
+        )
+        self.assertEqual(
+            [sp.profile for sp in SetProfile.select().where(SetProfile.set == 1)],
+            ["p1", "p2"],
+        )
+        js = q.getJobsAndSets(DEFAULT_QUEUE)
+        self.assertEqual([j.id for j in js], list(range(1, 103)))
+
     def testAppendSet(self):
         # Initial append creates a job to live in
         self.assertEqual(
@@ -129,9 +203,21 @@ class TestSingleItemQueue(QueuesDBTest):
         q.updateJob(1, dict(sets=[dict(id=1, profiles=["a", "b"])]))
         self.assertEqual(Set.get(id=1).profiles(), ["a", "b"])
 
+    def testNextJobInQueueSkipsIncompatibleProfile(self):
+        q.updateJob(1, dict(sets=[dict(id=1, profiles=["other"])]))
+        self.assertEqual(q.getNextJobInQueue(DEFAULT_QUEUE, PROFILE), None)
+        self.assertEqual(
+            q.getNextJobInQueue(DEFAULT_QUEUE, dict(name="other")).name, "j1"
+        )
+
+    def testNextJobInQueueSkipsDraft(self):
+        Job.update(draft=True).where(Job.id == 1).execute()
+        self.assertEqual(q.getNextJobInQueue(DEFAULT_QUEUE, PROFILE), None)
+
     def testRemoveJob(self):
         q.remove(job_ids=[1])
         self.assertEqual(len(q.getJobsAndSets(DEFAULT_QUEUE)), 0)  # No jobs or sets
+        self.assertNotEqual(Job.get(id=1).archived, None)
 
     def testJobIdsConsistent(self):
         q.remove(job_ids=[1])
@@ -299,12 +385,50 @@ class TestMultiItemQueue(QueuesDBTest):
                 rank=rank,
             )
 
+    def testGetQueuedSetPaths(self):
+        self.assertEqual(
+            q.getQueuedSetPaths(), {"a.gcode", "b.gcode", "c.gcode", "d.gcode"}
+        )
+        q.remove(job_ids=[1])
+        self.assertEqual(q.getQueuedSetPaths(), {"c.gcode", "d.gcode"})
+
+    def testGetRemainingPrints(self):
+        self.assertEqual(q.getRemainingPrints(), {DEFAULT_QUEUE: 4})
+        Job.update(count=2, remaining=2).where(Job.id == 1).execute()
+        Set.update(remaining=0).where(Set.id == 1).execute()
+        self.assertEqual(q.getRemainingPrints(), {DEFAULT_QUEUE: 1 + 2 + 2})
+        want = sum(j.remaining_prints() for j in Job.select())
+        self.assertEqual(q.getRemainingPrints()[DEFAULT_QUEUE], want)
+
+        Job.update(draft=True).where(Job.id == 2).execute()
+        self.assertEqual(q.getRemainingPrints(), {DEFAULT_QUEUE: 3})
+
     def testMoveJob(self):
         for (moveArgs, want) in [((1, 2), [2, 1]), ((2, None), [2, 1])]:
             with self.subTest(f"moveJob({moveArgs}) -> want {want}"):
                 q.moveJob(*moveArgs)
                 self.assertEqual([j.id for j in q.getJobsAndSets(DEFAULT_QUEUE)], want)
 
+    def testMoveJobIgnoresOtherQueues(self):
+        other = Queue.create(name="other", strategy="LINEAR", rank=5)
+        j3 = q.newEmptyJob(other, "j3", rank=lambda: Job.get(id=1).rank + 1e-9)
+        q.moveJob(2, 1)  # Moves to the end, so doesn't need a midpoint with j3
+        self.assertEqual([j.id for j in q.getJobsAndSets(DEFAULT_QUEUE)], [1, 2])
+        q.moveJob(2, None)
+        self.assertEqual([j.id for j in q.getJobsAndSets(DEFAULT_QUEUE)], [2, 1])
+        self.assertEqual(Job.get(id=j3.id).rank, j3.rank)
+
+    def testGetJobsAndSetsPrefetched(self):
+        js = q.getJobsAndSets(DEFAULT_QUEUE)
+        with patch.object(DB.queues, "execute_sql") as es:
+            self.assertEqual(
+                [[s.path for s in j.sets] for j in js],
+                [["a.gcode", "b.gcode"], ["c.gcode", "d.gcode"]],
+            )
+            self.assertEqual([j.as_dict()["queue"] for j in js], [DEFAULT_QUEUE] * 2)
+            self.assertEqual(js[0].sets[0].job, js[0])
+            es.assert_not_called()
+
     def testGetNextJobAfterDecrement(self):
         j = q.getNextJobInQueue(DEFAULT_QUEUE, PROFILE)
         s = j.sets[0]
@@ -351,18 +475,138 @@ class TestMultiItemQueue(QueuesDBTest):
             ],
         )
 
+    def testGetHistoryPaginated(self):
+        t0 = datetime.datetime(2022, 1, 1)
+        for i in range(5):
+            Run.create(
+                queueName=DEFAULT_QUEUE,
+                jobName=f"j{i % 2}",
+                path="a.gcode",
+                # Two runs share a start time to exercise the id tiebreak
+                start=t0 + datetime.timedelta(hours=min(i, 3)),
+                result="success" if i != 2 else "failure",
+            )
+        ids = lambda rows: [r["run_id"] for r in rows]
+        self.assertEqual(ids(q.getHistory(limit=2)), [5, 4])
+        self.assertEqual(ids(q.getHistory(before=4, limit=2)), [3, 2])
+        self.assertEqual(ids(q.getHistory(before=2, limit=2)), [1])
+        self.assertEqual(ids(q.getHistory(before=1)), [])
+
+        self.assertEqual(ids(q.getHistory(job="j1")), [4, 2])
+        self.assertEqual(ids(q.getHistory(result="failure")), [3])
+        self.assertEqual(ids(q.getHistory(queue="other")), [])
+        self.assertEqual(
+            ids(
+                q.getHistory(
+                    since=(t0 + datetime.timedelta(hours=1)).timestamp(),
+                    until=(t0 + datetime.timedelta(hours=3)).timestamp(),
+                )
+            ),
+            [3, 2],
+        )
+
+    def testGetRun(self):
+        s = Set.get(id=1)
+        r = q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
+        self.assertEqual(q.getRun(r.id)["set_path"], "a.gcode")
+        self.assertEqual(q.getRun(12345), None)
+
     def testResetHistory(self):
         s = Set.get(id=1)
         q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
         self.assertNotEqual(Run.select().count(), 0)
         q.resetHistory()
         self.assertEqual(Run.select().count(), 0)
+        self.assertEqual(RunStats.select().count(), 0)
+
+    def testRunStatsUpdatedOnEnd(self):
+        s = Set.get(id=1)
+        r = q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
+        self.assertEqual(RunStats.select().count(), 0)
+        q.endRun(r, "success")
+        # Starting a run in the same job aborts any unfinished ones
+        q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
+        q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
+        got = dict((rs.result, rs.count) for rs in RunStats.select())
+        self.assertEqual(got, dict(success=1, aborted=1))
+
+    def testGetRunTotals(self):
+        s = Set.get(id=1)
+        for result in ("success", "success", "failure"):
+            q.endRun(q.beginRun(DEFAULT_QUEUE, s.job.name, s.path), result)
+        got = dict((res, n) for (qn, res, n, _) in q.getRunTotals())
+        self.assertEqual(got, dict(success=2, failure=1))
+
+    def testGetHistoryStats(self):
+        t0 = datetime.datetime(2022, 1, 1, 12)
+        for i, (path, result) in enumerate(
+            [
+                ("a.gcode", "success"),
+                ("a.gcode", "failure"),
+                ("b.gcode", "success"),
+                ("b.gcode", None),  # Unfinished; not counted
+            ]
+        ):
+            r = Run.create(
+                queueName=DEFAULT_QUEUE,
+                jobName="j1",
+                path=path,
+                start=t0 + datetime.timedelta(days=i // 2),
+            )
+            if result is not None:
+                r.end = r.start + datetime.timedelta(hours=i + 1)
+                r.result = result
+                r.save()
+                RunStats.record(r)
+
+        byPath = q.getHistoryStats()
+        self.assertEqual([s["key"] for s in byPath], ["a.gcode", "b.gcode"])
+        self.assertEqual(
+            byPath[0],
+            dict(
+                key="a.gcode",
+                runs=2,
+                success=1,
+                failure=1,
+                aborted=0,
+                duration=3 * 3600,
+                mean_duration=1.5 * 3600,
+                success_rate=0.5,
+            ),
+        )
+        self.assertEqual(q.getHistoryStats(group="job")[0]["runs"], 3)
+        self.assertEqual(q.getHistoryStats(queue="other"), [])
+
+        byDay = q.getHistoryStats(group="day")
+        self.assertEqual([s["key"] for s in byDay], ["2022-01-01", "2022-01-02"])
+        self.assertEqual(byDay[1]["utilization"], 3 / 24)
+
+        # Time-bounded queries aggregate raw runs, and must match the rollup
+        windowed = q.getHistoryStats(group="day", since=t0.timestamp() - 1)
+        self.assertEqual(
+            [(s["key"], s["runs"], s["duration"]) for s in windowed],
+            [(s["key"], s["runs"], s["duration"]) for s in byDay],
+        )
+        windowed = q.getHistoryStats(
+            since=(t0 + datetime.timedelta(days=1)).timestamp()
+        )
+        self.assertEqual([(s["key"], s["runs"]) for s in windowed], [("b.gcode", 1)])
+        # `until` excludes runs starting exactly at the bound, as in getHistory()
+        windowed = q.getHistoryStats(
+            until=(t0 + datetime.timedelta(days=1)).timestamp()
+        )
+        self.assertEqual([(s["key"], s["runs"]) for s in windowed], [("a.gcode", 2)])
+
+        with self.assertRaises(ValueError):
+            q.getHistoryStats(group="bogus")
 
     def testAnnotateLastRun(self):
         s = Set.get(id=1)
         r = q.beginRun(DEFAULT_QUEUE, s.job.name, s.path)
         q.endRun(r, "success")
-        q.annotateLastRun(s.path, "movie_path.mp4", "thumb_path.png")
+        self.assertEqual(
+            q.annotateLastRun(s.path, "movie_path.mp4", "thumb_path.png"), r
+        )
         r = Run.get(id=r.id)
         self.assertEqual(r.movie_path, "movie_path.mp4")
         self.assertEqual(r.thumb_path, "thumb_path.png")
@@ -481,3 +725,97 @@ class TestAutomation(AutomationDBTest):
         )
         with self.assertRaises(Exception):
             q.genEventScript(e, lambda cond: dict(bar="baz"))
+
+
+class TestJobRanks(QueuesDBTest):
+    NUM_JOBS = 200
+
+    def setUp(self):
+        super().setUp()
+        self.other = Queue.create(name="other", strategy="LINEAR", rank=5)
+        for qq in (self.q, self.other):
+            Job.insert_many(
+                [dict(queue=qq, name=f"j{i}", rank=i) for i in range(self.NUM_JOBS)]
+            ).execute()
+        self.ids = [j.id for j in Job.select().where(Job.queue == self.q)]
+
+    def order(self):
+        return [
+            j.id for j in Job.select().where(Job.queue == self.q).order_by(Job.rank)
+        ]
+
+    def changes(self):
+        return DB.queues.execute_sql("SELECT total_changes()").fetchone()[0]
+
+    def testMovesFollowDestination(self):
+        want = list(self.ids)
+        for src, dest in [(1, 5), (7, None), (3, 200), (200, 100)]:
+            q.moveJob(src, dest)
+            want.remove(src)
+            want.insert(0 if dest is None else want.index(dest) + 1, src)
+            self.assertEqual(self.order(), want)
+
+    def testRepeatedMovesIntoSameGapRebalanceLocally(self):
+        # Each move splits the same gap in half, eventually exhausting float precision
+        otherRanks = [j.rank for j in Job.select().where(Job.queue == self.other)]
+        want = list(self.ids)
+        start = self.changes()
+        for i in range(100):
+            src = want[-1]
+            q.moveJob(src, want[100])
+            want.remove(src)
+            want.insert(101, src)
+        self.assertEqual(self.order(), want)
+        # Rebalancing only touches a window of neighbors rather than the whole queue
+        self.assertLess(self.changes() - start, 100 * 4)
+        self.assertEqual(
+            [j.rank for j in Job.select().where(Job.queue == self.other)], otherRanks
+        )
+
+    def testRankBalanceWidensWindow(self):
+        # All jobs share almost the same rank; spreading them needs the whole queue
+        for jid in self.ids:
+            Job.update(rank=5 + jid * 1e-9).where(Job.id == jid).execute()
+        n = q._rankBalance(self.q.id, Job.get(id=100).rank, None)
+        self.assertEqual(n, self.NUM_JOBS)
+        self.assertEqual(self.order(), self.ids)
+        ranks = [j.rank for j in Job.select().where(Job.queue == self.q)]
+        self.assertEqual(min(b - a for a, b in zip(ranks, ranks[1:])), q.RANK_GAP)
+
+    def testSetRanksBatched(self):
+        ranks = dict((jid, -jid) for jid in self.ids)
+        with patch.object(q, "RANK_UPDATE_BATCH", 7):
+            q._setRanks(ranks)
+        self.assertEqual(self.order(), self.ids[::-1])
+
+    def testReorderJobsWritesOnlyMoved(self):
+        Job.update(rank=Job.rank * 100).where(Job.queue == self.q).execute()
+        other = [j.rank for j in Job.select().where(Job.queue == self.other)]
+        start = self.changes()
+        q.reorderJobs(DEFAULT_QUEUE, [50, 10, 30], after_id=100)
+        self.assertEqual(self.changes() - start, 3)
+        want = [i for i in self.ids if i not in (50, 10, 30)]
+        want[want.index(100) + 1 : want.index(100) + 1] = [50, 10, 30]
+        self.assertEqual(self.order(), want)
+        self.assertEqual(
+            [j.rank for j in Job.select().where(Job.queue == self.other)], other
+        )
+
+    def testReorderJobsRespreadsWhenCrowded(self):
+        # Ranks of adjacent jobs are 1 apart - too close to fit 5 jobs between
+        want = [i for i in self.ids if i not in range(1, 6)]
+        want[want.index(100) + 1 : want.index(100) + 1] = [5, 4, 3, 2, 1]
+        q.reorderJobs(DEFAULT_QUEUE, [5, 4, 3, 2, 1], after_id=100)
+        self.assertEqual(self.order(), want)
+
+    def testReorderJobsInvalid(self):
+        otherJob = Job.get(queue=self.other).id
+        for (job_ids, after_id) in [
+            ([1, 1], None),
+            ([otherJob], None),
+            ([1], 1),
+            ([1], otherJob),
+        ]:
+            with self.subTest(job_ids=job_ids, after_id=after_id):
+                with self.assertRaises(ValueError):
+                    q.reorderJobs(DEFAULT_QUEUE, job_ids, after_id)
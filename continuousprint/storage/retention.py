@@ -0,0 +1,140 @@
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from peewee import fn
+
+from .database import Job, Run, Queue, DB, ARCHIVE_QUEUE
+
+# Rows deleted per transaction - small enough that the queue DB write lock is
+# only held briefly, so the driver and UI aren't stalled behind a large purge.
+RETENTION_BATCH = 200
+BATCH_PAUSE = 0.05  # Seconds between batches, to let other writers in
+
+
+def _cutoff(days, now):
+    if not days:
+        return None
+    return now - timedelta(days=days)
+
+
+def expiredRunIds(max_age_days=0, max_count=0, now=None):
+    """Returns ids of finished runs older than `max_age_days`, or beyond the newest
+    `max_count` runs. A limit of 0 disables that policy."""
+    now = now or datetime.now()
+    ids = set()
+    cutoff = _cutoff(max_age_days, now)
+    if cutoff is not None:
+        ids |= set(
+            r.id
+            for r in Run.select(Run.id).where(
+                Run.end.is_null(False) & (Run.start < cutoff)
+            )
+        )
+    if max_count:
+        ids |= set(
+            r.id
+            for r in Run.select(Run.id)
+            .where(Run.end.is_null(False))
+            .order_by(Run.start.desc(), Run.id.desc())
+            .offset(max_count)
+        )
+    return sorted(ids)
+
+
+def expiredArchivedJobIds(max_age_days=0, max_count=0, now=None):
+    """Returns ids of archived jobs archived more than `max_age_days` ago, or beyond
+    the `max_count` most recently archived. A limit of 0 disables that policy."""
+    now = now or datetime.now()
+    archived = fn.COALESCE(Job.archived, Job.created)
+    base = Job.select(Job.id).join(Queue).where(Queue.name == ARCHIVE_QUEUE)
+    ids = set()
+    cutoff = _cutoff(max_age_days, now)
+    if cutoff is not None:
+        ids |= set(j.id for j in base.where(archived < cutoff))
+    if max_count:
+        ids |= set(
+            j.id
+            for j in base.order_by(archived.desc(), Job.id.desc()).offset(max_count)
+        )
+    return sorted(ids)
+
+
+def _batches(ids, batch):
+    for i in range(0, len(ids), batch):
+        yield ids[i : i + batch]
+
+
+def _purge(ids, export, fetch, delete, batch, pause):
+    n = 0
+    for chunk in _batches(ids, batch):
+        with DB.queues.atomic():
+            if export is not None:
+                for row in fetch(chunk):
+                    export.write(json.dumps(row, default=str) + "\n")
+            n += delete(chunk)
+        time.sleep(pause)
+    return n
+
+
+def _runRows(ids):
+    return [r.as_dict() for r in Run.select().where(Run.id.in_(ids))]
+
+
+def _deleteRuns(ids):
+    return Run.delete().where(Run.id.in_(ids)).execute()
+
+
+def _jobRows(ids):
+    rows = []
+    for j in Job.select().where(Job.id.in_(ids)):
+        d = j.as_dict()
+        d["archived"] = j.archived
+        rows.append(d)
+    return rows
+
+
+def _deleteJobs(ids):
+    # Sets (and their profile index) are removed via ON DELETE CASCADE
+    return Job.delete().where(Job.id.in_(ids)).execute()
+
+
+def applyRetention(
+    run_days=0,
+    max_runs=0,
+    archive_days=0,
+    max_archived=0,
+    export_dir=None,
+    now=None,
+    batch=RETENTION_BATCH,
+    pause=BATCH_PAUSE,
+):
+    """Deletes runs and archived jobs (with their sets) which fall outside the given
+    policies, in batches. If `export_dir` is set, expired rows are first appended
+    to gzipped JSON-lines files there, one per table per invocation.
+
+    Run statistics are kept in the RunStats rollup and are not affected."""
+    now = now or datetime.now()
+    result = dict(runs_deleted=0, jobs_deleted=0, exported=[])
+    for (name, ids, fetch, delete) in (
+        ("runs", expiredRunIds(run_days, max_runs, now), _runRows, _deleteRuns),
+        (
+            "jobs",
+            expiredArchivedJobIds(archive_days, max_archived, now),
+            _jobRows,
+            _deleteJobs,
+        ),
+    ):
+        if len(ids) == 0:
+            continue
+        if export_dir is None:
+            n = _purge(ids, None, fetch, delete, batch, pause)
+        else:
+            Path(export_dir).mkdir(parents=True, exist_ok=True)
+            path = Path(export_dir) / f"{name}-{now.strftime('%Y%m%d-%H%M%S')}.jsonl.gz"
+            with gzip.open(path, "at") as f:
+                n = _purge(ids, f, fetch, delete, batch, pause)
+            result["exported"].append(str(path))
+        result[f"{name}_deleted"] = n
+    return result
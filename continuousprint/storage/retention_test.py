@@ -0,0 +1,97 @@
+import datetime
+import gzip
+import json
+import tempfile
+from pathlib import Path
+
+from .database import Job, Set, SetProfile, Run, RunStats, DEFAULT_QUEUE
+from .database_test import QueuesDBTest
+from ..storage import queries as q
+from . import retention as r
+
+NOW = datetime.datetime(2022, 6, 1)
+
+
+class TestRetention(QueuesDBTest):
+    def setUp(self):
+        super().setUp()
+        for days_ago in (100, 50, 10, 1):
+            start = NOW - datetime.timedelta(days=days_ago)
+            Run.create(
+                queueName=DEFAULT_QUEUE,
+                jobName="j1",
+                path="a.gcode",
+                start=start,
+                end=start + datetime.timedelta(hours=1),
+                result="success",
+            )
+        # Unfinished runs are never expired
+        Run.create(
+            queueName=DEFAULT_QUEUE,
+            jobName="j2",
+            path="a.gcode",
+            start=NOW - datetime.timedelta(days=200),
+        )
+
+        for i in range(3):
+            q.appendSet(
+                DEFAULT_QUEUE,
+                "",
+                dict(path=f"{i}.gcode", sd=False, material="", count=1, profiles=["p"]),
+            )
+        q.remove(job_ids=[1, 2, 3])
+        for i, days_ago in enumerate((60, 20, 5)):
+            Job.update(archived=NOW - datetime.timedelta(days=days_ago)).where(
+                Job.id == i + 1
+            ).execute()
+
+    def testNoPolicyKeepsEverything(self):
+        self.assertEqual(r.expiredRunIds(now=NOW), [])
+        self.assertEqual(r.expiredArchivedJobIds(now=NOW), [])
+        got = r.applyRetention(now=NOW, pause=0)
+        self.assertEqual(got, dict(runs_deleted=0, jobs_deleted=0, exported=[]))
+
+    def testExpiredRunIds(self):
+        self.assertEqual(r.expiredRunIds(max_age_days=30, now=NOW), [1, 2])
+        self.assertEqual(r.expiredRunIds(max_count=1, now=NOW), [1, 2, 3])
+        self.assertEqual(r.expiredRunIds(max_age_days=75, max_count=3, now=NOW), [1])
+
+    def testExpiredArchivedJobIds(self):
+        self.assertEqual(r.expiredArchivedJobIds(max_age_days=30, now=NOW), [1])
+        self.assertEqual(r.expiredArchivedJobIds(max_count=1, now=NOW), [1, 2])
+
+    def testExpiredArchivedJobIdsIgnoresActiveQueue(self):
+        j = q.newEmptyJob(DEFAULT_QUEUE)
+        Job.update(created=NOW - datetime.timedelta(days=365)).where(
+            Job.id == j.id
+        ).execute()
+        self.assertNotIn(j.id, r.expiredArchivedJobIds(max_age_days=1, now=NOW))
+
+    def testApplyRetentionBatched(self):
+        got = r.applyRetention(run_days=30, max_archived=1, now=NOW, batch=1, pause=0)
+        self.assertEqual(got, dict(runs_deleted=2, jobs_deleted=2, exported=[]))
+        self.assertEqual([x.id for x in Run.select().order_by(Run.id)], [3, 4, 5])
+        self.assertEqual([x.id for x in Job.select()], [3])
+        self.assertEqual(Set.select().where(Set.job.in_([1, 2])).count(), 0)
+        self.assertEqual(SetProfile.select().count(), 1)
+
+    def testApplyRetentionExports(self):
+        with tempfile.TemporaryDirectory() as td:
+            got = r.applyRetention(
+                run_days=30, archive_days=30, export_dir=td, now=NOW, pause=0
+            )
+            self.assertEqual(len(got["exported"]), 2)
+            with gzip.open(Path(td) / "runs-20220601-000000.jsonl.gz", "rt") as f:
+                runs = [json.loads(line) for line in f]
+            with gzip.open(Path(td) / "jobs-20220601-000000.jsonl.gz", "rt") as f:
+                jobs = [json.loads(line) for line in f]
+        self.assertEqual([x["id"] for x in runs], [1, 2])
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]["sets"][0]["path"], "0.gcode")
+
+    def testApplyRetentionKeepsStats(self):
+        for run in Run.select().where(Run.end.is_null(False)):
+            RunStats.record(run)
+        r.applyRetention(max_runs=1, now=NOW, pause=0)
+        self.assertEqual(Run.select().count(), 2)
+        self.assertEqual(q.getHistoryStats()[0]["runs"], 4)
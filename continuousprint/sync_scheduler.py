@@ -0,0 +1,36 @@
+import time
+from .worker import Worker
+
+
+class SyncScheduler(Worker):
+    """Coalesces UI sync requests so that bursts (e.g. LAN queue gossip) result in a
+    single sync.
+
+    Requests made within `window` seconds of the first pending request are folded
+    together, and the sync function runs on a background thread rather than the
+    caller's thread."""
+
+    def __init__(self, fn, window, logger):
+        super().__init__("Sync", logger, ("requested", "emitted"))
+        self._fn = fn
+        self._window = window
+        self._pending = False
+        self._start()
+
+    def request(self):
+        with self._cv:
+            self._count("requested")
+            self._pending = True
+            self._cv.notify_all()
+
+    def _has_work(self):
+        return self._pending
+
+    def _work(self, item):
+        time.sleep(self._window)  # Let further requests pile up
+        with self._cv:
+            self._pending = False
+        self._fn()
+
+    def _finished(self, item, result):
+        self._count("emitted")
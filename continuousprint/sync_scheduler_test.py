@@ -0,0 +1,32 @@
+import unittest
+import threading
+import logging
+from unittest.mock import MagicMock
+from .sync_scheduler import SyncScheduler
+
+
+class TestSyncScheduler(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.fn = MagicMock(side_effect=lambda: self.release.wait(5))
+        self.s = SyncScheduler(self.fn, 0.05, logging.getLogger())
+        self.addCleanup(self.s.stop)
+        self.addCleanup(self.release.set)
+
+    def testCoalescesBurst(self):
+        self.release.set()
+        for i in range(10):
+            self.s.request()
+        self.assertTrue(self.s.wait_idle(timeout=5))
+        self.fn.assert_called_once()
+        self.assertEqual(self.s.counters(), dict(requested=10, emitted=1))
+
+    def testRequestDuringSyncRunsAgain(self):
+        self.s.request()
+        while not self.fn.called:
+            self.release.wait(0.01)
+        self.s.request()  # Arrives while the first sync is still running
+        self.release.set()
+        self.assertTrue(self.s.wait_idle(timeout=5))
+        self.assertEqual(self.fn.call_count, 2)
+        self.assertEqual(self.s.counters(), dict(requested=2, emitted=2))
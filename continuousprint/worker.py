@@ -0,0 +1,85 @@
+import threading
+import traceback
+
+
+class Worker:
+    """Runs work handed to it on a daemon thread.
+
+    Subclasses hold their state under `_cv` and only decide what to run and when:
+    `_has_work()` says whether anything is left to do, `_ready()` whether it can be
+    run yet (waiting up to `_timeout()` seconds before asking again), `_take()`
+    claims it, `_work()` runs it without the lock held and `_finished()` records the
+    result. Exceptions from `_work()` are logged and don't stop the thread.
+
+    Subclasses call `_start()` once their own state is set up."""
+
+    def __init__(self, name, logger, counters):
+        self._name = name
+        self._logger = logger
+        self._counters = dict((k, 0) for k in counters)
+        self._cv = threading.Condition()
+        self._running = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _start(self):
+        self._thread.start()
+
+    def counters(self) -> dict:
+        with self._cv:
+            return dict(self._counters)
+
+    def wait_idle(self, timeout=None) -> bool:
+        """Blocks until no work is pending or running; returns False on timeout"""
+        with self._cv:
+            return self._cv.wait_for(
+                lambda: not self._running and not self._has_work(), timeout
+            )
+
+    def stop(self):
+        with self._cv:
+            self._stopped = True
+            self._cv.notify_all()
+        self._thread.join()
+
+    def _count(self, k):
+        self._counters[k] += 1
+
+    def _has_work(self) -> bool:
+        raise NotImplementedError
+
+    def _ready(self) -> bool:
+        return self._has_work()
+
+    def _timeout(self):
+        return None
+
+    def _take(self):
+        pass
+
+    def _work(self, item):
+        raise NotImplementedError
+
+    def _finished(self, item, result):
+        pass
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not (self._stopped or self._ready()):
+                    self._cv.wait(self._timeout())
+                if self._stopped:
+                    return
+                item = self._take()
+                self._running = True
+
+            result = None
+            try:
+                result = self._work(item)
+            except Exception:
+                self._logger.error(f"{self._name} failed: {traceback.format_exc()}")
+
+            with self._cv:
+                self._running = False
+                self._finished(item, result)
+                self._cv.notify_all()
@@ -0,0 +1,66 @@
+import unittest
+import threading
+import logging
+from .worker import Worker
+
+
+class FakeWorker(Worker):
+    """Runs each submitted callable in turn"""
+
+    def __init__(self):
+        super().__init__("Fake", logging.getLogger(), ("submitted", "done"))
+        self._queue = []
+        self._start()
+
+    def submit(self, fn):
+        with self._cv:
+            self._count("submitted")
+            self._queue.append(fn)
+            self._cv.notify_all()
+
+    def _has_work(self):
+        return len(self._queue) > 0
+
+    def _take(self):
+        return self._queue.pop(0)
+
+    def _work(self, item):
+        return item()
+
+    def _finished(self, item, result):
+        self._count("done")
+
+
+class TestWorker(unittest.TestCase):
+    def setUp(self):
+        self.w = FakeWorker()
+        self.addCleanup(self.w.stop)
+
+    def testRunsOnWorkerThread(self):
+        ran = []
+        self.w.submit(lambda: ran.append(threading.current_thread()))
+        self.assertTrue(self.w.wait_idle(timeout=5))
+        self.assertEqual(ran, [self.w._thread])
+        self.assertEqual(self.w.counters(), dict(submitted=1, done=1))
+
+    def testExceptionDoesNotStopWorker(self):
+        def fail():
+            raise Exception("testing")
+
+        self.w.submit(fail)
+        self.assertTrue(self.w.wait_idle(timeout=5))
+        self.w.submit(lambda: None)
+        self.assertTrue(self.w.wait_idle(timeout=5))
+        self.assertEqual(self.w.counters(), dict(submitted=2, done=2))
+
+    def testWaitIdleTimesOut(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.w.submit(lambda: release.wait(5))
+        self.assertFalse(self.w.wait_idle(timeout=0.05))
+        release.set()
+        self.assertTrue(self.w.wait_idle(timeout=5))
+
+    def testStopEndsThread(self):
+        self.w.stop()
+        self.assertFalse(self.w._thread.is_alive())